@@ -1,10 +1,16 @@
-import xml.etree.ElementTree as ElementTree
+import sys
+from typing import Iterator, Optional
+from xml.parsers import expat
 
+from apkcomparator.data import ManifestDifference, ManifestSection
 from utils.stringify import stringify
 
+ANDROID_NAMESPACE = 'http://schemas.android.com/apk/res/android'
+ANDROID_PREFIX = 'android'
+
 
 def namespaced(attr):
-    return '{http://schemas.android.com/apk/res/android}' + attr
+    return '{' + ANDROID_NAMESPACE + '}' + attr
 
 
 TAG_MANIFEST = 'manifest'
@@ -20,28 +26,64 @@ TAG_USES_PERMISSION_SDK_23 = 'uses-permission-sdk-23'
 TAG_USES_SDK = 'uses-sdk'
 ATTR_NAMESPACED_NAME = namespaced('name')
 
+# Child tag -> set attribute collecting android:name of such children
+_MANIFEST_NAME_TAGS = {
+    TAG_PERMISSION: 'permissions',
+    TAG_USES_FEATURE: 'uses_features',
+    TAG_USES_PERMISSION: 'uses_permissions',
+    TAG_USES_PERMISSION_SDK_23: 'uses_permissions_sdk_23',
+    TAG_SUPPORTS_GL_TEXTURE: 'supports_gl_texture',
+}
+_APPLICATION_NAME_TAGS = {
+    'service': 'services',
+    'activity': 'activities',
+    'activity-alias': 'activity_aliases',
+    'provider': 'providers',
+    'receiver': 'receivers',
+    'meta-data': 'meta_datas',
+}
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    return None if value is None else sys.intern(value)
+
 
-def _compare_and_print(lhs: object, rhs: object, description: str, lines: list[str]):
+def _add_name(names: set[str], attrib: dict[str, str], key: str):
+    name = attrib.get(key)
+    if name:
+        names.add(sys.intern(name))
+
+
+def _diff(lhs: object, rhs: object, description: str) -> Iterator[ManifestDifference]:
     if isinstance(lhs, set) and isinstance(rhs, set):
         if lhs != rhs:
-            lines.append('Different {}:'.format(description))
-            added = rhs - lhs
-            removed = lhs - rhs
-            if added:
-                lines.append('\tAdded: {}'.format(' '.join(list(added))))
-            if removed:
-                lines.append('\tRemoved: {}'.format(' '.join(list(removed))))
+            yield ManifestDifference(description=description, was=None, now=None,
+                                     added=sorted(rhs - lhs), removed=sorted(lhs - rhs))
     elif lhs != rhs:
-        lines.append('Different {}:\n\tWas: {}\n\tNow: {}'.format(description, lhs, rhs))
+        yield ManifestDifference(description=description, was=lhs, now=rhs, added=None, removed=None)
+
 
+def format_difference(difference: ManifestDifference) -> Iterator[str]:
+    if difference.added is None and difference.removed is None:
+        yield 'Different {}:\n\tWas: {}\n\tNow: {}'.format(difference.description, difference.was, difference.now)
+        return
+    yield 'Different {}:'.format(difference.description)
+    if difference.added:
+        yield '\tAdded: {}'.format(' '.join(difference.added))
+    if difference.removed:
+        yield '\tRemoved: {}'.format(' '.join(difference.removed))
 
-def _parse_names_by_tag(tree: ElementTree.Element, tag: str):
-    result = set()
-    for element in tree.findall(tag):
-        name = element.attrib.get(ATTR_NAMESPACED_NAME, None)
-        if name:
-            result.add(name)
-    return result
+
+def iter_manifest_section(section: ManifestSection) -> Iterator[str]:
+    if section.error:
+        yield section.error
+        return
+    for difference in section.differences:
+        yield from format_difference(difference)
+    if len(section.manual_checks) > 0:
+        yield 'Manually check these sections:'
+        for manual_check in section.manual_checks:
+            yield '    {}'.format(manual_check)
 
 
 @stringify
@@ -49,31 +91,27 @@ class Application(object):
     #
     # https://developer.android.com/guide/topics/manifest/manifest-element
     #
-    services = None
-    activities = None
-    activity_aliases = None
-    providers = None
-    receivers = None
-    meta_datas = None
-
-    def __init__(self, tree: ElementTree.Element):
-        if tree.tag != TAG_APPLICATION:
-            raise RuntimeError(
-                'Expected <{}> as root tag'.format(TAG_APPLICATION))
-        self.services = _parse_names_by_tag(tree, 'service')
-        self.activities = _parse_names_by_tag(tree, 'activity')
-        self.activity_aliases = _parse_names_by_tag(tree, 'activity-alias')
-        self.providers = _parse_names_by_tag(tree, 'provider')
-        self.receivers = _parse_names_by_tag(tree, 'receiver')
-        self.meta_datas = _parse_names_by_tag(tree, 'meta-data')
+    __slots__ = ('services', 'activities', 'activity_aliases', 'providers', 'receivers', 'meta_datas')
+
+    def __init__(self):
+        self.services = set()
+        self.activities = set()
+        self.activity_aliases = set()
+        self.providers = set()
+        self.receivers = set()
+        self.meta_datas = set()
+
+    def iter_differences(self, other) -> Iterator[ManifestDifference]:
+        yield from _diff(self.services, other.services, 'services')
+        yield from _diff(self.activities, other.activities, 'activities')
+        yield from _diff(self.activity_aliases, other.activity_aliases, 'activity-aliases')
+        yield from _diff(self.providers, other.providers, 'content providers')
+        yield from _diff(self.receivers, other.receivers, 'broadcast receivers')
+        yield from _diff(self.meta_datas, other.meta_datas, 'meta-datas')
 
     def print_diff(self, other, lines):
-        _compare_and_print(self.services, other.services, 'services', lines)
-        _compare_and_print(self.activities, other.activities, 'activities', lines)
-        _compare_and_print(self.activity_aliases, other.activity_aliases, 'activity-aliases', lines)
-        _compare_and_print(self.providers, other.providers, 'content providers', lines)
-        _compare_and_print(self.receivers, other.receivers, 'broadcast receivers', lines)
-        _compare_and_print(self.meta_datas, other.meta_datas, 'meta-datas', lines)
+        for difference in self.iter_differences(other):
+            lines.extend(format_difference(difference))
 
 
 @stringify
@@ -81,43 +119,38 @@ class SupportsScreens(object):
     #
     # https://developer.android.com/guide/topics/manifest/supports-screens-element
     #
-    resizeable = None
-    small_screens = None
-    normal_screens = None
-    large_screens = None
-    xlarge_screens = None
-    any_density = None
-    requires_smallest_width_dp = None
-    compatible_width_limit_dp = None
-    largest_width_limit_dp = None
-
-    def __init__(self, tree: ElementTree.Element):
-        if tree.tag != TAG_SUPPORTS_SCREENS:
-            raise RuntimeError(
-                'Expected <{}> as root tag'.format(TAG_SUPPORTS_SCREENS))
-        self.resizeable = tree.attrib.get(namespaced('resizeable'), None)
-        self.small_screens = tree.attrib.get(namespaced('smallScreens'), None)
-        self.normal_screens = tree.attrib.get(namespaced('normalScreens'), None)
-        self.large_screens = tree.attrib.get(namespaced('largeScreens'), None)
-        self.xlarge_screens = tree.attrib.get(namespaced('xlargeScreens'), None)
-        self.any_density = tree.attrib.get(namespaced('anyDensity'), None)
-        self.requires_smallest_width_dp = tree.attrib.get(namespaced('requiresSmallestWidthDp'), None)
-        self.compatible_width_limit_dp = tree.attrib.get(namespaced('compatibleWidthLimitDp'), None)
-        self.largest_width_limit_dp = tree.attrib.get(namespaced('largestWidthLimitDp'), None)
+    __slots__ = ('resizeable', 'small_screens', 'normal_screens', 'large_screens', 'xlarge_screens',
+                 'any_density', 'requires_smallest_width_dp', 'compatible_width_limit_dp',
+                 'largest_width_limit_dp')
+
+    def __init__(self, attrib: dict[str, str]):
+        self.resizeable = _intern(attrib.get(namespaced('resizeable')))
+        self.small_screens = _intern(attrib.get(namespaced('smallScreens')))
+        self.normal_screens = _intern(attrib.get(namespaced('normalScreens')))
+        self.large_screens = _intern(attrib.get(namespaced('largeScreens')))
+        self.xlarge_screens = _intern(attrib.get(namespaced('xlargeScreens')))
+        self.any_density = _intern(attrib.get(namespaced('anyDensity')))
+        self.requires_smallest_width_dp = _intern(attrib.get(namespaced('requiresSmallestWidthDp')))
+        self.compatible_width_limit_dp = _intern(attrib.get(namespaced('compatibleWidthLimitDp')))
+        self.largest_width_limit_dp = _intern(attrib.get(namespaced('largestWidthLimitDp')))
+
+    def iter_differences(self, other) -> Iterator[ManifestDifference]:
+        yield from _diff(self.resizeable, other.resizeable, 'resizable')
+        yield from _diff(self.small_screens, other.small_screens, 'smallScreens')
+        yield from _diff(self.normal_screens, other.normal_screens, 'normalScreens')
+        yield from _diff(self.large_screens, other.large_screens, 'largeScreens')
+        yield from _diff(self.xlarge_screens, other.xlarge_screens, 'xlargeScreens')
+        yield from _diff(self.any_density, other.any_density, 'anyDensity')
+        yield from _diff(self.requires_smallest_width_dp, other.requires_smallest_width_dp,
+                         'requiresSmallestWidthDp')
+        yield from _diff(self.compatible_width_limit_dp, other.compatible_width_limit_dp,
+                         'compatibleWidthLimitDp')
+        yield from _diff(self.largest_width_limit_dp, other.largest_width_limit_dp,
+                         'largestWidthLimitDp')
 
     def print_diff(self, other, lines: list[str]):
-        _compare_and_print(self.resizeable, other.resizeable, 'resizable', lines)
-        _compare_and_print(self.small_screens, other.small_screen, 'smallScreens', lines)
-        _compare_and_print(self.normal_screens, other.normal_screens, 'normalScreens', lines)
-        _compare_and_print(self.large_screens, other.large_screens, 'largeScreens', lines)
-        _compare_and_print(self.xlarge_screens, other.xlarge_screens, 'xlargeScreens', lines)
-        _compare_and_print(self.any_density, other.any_density, 'anyDensity', lines)
-        _compare_and_print(self.requires_smallest_width_dp, other.requires_smallest_width_dp,
-                           'requiresSmallestWidthDp', lines)
-        _compare_and_print(self.compatible_width_limit_dp, other.compatible_width_limit_dp,
-                           'compatibleWidthLimitDp', lines)
-        _compare_and_print(self.largest_width_limit_dp, other.largest_width_limit_dp,
-                           'largestWidthLimitDp', lines)
+        for difference in self.iter_differences(other):
+            lines.extend(format_difference(difference))
 
 
 @stringify
@@ -125,23 +158,21 @@ class CompatibleScreens(object):
     #
     # https://developer.android.com/guide/topics/manifest/manifest-element
     #
-    screens = None
+    __slots__ = ('screens',)
 
-    def __init__(self, tree: ElementTree.Element):
-        if tree.tag != TAG_COMPATIBLE_SCREENS:
-            raise RuntimeError(
-                'Expected <{}> as root tag'.format(TAG_COMPATIBLE_SCREENS))
+    def __init__(self):
+        self.screens = set()
 
-        _set = set()
-        for element in tree.findall('screen'):
-            size = element.attrib.get(namespaced('screenSize'), None)
-            density = element.attrib.get(namespaced('screenDensity'), None)
-            _set.add('{}-{}'.format(size, density))
+    def add_screen(self, attrib: dict[str, str]):
+        self.screens.add(sys.intern('{}-{}'.format(
+            attrib.get(namespaced('screenSize')), attrib.get(namespaced('screenDensity')))))
 
-        self.screens = _set
+    def iter_differences(self, other) -> Iterator[ManifestDifference]:
+        yield from _diff(self.screens, other.screens, TAG_COMPATIBLE_SCREENS)
 
     def print_diff(self, other, lines: list[str]):
-        _compare_and_print(self.screens, other.screens, TAG_COMPATIBLE_SCREENS, lines)
+        for difference in self.iter_differences(other):
+            lines.extend(format_difference(difference))
 
 
 @stringify
@@ -149,22 +180,21 @@ class UsesSdk(object):
     #
     # https://developer.android.com/guide/topics/manifest/uses-sdk-element
     #
-    min_sdk = None
-    target_sdk = None
-    max_sdk = None
-
-    def __init__(self, tree: ElementTree.Element):
-        if tree.tag != TAG_USES_SDK:
-            raise RuntimeError(
-                'Expected <{}> as root tag'.format(TAG_USES_SDK))
-        self.min_sdk = tree.attrib.get(namespaced('minSdkVersion'), None)
-        self.target_sdk = tree.attrib.get(namespaced('targetSdkVersion'), None)
-        self.max_sdk = tree.attrib.get(namespaced('maxSdkVersion'), None)
+    __slots__ = ('min_sdk', 'target_sdk', 'max_sdk')
+
+    def __init__(self, attrib: dict[str, str]):
+        self.min_sdk = _intern(attrib.get(namespaced('minSdkVersion')))
+        self.target_sdk = _intern(attrib.get(namespaced('targetSdkVersion')))
+        self.max_sdk = _intern(attrib.get(namespaced('maxSdkVersion')))
+
+    def iter_differences(self, other) -> Iterator[ManifestDifference]:
+        yield from _diff(self.min_sdk, other.min_sdk, 'min sdk')
+        yield from _diff(self.target_sdk, other.target_sdk, 'target sdk')
+        yield from _diff(self.max_sdk, other.max_sdk, 'max sdk')
 
     def print_diff(self, other, lines: list[str]):
-        _compare_and_print(self.min_sdk, other.min_sdk, 'min sdk', lines)
-        _compare_and_print(self.target_sdk, other.target_sdk, 'target sdk', lines)
-        _compare_and_print(self.max_sdk, other.max_sdk, 'max sdk', lines)
+        for difference in self.iter_differences(other):
+            lines.extend(format_difference(difference))
 
 
 @stringify
@@ -172,80 +202,53 @@ class Manifest(object):
     #
     # https://developer.android.com/guide/topics/manifest/manifest-element
     #
-    package = None
-    shared_user_id = None
-    shared_user_label = None
-    version_code = None
-    version_name = None
-    install_location = None
-    application = None
-    compatible_screens = None
-    permissions = None
-    supports_gl_texture = None
-    supports_screens = None
-    uses_features = None
-    uses_permissions = None
-    uses_permissions_sdk_23 = None
-    uses_sdk = None
-    # Optionals for manual check
-    has_uses_configuration = False
-
-    def __init__(self, tree: ElementTree.Element):
-        if tree.tag != TAG_MANIFEST:
-            raise RuntimeError(
-                'Expected <{}> as root tag'.format(TAG_MANIFEST))
-
-        self.package = tree.attrib['package']
-        self.version_code = tree.attrib.get(namespaced('versionCode'))
-        self.version_name = tree.attrib.get(namespaced('versionName'))
-        self.shared_user_id = tree.attrib.get(namespaced('sharedUserId'), None)
-        self.shared_user_label = tree.attrib.get(namespaced('sharedUserLabel'), None)
-        self.install_location = tree.attrib.get(namespaced('installLocation'), None)
-        self.permissions = _parse_names_by_tag(tree, TAG_PERMISSION)
-        self.uses_features = _parse_names_by_tag(tree, TAG_USES_FEATURE)
-        self.uses_permissions = _parse_names_by_tag(tree, TAG_USES_PERMISSION)
-        self.uses_permissions_sdk_23 = _parse_names_by_tag(tree, TAG_USES_PERMISSION_SDK_23)
-        self.supports_gl_texture = _parse_names_by_tag(tree, TAG_SUPPORTS_GL_TEXTURE)
-        self.application = Application(tree.find(TAG_APPLICATION))
-
-        uses_sdk_tree = tree.find(TAG_USES_SDK)
-        if uses_sdk_tree is None:
-            self.uses_sdk = None
-        else:
-            self.uses_sdk = UsesSdk(uses_sdk_tree)
-
-        supports_screens_tree = tree.find(TAG_SUPPORTS_SCREENS)
-        if supports_screens_tree is None:
-            self.supports_screens = None
-        else:
-            self.supports_screens = SupportsScreens(supports_screens_tree)
-
-        compatible_screens_tree = tree.find(TAG_COMPATIBLE_SCREENS)
-        if compatible_screens_tree is None:
-            self.compatible_screens = None
-        else:
-            self.compatible_screens = CompatibleScreens(compatible_screens_tree)
-
-        self.has_uses_configuration = tree.find(TAG_USES_CONFIGURATION) is not None
-
-    def print_diff(self, other):
-        lines = []
+    __slots__ = ('package', 'shared_user_id', 'shared_user_label', 'version_code', 'version_name',
+                 'install_location', 'application', 'compatible_screens', 'permissions', 'supports_gl_texture',
+                 'supports_screens', 'uses_features', 'uses_permissions', 'uses_permissions_sdk_23', 'uses_sdk',
+                 # Optionals for manual check
+                 'has_uses_configuration')
+
+    def __init__(self, attrib: dict[str, str]):
+        if 'package' not in attrib:
+            raise RuntimeError('<{}> has no package'.format(TAG_MANIFEST))
+        self.package = _intern(attrib['package'])
+        self.version_code = _intern(attrib.get(namespaced('versionCode')))
+        self.version_name = _intern(attrib.get(namespaced('versionName')))
+        self.shared_user_id = _intern(attrib.get(namespaced('sharedUserId')))
+        self.shared_user_label = _intern(attrib.get(namespaced('sharedUserLabel')))
+        self.install_location = _intern(attrib.get(namespaced('installLocation')))
+        self.permissions = set()
+        self.uses_features = set()
+        self.uses_permissions = set()
+        self.uses_permissions_sdk_23 = set()
+        self.supports_gl_texture = set()
+        self.application = None
+        self.uses_sdk = None
+        self.supports_screens = None
+        self.compatible_screens = None
+        self.has_uses_configuration = False
+
+    def diff(self, other) -> ManifestSection:
         manual_checks = []
-        _compare_and_print(self.package, other.package, 'package', lines)
-        _compare_and_print(self.shared_user_id, other.shared_user_id, 'sharedUserId', lines)
-        _compare_and_print(self.shared_user_label, other.shared_user_label, 'sharedUserLabel', lines)
-        _compare_and_print(self.version_code, other.version_code, 'versionCode', lines)
-        _compare_and_print(self.version_name, other.version_name, 'versionName', lines)
-        _compare_and_print(self.install_location, other.install_location, 'installLocation', lines)
-        _compare_and_print(self.permissions, other.permissions, TAG_PERMISSION, lines)
-        _compare_and_print(self.uses_features, other.uses_features, TAG_USES_FEATURE, lines)
-        _compare_and_print(self.uses_permissions, other.uses_permissions, TAG_USES_PERMISSION, lines)
-        _compare_and_print(self.uses_permissions_sdk_23, other.uses_permissions_sdk_23, TAG_USES_PERMISSION_SDK_23,
-                           lines)
-        _compare_and_print(self.supports_gl_texture, other.supports_gl_texture, TAG_SUPPORTS_GL_TEXTURE, lines)
+        differences = list(self._iter_differences(other, manual_checks))
+        return ManifestSection(error=None, differences=differences, manual_checks=manual_checks)
+
+    def _iter_differences(self, other, manual_checks: list[str]) -> Iterator[ManifestDifference]:
+        yield from _diff(self.package, other.package, 'package')
+        yield from _diff(self.shared_user_id, other.shared_user_id, 'sharedUserId')
+        yield from _diff(self.shared_user_label, other.shared_user_label, 'sharedUserLabel')
+        yield from _diff(self.version_code, other.version_code, 'versionCode')
+        yield from _diff(self.version_name, other.version_name, 'versionName')
+        yield from _diff(self.install_location, other.install_location, 'installLocation')
+        yield from _diff(self.permissions, other.permissions, TAG_PERMISSION)
+        yield from _diff(self.uses_features, other.uses_features, TAG_USES_FEATURE)
+        yield from _diff(self.uses_permissions, other.uses_permissions, TAG_USES_PERMISSION)
+        yield from _diff(self.uses_permissions_sdk_23, other.uses_permissions_sdk_23,
+                         TAG_USES_PERMISSION_SDK_23)
+        yield from _diff(self.supports_gl_texture, other.supports_gl_texture, TAG_SUPPORTS_GL_TEXTURE)
 
         if self.uses_sdk is not None and other.uses_sdk is not None:
-            self.uses_sdk.print_diff(other.uses_sdk, lines)
+            yield from self.uses_sdk.iter_differences(other.uses_sdk)
         elif (self.uses_sdk is not None) != (other.uses_sdk is not None):
             manual_checks.append(TAG_USES_SDK)
 
@@ -253,35 +256,131 @@ class Manifest(object):
             manual_checks.append(TAG_USES_CONFIGURATION)
 
         if self.compatible_screens is not None and other.compatible_screens is not None:
-            self.compatible_screens.print_diff(other.compatible_screens, lines)
+            yield from self.compatible_screens.iter_differences(other.compatible_screens)
         elif (self.compatible_screens is None) != (other.compatible_screens is None):
             manual_checks.append(TAG_COMPATIBLE_SCREENS)
 
         if self.supports_screens is not None and other.supports_screens is not None:
-            self.supports_screens.print_diff(other.supports_screens, lines)
+            yield from self.supports_screens.iter_differences(other.supports_screens)
         elif (self.supports_screens is None) != (other.supports_screens is None):
             manual_checks.append(TAG_SUPPORTS_SCREENS)
 
-        self.application.print_diff(other.application, lines)
+        yield from self.application.iter_differences(other.application)
 
-        if len(manual_checks) > 0:
-            lines.append('Manually check these sections:')
-            for manual_check in manual_checks:
-                lines.append('    {}'.format(manual_check))
-        return '\n'.join(lines)
+    def print_diff(self, other):
+        return '\n'.join(iter_manifest_section(self.diff(other)))
 
 
-def compare_manifests(prev_manifest: str, current_manifest: str) -> str:
+class _ManifestBuilder(object):
+    # Fills the model from expat callbacks in one pass over the document.
+    # Like the former findall() lookups only direct children of <manifest>,
+    # <application> and <compatible-screens> are taken into account.
+    #
+    # Namespace processing of expat costs more than the rest of the parse, so
+    # prefixes are resolved here from the declarations of the root element.
+    __slots__ = ('manifest', '_path', '_prefix', '_name')
+
+    def __init__(self):
+        self.manifest = None
+        self._path = []
+        self._prefix = ANDROID_PREFIX + ':'
+        self._name = self._prefix + 'name'
+
+    def _resolve(self, attrib: dict[str, str]) -> dict[str, str]:
+        prefix = self._prefix
+        return {namespaced(key[len(prefix):]) if key.startswith(prefix) else key: value
+                for key, value in attrib.items()}
+
+    def start(self, tag: str, attrib: dict[str, str]):
+        path = self._path
+        depth = len(path)
+        path.append(tag)
+        # Most elements are intent filters and other deeper nodes
+        if depth > 2:
+            return
+        if depth == 2:
+            self._start_grandchild(tag, attrib)
+        elif depth == 1:
+            self._start_manifest_child(tag, attrib)
+        elif tag != TAG_MANIFEST:
+            raise RuntimeError('Expected <{}> as root tag'.format(TAG_MANIFEST))
+        else:
+            for key, value in attrib.items():
+                if key.startswith('xmlns:') and value == ANDROID_NAMESPACE:
+                    self._prefix = key[len('xmlns:'):] + ':'
+                    self._name = self._prefix + 'name'
+            self.manifest = Manifest(self._resolve(attrib))
+
+    def end(self, tag: str):
+        self._path.pop()
+
+    def _start_manifest_child(self, tag: str, attrib: dict[str, str]):
+        manifest = self.manifest
+        bucket = _MANIFEST_NAME_TAGS.get(tag)
+        if bucket is not None:
+            _add_name(getattr(manifest, bucket), attrib, self._name)
+        elif tag == TAG_APPLICATION:
+            if manifest.application is None:
+                manifest.application = Application()
+            else:
+                # Only the first <application> is compared
+                self._path[-1] = None
+        elif tag == TAG_USES_SDK and manifest.uses_sdk is None:
+            manifest.uses_sdk = UsesSdk(self._resolve(attrib))
+        elif tag == TAG_SUPPORTS_SCREENS and manifest.supports_screens is None:
+            manifest.supports_screens = SupportsScreens(self._resolve(attrib))
+        elif tag == TAG_COMPATIBLE_SCREENS:
+            if manifest.compatible_screens is None:
+                manifest.compatible_screens = CompatibleScreens()
+            else:
+                self._path[-1] = None
+        elif tag == TAG_USES_CONFIGURATION:
+            manifest.has_uses_configuration = True
+
+    def _start_grandchild(self, tag: str, attrib: dict[str, str]):
+        parent = self._path[1]
+        if parent == TAG_APPLICATION:
+            bucket = _APPLICATION_NAME_TAGS.get(tag)
+            if bucket is not None:
+                _add_name(getattr(self.manifest.application, bucket), attrib, self._name)
+        elif parent == TAG_COMPATIBLE_SCREENS and tag == 'screen':
+            self.manifest.compatible_screens.add_screen(self._resolve(attrib))
+
+
+def parse_manifest(manifest: Optional[str]) -> Optional[Manifest]:
+    if not manifest:
+        return None
+    builder = _ManifestBuilder()
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = builder.start
+    parser.EndElementHandler = builder.end
+    try:
+        parser.Parse(manifest.encode(), True)
+    except expat.ExpatError as e:
+        raise RuntimeError('Cannot parse manifest: {}'.format(e))
+    if builder.manifest is None:
+        raise RuntimeError('Expected <{}> as root tag'.format(TAG_MANIFEST))
+    if builder.manifest.application is None:
+        raise RuntimeError('Expected <{}> in <{}>'.format(TAG_APPLICATION, TAG_MANIFEST))
+    return builder.manifest
+
+
+def diff_manifests(prev_manifest: Optional[Manifest], current_manifest: Optional[Manifest]) -> ManifestSection:
+    error = None
     if not prev_manifest and not current_manifest:
-        return 'Cannot get manifests'
-    if not prev_manifest:
-        return 'Cannot get previous version\'s manifest'
-    if not current_manifest:
-        return 'Cannot get current version\'s manifest'
-
-    lhs_tree = ElementTree.ElementTree(ElementTree.fromstring(prev_manifest))
-    lhs_manifest = Manifest(lhs_tree.getroot())
-    rhs_tree = ElementTree.ElementTree(
-        ElementTree.fromstring(current_manifest))
-    rhs_manifest = Manifest(rhs_tree.getroot())
-    return lhs_manifest.print_diff(rhs_manifest)
+        error = 'Cannot get manifests'
+    elif not prev_manifest:
+        error = 'Cannot get previous version\'s manifest'
+    elif not current_manifest:
+        error = 'Cannot get current version\'s manifest'
+    if error:
+        return ManifestSection(error=error, differences=[], manual_checks=[])
+    return prev_manifest.diff(current_manifest)
+
+
+def compare_parsed_manifests(prev_manifest: Optional[Manifest], current_manifest: Optional[Manifest]) -> str:
+    return '\n'.join(iter_manifest_section(diff_manifests(prev_manifest, current_manifest)))
+
+
+def compare_manifests(prev_manifest: str, current_manifest: str) -> str:
+    return compare_parsed_manifests(parse_manifest(prev_manifest), parse_manifest(current_manifest))
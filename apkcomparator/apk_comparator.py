@@ -1,21 +1,85 @@
+import collections
+import functools
 import os.path
+import struct
 import subprocess
-from typing import Optional
+import zlib
+from array import array
+from concurrent.futures import Executor
+from typing import Callable, Iterable, Optional
 
-from apkcomparator.android_manifest_comparator import compare_manifests
+from apkcomparator.android_manifest_comparator import Manifest, diff_manifests, parse_manifest
 from apkcomparator.apk_compare_result_processor import (
-    process_apk_compare_result)
-from apkcomparator.apk_plain_data_comparator import compare_plain_data
-from apkcomparator.data import Apk, ApkCompareReport, ApkPlainData
+    ReportLine, categorize_compare_result, get_report_lines)
+from apkcomparator.apkanalyzer_daemon import run_apkanalyzer
+from apkcomparator.apk_reader import open_archive
+from apkcomparator.binary_xml import decode_xml
+from apkcomparator.budget import Budget, evaluate_budget, get_budget
+from apkcomparator.bundle_comparator import diff_bundles, is_bundle
+from apkcomparator.cache import cache_key, load_analysis, store_analysis
+from apkcomparator.dex_packages_comparator import diff_dex_packages
+from apkcomparator.duplicates import diff_duplicates, entry_contents, find_duplicates, remember_duplicates
+from apkcomparator.download_size import diff_download_sizes, estimate_download_size
+from apkcomparator.dex_reader import DexPackages, count_methods, count_packages
+from apkcomparator.manifest_tree import diff_manifest_trees
+from apkcomparator.native_libs_comparator import diff_native_libraries
+from apkcomparator.patch_size import estimate_patch_size, is_patch_estimation_enabled
+from apkcomparator.resource_table import diff_resource_tables, read_resource_table
+from apkcomparator.zip_differ import diff_archives
+from apkcomparator.data import (
+    Apk, ApkAnalysis, ApkCompareReport, ApkPlainData, BudgetSection, BundleSection, DownloadSizeSection,
+    DuplicateGroup, NativeLibrariesSection, PlainDataSection, ResourcesSection)
+from utils.concurrency import create_executor, remaining_time, subprocess_slot
 from utils.environment import android_tools_bin_dir
+from utils.exceptions import BadApkError
 from utils.logger import log
+from utils.tracing import span, traced
+
+BACKEND_NATIVE = 'native'
+BACKEND_APKANALYZER = 'apkanalyzer'
+BACKENDS = (BACKEND_NATIVE, BACKEND_APKANALYZER)
+
+APKANALYZER = 'apkanalyzer'
+
+MANIFEST_ENTRY = 'AndroidManifest.xml'
+
+# Per-apk analyses, named like their ApkAnalysis fields
+ANALYSIS_PLAIN_DATA = 'plain_data'
+ANALYSIS_MANIFEST = 'manifest'
+ANALYSIS_DEX_PACKAGES = 'dex_packages'
+ANALYSIS_DUPLICATES = 'duplicates'
+ANALYSES = (ANALYSIS_PLAIN_DATA, ANALYSIS_MANIFEST, ANALYSIS_DEX_PACKAGES, ANALYSIS_DUPLICATES)
+
+_backend = BACKEND_NATIVE
+
+
+def set_backend(backend: str):
+    global _backend
+    if backend not in BACKENDS:
+        raise ValueError('Unknown backend {}, expected one of {}'.format(backend, ', '.join(BACKENDS)))
+    _backend = backend
+
+
+def get_backend() -> str:
+    return _backend
 
 
 def call_with_output(command: list[str]):
     output = None
     error = None
+    # Calls of a job with a deadline are killed once it passes
+    if remaining_time() == 0:
+        return None, 'Deadline passed before {} started'.format(os.path.basename(command[0]))
+    if os.path.basename(command[0]) == APKANALYZER:
+        result = run_apkanalyzer(command[1:], remaining_time())
+        if result is not None:
+            rc, stdout, stderr = result
+            if rc == 0:
+                return stdout.decode(), None
+            return None, stderr.decode()
     try:
-        rc = subprocess.run(command, capture_output=True)
+        with subprocess_slot():
+            rc = subprocess.run(command, capture_output=True, timeout=remaining_time())
         if rc.returncode == 0:
             output = rc.stdout.decode()
         else:
@@ -32,13 +96,21 @@ def execute_apkanalyzer(subject: str, verb: str, *args):
     log().info('Executing command: apkanalyzer {subject} {verb} {args}'.format(
         subject=subject, verb=verb, args=' '.join(args)
     ))
-    apkanalyzer = os.path.join(android_tools_bin_dir(), 'apkanalyzer')
+    apkanalyzer = os.path.join(android_tools_bin_dir(), APKANALYZER)
     command = [apkanalyzer, subject, verb]
     command.extend(args)
-    return call_with_output(command)
+    with span('apkanalyzer {} {}'.format(subject, verb), APKANALYZER, subprocess=True, args=' '.join(args)):
+        return call_with_output(command)
 
 
 def get_download_size(apk: Apk) -> int:
+    if _backend == BACKEND_NATIVE:
+        try:
+            with open_archive(apk.apk_path) as archive:
+                return estimate_download_size(archive)
+        except (OSError, BadApkError, zlib.error) as e:
+            log().error('Failed to get download size, error: {}'.format(e))
+            return -1
     output, error = execute_apkanalyzer('apk', 'download-size', apk.apk_path)
     if error:
         log().error('Failed to get download size, error: {}'.format(output))
@@ -47,6 +119,12 @@ def get_download_size(apk: Apk) -> int:
 
 
 def get_file_size(apk: Apk) -> int:
+    if _backend == BACKEND_NATIVE:
+        try:
+            return os.path.getsize(apk.apk_path)
+        except OSError as e:
+            log().error('Failed to get file size, error: {}'.format(e))
+            return -1
     output, error = execute_apkanalyzer('apk', 'file-size', apk.apk_path)
     if error:
         log().error('Failed to get file size, error: {}'.format(output))
@@ -55,6 +133,13 @@ def get_file_size(apk: Apk) -> int:
 
 
 def get_methods_count(apk: Apk) -> int:
+    if _backend == BACKEND_NATIVE:
+        try:
+            with open_archive(apk.apk_path) as archive:
+                return count_methods(archive)
+        except (OSError, BadApkError, IndexError, struct.error, zlib.error) as e:
+            log().error('Failed to get methods count, error: {}'.format(e))
+            return -1
     output, error = execute_apkanalyzer('dex', 'references', apk.apk_path)
     if error:
         log().error('Failed to get methods count, error: {}'.format(error))
@@ -62,7 +147,58 @@ def get_methods_count(apk: Apk) -> int:
     return sum([int(line.split('\t')[1]) for line in output.splitlines()])
 
 
+def parse_dex_packages(output: str) -> DexPackages:
+    # "<type> <state> <defined methods> <referenced methods> <size> <name...>",
+    # classes (C) are aggregated by package, fields (F) are named "<class> <type> <field>"
+    packages = {}
+    for line in output.splitlines():
+        terms = line.split(None, 5)
+        if len(terms) < 6 or terms[0] not in ('C', 'F'):
+            continue
+        name = terms[5].split(' ')[0]
+        package = name.rsplit('.', 1)[0] if '.' in name else ''
+        row = packages.setdefault(package, [0, 0, 0, 0])
+        if terms[0] == 'F':
+            row[2] += 1
+            continue
+        if terms[1] == 'd':
+            row[0] += 1
+            row[3] += int(terms[4])
+        row[1] += int(terms[3])
+    table = DexPackages(names=[], classes=array('q'), methods=array('q'), fields=array('q'), sizes=array('q'))
+    for package, row in sorted(packages.items()):
+        table.names.append(package)
+        for column, value in zip(table[1:], row):
+            column.append(value)
+    return table
+
+
+def get_dex_packages(apk: Apk) -> Optional[DexPackages]:
+    if _backend == BACKEND_NATIVE:
+        try:
+            with open_archive(apk.apk_path) as archive:
+                return count_packages(archive)
+        except (OSError, BadApkError, IndexError, struct.error, zlib.error) as e:
+            log().error('Failed to get dex packages, error: {}'.format(e))
+            return None
+    output, error = execute_apkanalyzer('dex', 'packages', apk.apk_path)
+    if error:
+        log().error('Failed to get dex packages, error: {}'.format(error))
+        return None
+    return parse_dex_packages(output)
+
+
 def get_manifest(apk: Apk) -> Optional[str]:
+    if _backend == BACKEND_NATIVE:
+        try:
+            with open_archive(apk.apk_path) as archive:
+                entry = archive.entries.get(MANIFEST_ENTRY)
+                if entry is None:
+                    raise BadApkError('{} has no {}'.format(apk.apk_path, MANIFEST_ENTRY))
+                return decode_xml(archive.read(entry))
+        except (OSError, BadApkError, zlib.error) as e:
+            log().error('Failed to get manifest, error: {}'.format(e))
+            return None
     output, error = execute_apkanalyzer('manifest', 'print', apk.apk_path)
     if error:
         log().error('Failed to get manifest, error: {}'.format(error))
@@ -70,6 +206,25 @@ def get_manifest(apk: Apk) -> Optional[str]:
     return output
 
 
+def get_duplicates(apk: Apk) -> Optional[list[DuplicateGroup]]:
+    # Entries are always hashed in-process, apkanalyzer cannot tell equal files apart
+    try:
+        with open_archive(apk.apk_path) as archive:
+            return find_duplicates(archive)
+    except (OSError, BadApkError, zlib.error) as e:
+        log().error('Failed to find duplicates, error: {}'.format(e))
+        return None
+
+
+def get_previous_contents(prev: Apk, curr: Apk) -> Optional[dict[str, tuple[int, int]]]:
+    try:
+        with open_archive(prev.apk_path) as archive:
+            return entry_contents(archive)
+    except (OSError, BadApkError) as e:
+        log().error('Failed to read entries, error: {}'.format(e))
+        return None
+
+
 def get_compare_result(prev: Apk, curr: Apk) -> Optional[str]:
     output, error = execute_apkanalyzer(
         'apk', 'compare', '--different-only', '--files-only', prev.apk_path,
@@ -80,6 +235,65 @@ def get_compare_result(prev: Apk, curr: Apk) -> Optional[str]:
     return output
 
 
+def get_compare_report_lines(prev: Apk, curr: Apk) -> list[ReportLine]:
+    if _backend == BACKEND_NATIVE:
+        try:
+            with open_archive(prev.apk_path) as prev_archive, open_archive(curr.apk_path) as curr_archive:
+                return diff_archives(prev_archive, curr_archive)
+        except (OSError, BadApkError) as e:
+            log().error('Failed to compare result, error: {}'.format(e))
+            return []
+    return get_report_lines(get_compare_result(prev, curr))
+
+
+def get_resources_diff(prev: Apk, curr: Apk) -> ResourcesSection:
+    # resources.arsc is always read in-process, apkanalyzer has no single command for the whole table
+    try:
+        with open_archive(prev.apk_path) as prev_archive, open_archive(curr.apk_path) as curr_archive:
+            return diff_resource_tables(read_resource_table(prev_archive), read_resource_table(curr_archive))
+    except (OSError, BadApkError, IndexError, struct.error, zlib.error) as e:
+        log().error('Failed to compare resource tables, error: {}'.format(e))
+        return ResourcesSection(error='Cannot compare resource tables', string_pools=[], types=[])
+
+
+def get_download_size_diff(prev: Apk, curr: Apk) -> DownloadSizeSection:
+    # Entries are always estimated in-process, apkanalyzer only reports the total
+    try:
+        with open_archive(prev.apk_path) as prev_archive, open_archive(curr.apk_path) as curr_archive:
+            return diff_download_sizes(prev_archive, curr_archive)
+    except (OSError, BadApkError, zlib.error) as e:
+        log().error('Failed to estimate download sizes, error: {}'.format(e))
+        return DownloadSizeSection(error='Cannot estimate download sizes', categories=[], entries=[])
+
+
+def get_patch_size(prev: Apk, curr: Apk) -> Optional[int]:
+    try:
+        with open_archive(prev.apk_path) as prev_archive, open_archive(curr.apk_path) as curr_archive:
+            return estimate_patch_size(prev_archive, curr_archive)
+    except (OSError, BadApkError, zlib.error) as e:
+        log().error('Failed to estimate patch size, error: {}'.format(e))
+        return None
+
+
+def get_native_libraries_diff(prev: Apk, curr: Apk) -> NativeLibrariesSection:
+    try:
+        with open_archive(prev.apk_path) as prev_archive, open_archive(curr.apk_path) as curr_archive:
+            return diff_native_libraries(prev_archive, curr_archive)
+    except (OSError, BadApkError, IndexError, struct.error, zlib.error) as e:
+        log().error('Failed to compare native libraries, error: {}'.format(e))
+        return NativeLibrariesSection(error='Cannot compare native libraries', abis=[], libraries=[])
+
+
+def get_bundle_diff(prev: Apk, curr: Apk) -> BundleSection:
+    # Bundles and apk sets are always read in-process, apkanalyzer only reads single apks
+    try:
+        with open_archive(prev.apk_path) as prev_archive, open_archive(curr.apk_path) as curr_archive:
+            return diff_bundles(prev_archive, curr_archive)
+    except (OSError, BadApkError, zlib.error) as e:
+        log().error('Failed to compare splits, error: {}'.format(e))
+        return BundleSection(error='Cannot compare splits', splits=[], configs=[])
+
+
 def get_version_name(apk: Apk) -> Optional[str]:
     output, error = execute_apkanalyzer('apk', 'summary', apk.apk_path)
     if error:
@@ -88,25 +302,267 @@ def get_version_name(apk: Apk) -> Optional[str]:
     return output.split('\t')[2]
 
 
-def assemble_report(plain_data_report: str, compare_report: str, manifest_report: str):
-    return '\n'.join([plain_data_report, compare_report, manifest_report])
-
-
-def generate_report(prev_apk: Apk, curr_apk: Apk) -> ApkCompareReport:
-    prev_apk_plain_data = ApkPlainData(
-        download_size=get_download_size(prev_apk),
-        file_size=get_file_size(prev_apk),
-        methods_count=get_methods_count(prev_apk)
-    )
-    curr_apk_plain_data = ApkPlainData(
-        download_size=get_download_size(curr_apk),
-        file_size=get_file_size(curr_apk),
-        methods_count=get_methods_count(curr_apk)
-    )
-    plain_data_report = compare_plain_data(prev_apk_plain_data, curr_apk_plain_data)
-    apk_compare_result = get_compare_result(prev_apk, curr_apk)
-    compare_report = process_apk_compare_result(apk_compare_result)
-    prev_apk_manifest, curr_apk_manifest = get_manifest(prev_apk), get_manifest(curr_apk)
-    manifest_compare_report = compare_manifests(prev_apk_manifest, curr_apk_manifest)
-    report = assemble_report(plain_data_report, compare_report, manifest_compare_report)
-    return ApkCompareReport(report)
+def get_requested_patch_size(prev: Apk, curr: Apk) -> Optional[int]:
+    return get_patch_size(prev, curr) if is_patch_estimation_enabled() else None
+
+
+def _parse_manifest(apk: Apk, manifest: Optional[str]) -> Optional[Manifest]:
+    # A manifest that decodes but is not a valid manifest fails only the manifest section
+    try:
+        return parse_manifest(manifest)
+    except RuntimeError as e:
+        log().error('Failed to parse manifest of {}, error: {}'.format(apk.apk_path, e))
+        return None
+
+
+def _traced_analysis(call: Callable, apk: Apk) -> Callable:
+    return traced(call, call.__name__, 'analysis', apk=apk.apk_path)
+
+
+def _missing_analyses(analysis: Optional[ApkAnalysis], needed: set[str]) -> set[str]:
+    # Failed calls are reported as -1 or None and are retried
+    if analysis is None:
+        return set(needed)
+    return {name for name in needed
+            if getattr(analysis, name) is None or (name == ANALYSIS_PLAIN_DATA and -1 in analysis.plain_data)}
+
+
+def submit_analysis(apk: Apk, executor: Executor, analyses: Iterable[str] = ANALYSES) -> Callable[[], ApkAnalysis]:
+    needed = set(analyses)
+    if not needed:
+        return lambda: ApkAnalysis(plain_data=None, manifest=None, parsed_manifest=None)
+    key = cache_key(apk, _backend)
+    cached = load_analysis(key)
+    if cached is not None:
+        # Unchanged entries of the other apk reuse the cached hashes
+        remember_duplicates(cached.duplicates)
+    missing = _missing_analyses(cached, needed)
+    if not missing:
+        return lambda: cached
+    cached = cached or ApkAnalysis(plain_data=None, manifest=None, parsed_manifest=None)
+
+    plain_data = None
+    if ANALYSIS_PLAIN_DATA in missing:
+        plain_data = [executor.submit(_traced_analysis(call, apk), apk)
+                      for call in (get_download_size, get_file_size, get_methods_count)]
+    manifest = executor.submit(_traced_analysis(get_manifest, apk), apk) if ANALYSIS_MANIFEST in missing else None
+    dex_packages = (executor.submit(_traced_analysis(get_dex_packages, apk), apk)
+                    if ANALYSIS_DEX_PACKAGES in missing else None)
+    duplicates = (executor.submit(_traced_analysis(get_duplicates, apk), apk)
+                  if ANALYSIS_DUPLICATES in missing else None)
+
+    analyses = []
+
+    def result() -> ApkAnalysis:
+        if analyses:
+            return analyses[0]
+        manifest_text = manifest.result() if manifest else cached.manifest
+        analysis = ApkAnalysis(
+            plain_data=ApkPlainData(*(future.result() for future in plain_data)) if plain_data else cached.plain_data,
+            manifest=manifest_text,
+            parsed_manifest=_parse_manifest(apk, manifest_text) if manifest else cached.parsed_manifest,
+            dex_packages=dex_packages.result() if dex_packages else cached.dex_packages,
+            duplicates=duplicates.result() if duplicates else cached.duplicates
+        )
+        # The cached analysis grows with the sections of later runs, it is
+        # stored when at least one of the missing analyses succeeded
+        if _missing_analyses(analysis, missing) != missing:
+            store_analysis(key, analysis)
+        analyses.append(analysis)
+        return analysis
+
+    return result
+
+
+def _plain_data_section(prev_analysis, curr_analysis, patch_size) -> PlainDataSection:
+    return PlainDataSection(prev=prev_analysis().plain_data, curr=curr_analysis().plain_data, patch_size=patch_size())
+
+
+def _compared_section(prev_analysis, curr_analysis, compared):
+    return compared()
+
+
+def _files_section(prev_analysis, curr_analysis, report_lines):
+    report_lines = report_lines()
+    with span('process_apk_compare_result', 'compare', profile=True):
+        return categorize_compare_result(report_lines)
+
+
+def _manifest_section(prev_analysis, curr_analysis, _):
+    prev_manifest, curr_manifest = prev_analysis().parsed_manifest, curr_analysis().parsed_manifest
+    with span('compare_manifests', 'compare', profile=True):
+        return diff_manifests(prev_manifest, curr_manifest)
+
+
+# Sections in report order. A section reads the listed analyses of both apks
+# and the result of its pair comparison, if it has one.
+ReportSection = collections.namedtuple('ReportSection', ('name', 'analyses', 'compare', 'build'))
+
+REPORT_SECTIONS = (
+    ReportSection('plain-data', (ANALYSIS_PLAIN_DATA,), get_requested_patch_size, _plain_data_section),
+    ReportSection('files', (), get_compare_report_lines, _files_section),
+    ReportSection('download-size', (), get_download_size_diff, _compared_section),
+    ReportSection('native-libraries', (), get_native_libraries_diff, _compared_section),
+    ReportSection('dex-packages', (ANALYSIS_DEX_PACKAGES,), None,
+                  lambda prev, curr, _: diff_dex_packages(prev().dex_packages, curr().dex_packages)),
+    ReportSection('resources', (), get_resources_diff, _compared_section),
+    ReportSection('duplicates', (ANALYSIS_DUPLICATES,), get_previous_contents,
+                  lambda prev, curr, contents: diff_duplicates(prev().duplicates, curr().duplicates, contents())),
+    ReportSection('manifest', (ANALYSIS_MANIFEST,), None, _manifest_section),
+    ReportSection('manifest-tree', (ANALYSIS_MANIFEST,), None,
+                  lambda prev, curr, _: diff_manifest_trees(prev().manifest, curr().manifest)),
+)
+SECTIONS = tuple(section.name for section in REPORT_SECTIONS)
+# The sections of the original report. The others read every entry of both
+# apks and are only built when --sections asks for them.
+DEFAULT_SECTIONS = ('plain-data', 'files', 'manifest')
+
+_sections = DEFAULT_SECTIONS
+
+
+def set_sections(sections: Optional[Iterable[str]]):
+    global _sections
+    sections = DEFAULT_SECTIONS if sections is None else tuple(sections)
+    unknown = [section for section in sections if section not in SECTIONS]
+    if unknown:
+        raise ValueError('Unknown sections {}, expected some of {}'.format(', '.join(unknown), ', '.join(SECTIONS)))
+    _sections = sections
+
+
+def get_sections() -> tuple[str]:
+    return _sections
+
+
+def required_analyses(sections: Iterable[str]) -> set[str]:
+    sections = set(sections)
+    return {analysis for section in REPORT_SECTIONS if section.name in sections for analysis in section.analyses}
+
+
+def submit_comparisons(prev: Apk, curr: Apk, executor: Executor,
+                       sections: Iterable[str]) -> dict[str, Callable[[], object]]:
+    sections = set(sections)
+    return {section.name: executor.submit(traced(section.compare, 'compare ' + section.name, 'compare'),
+                                          prev, curr).result
+            for section in REPORT_SECTIONS if section.name in sections and section.compare is not None}
+
+
+def build_report(prev_analysis: Callable[[], ApkAnalysis], curr_analysis: Callable[[], ApkAnalysis],
+                 comparisons: dict[str, Callable[[], object]], sections: Iterable[str]) -> ApkCompareReport:
+    sections = set(sections)
+    return ApkCompareReport([
+        functools.partial(traced(section.build, 'section ' + section.name, 'report'),
+                          prev_analysis, curr_analysis, comparisons.get(section.name))
+        for section in REPORT_SECTIONS if section.name in sections])
+
+
+_compare_bundles = traced(get_bundle_diff, 'compare splits', 'compare')
+
+
+def is_bundle_pair(prev: Apk, curr: Apk) -> bool:
+    return is_bundle(prev.apk_path) or is_bundle(curr.apk_path)
+
+
+def check_bundle_sections(prev: Apk, curr: Apk, sections: Optional[Iterable[str]]):
+    # A bundle report has only the splits section, explicitly requested sections
+    # and the budget verdict would be missing from it
+    if sections is not None and is_bundle_pair(prev, curr):
+        raise ValueError('Sections cannot be chosen for bundles and apk sets: {}, {}'.format(
+            prev.apk_path, curr.apk_path))
+    if get_budget() is not None and is_bundle_pair(prev, curr):
+        raise ValueError('Budgets cannot be checked for bundles and apk sets: {}, {}'.format(
+            prev.apk_path, curr.apk_path))
+
+
+def submit_bundle_comparison(prev: Apk, curr: Apk, executor: Executor) -> Callable[[], BundleSection]:
+    return executor.submit(_compare_bundles, prev, curr).result
+
+
+def build_bundle_report(compared: Callable[[], BundleSection]) -> ApkCompareReport:
+    # Bundles only get the split comparison, --sections applies to apk pairs
+    return ApkCompareReport([compared])
+
+
+def budget_sections(budget: Budget) -> set[str]:
+    # Sections whose pair comparisons the budget reads
+    sections = set()
+    if budget.needs_patch_size():
+        sections.add('plain-data')
+    if budget.needs_files():
+        sections.add('files')
+    return sections
+
+
+def budget_analyses(budget: Budget) -> set[str]:
+    analyses = set()
+    if budget.needs_plain_data():
+        analyses.add(ANALYSIS_PLAIN_DATA)
+    if budget.needs_manifest():
+        analyses.add(ANALYSIS_MANIFEST)
+    return analyses
+
+
+def _budget_stages(budget: Budget, prev_analysis: Callable[[], ApkAnalysis], curr_analysis: Callable[[], ApkAnalysis],
+                   comparisons: dict[str, Callable[[], object]]) -> list[tuple[str, Callable]]:
+    # Cheapest first: the sizes and the manifest are usually cached, the file compare reads both apks
+    stages = []
+    if budget.needs_plain_data() or budget.needs_patch_size():
+        stages.append(('plain data', lambda: budget.check_plain_data(
+            prev_analysis().plain_data, curr_analysis().plain_data,
+            comparisons['plain-data']() if budget.needs_patch_size() else None)))
+    if budget.needs_manifest():
+        stages.append(('manifest', lambda: budget.check_manifest(
+            diff_manifests(prev_analysis().parsed_manifest, curr_analysis().parsed_manifest))))
+    if budget.needs_files():
+        stages.append(('files', lambda: budget.check_files(comparisons['files']())))
+    return stages
+
+
+def generate_report(prev_apk: Apk, curr_apk: Apk, sections: Optional[Iterable[str]] = None,
+                    executor: Optional[Executor] = None) -> ApkCompareReport:
+    # With an executor of the caller's, the caller waits for or cancels the
+    # submitted calls, otherwise a private one is shut down without waiting
+    if is_bundle_pair(prev_apk, curr_apk):
+        return build_bundle_report(functools.partial(_compare_bundles, prev_apk, curr_apk))
+    sections = get_sections() if sections is None else tuple(sections)
+    budget = get_budget()
+    gated = budget_sections(budget) if budget else set()
+    analyses = required_analyses(sections) | (budget_analyses(budget) if budget else set())
+    owned = executor is None
+    executor = executor or create_executor('apkanalyzer')
+    try:
+        # Pair comparisons, the file compare above all, are usually the slowest calls, so they are submitted first.
+        # Under a fail-fast budget only the ones the budget reads are, the rest waits for its verdict.
+        fail_fast = budget is not None and budget.fail_fast
+        comparisons = submit_comparisons(prev_apk, curr_apk, executor,
+                                         gated if fail_fast else gated | set(sections))
+        prev_analysis = submit_analysis(prev_apk, executor, analyses)
+        curr_analysis = submit_analysis(curr_apk, executor, analyses)
+        if budget is not None:
+            check_budget = traced(functools.partial(
+                evaluate_budget, budget, _budget_stages(budget, prev_analysis, curr_analysis, comparisons)),
+                'section budget', 'report')
+        if fail_fast:
+            budget_section = check_budget()
+
+            def check_budget() -> BudgetSection:
+                return budget_section
+
+            if budget_section.stopped:
+                # Sections of the skipped comparisons are left out of the report
+                compared = {section.name for section in REPORT_SECTIONS if section.compare is not None}
+                sections = tuple(section for section in sections if section not in compared or section in gated)
+            else:
+                comparisons.update(submit_comparisons(prev_apk, curr_apk, executor, set(sections) - gated))
+    finally:
+        # Submitted calls keep running, the report waits for them section by section
+        if owned:
+            executor.shutdown(wait=False)
+    report = build_report(prev_analysis, curr_analysis, comparisons, sections)
+    if budget is not None:
+        # The verdict comes first, it only waits for the results the rules read
+        report.sections.insert(0, check_budget)
+    return report
+
+
+def find_budget_section(report: ApkCompareReport) -> Optional[BudgetSection]:
+    return next((section for section in report.iter_sections() if isinstance(section, BudgetSection)), None)
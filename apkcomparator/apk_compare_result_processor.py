@@ -1,10 +1,15 @@
 import collections
-from typing import Optional
+from typing import Iterator, Optional
 
+from apkcomparator.categories import CategoryIndex, get_category_index
+from apkcomparator.data import CategoryReport, FilesSection
 from utils.numbers import human_readable_size, get_sign
 
+# Sizes are the sizes of entries inside the APK, uncompressed sizes are
+# only known when the APKs were compared in-process.
 ReportLine = collections.namedtuple(
-    'ReportLine', ('lhs_size', 'rhs_size', 'diff', 'path'))
+    'ReportLine', ('lhs_size', 'rhs_size', 'diff', 'path', 'lhs_uncompressed_size', 'rhs_uncompressed_size'),
+    defaults=(None, None))
 
 
 def format_line(line: ReportLine, indent_tabs: int = 1):
@@ -36,36 +41,61 @@ def get_report_lines(report: Optional[str]) -> list[ReportLine]:
     return [get_report_line(line) for line in report.splitlines()]
 
 
-def add_report(report_header: str, lines: list[str], report_lines: list[ReportLine]):
+def iter_report(report_header: str, report_lines: list[ReportLine]) -> Iterator[str]:
     accumulated_diff = 0
     for report_line in report_lines:
         accumulated_diff += report_line.diff
-    lines.append('{}:'.format(report_header))
-    lines.append('\tTotal diff: {sign}{diff}'.format(
-        sign=get_sign(accumulated_diff),
-        diff=human_readable_size(accumulated_diff)
-    ))
+    yield from iter_category_report(report_header, accumulated_diff, report_lines)
+
+
+def iter_category_report(report_header: str, total_diff: int, report_lines: list[ReportLine]) -> Iterator[str]:
+    yield '{}:'.format(report_header)
+    yield '\tTotal diff: {sign}{diff}'.format(
+        sign=get_sign(total_diff),
+        diff=human_readable_size(total_diff)
+    )
     for line in report_lines:
-        lines.append(format_line(line))
+        yield format_line(line)
+
+
+def add_report(report_header: str, lines: list[str], report_lines: list[ReportLine]):
+    lines.extend(iter_report(report_header, report_lines))
+
 
+def _format_threshold(threshold: int) -> str:
+    if threshold and threshold % 1024 == 0:
+        return '{}KB'.format(threshold // 1024)
+    return '{} B'.format(threshold)
 
-def process_apk_compare_result(report: Optional[str]) -> str:
-    lines = ['Diff less that 1KB omitted from report!']
-    report_lines = get_report_lines(report)
-    report_lines = filter(lambda line: abs(line.diff) > 1024, report_lines)
+
+def categorize_compare_result(report_lines: list[ReportLine], index: Optional[CategoryIndex] = None) -> FilesSection:
+    index = index or get_category_index()
     report_lines = sorted(report_lines, key=lambda line: line.diff, reverse=True)
-    resource_lines = [line for line in report_lines if line.path.startswith('res/')]
-    dex_lines = [line for line in report_lines if line.path.endswith('.dex')]
-    asset_lines = [line for line in report_lines if line.path.startswith('assets/')]
-    lib_lines = [line for line in report_lines if line.path.startswith('lib/')]
-    other_lines = [line for line in report_lines if
-                   line not in resource_lines and
-                   line not in dex_lines and
-                   line not in asset_lines and
-                   line not in lib_lines]
-    add_report('Dex files', lines, dex_lines)
-    add_report('Libraries', lines, lib_lines)
-    add_report('Assets', lines, asset_lines)
-    add_report('Resources', lines, resource_lines)
-    add_report('Other', lines, other_lines)
-    return '\n'.join(lines)
+    buckets = index.bucket(report_lines)
+    categories = [
+        CategoryReport(
+            name=category.name,
+            threshold=category.threshold,
+            total_diff=sum(line.diff for line in category_lines),
+            lines=category_lines)
+        for category, category_lines in zip(index.categories + [index.other], buckets)]
+    return FilesSection(thresholds=sorted(index.thresholds()), categories=categories)
+
+
+def iter_files_section(section: FilesSection) -> Iterator[str]:
+    uniform_threshold = len(section.thresholds) == 1
+    if uniform_threshold:
+        yield 'Diff less that {} omitted from report!'.format(_format_threshold(section.thresholds[0]))
+    for category in section.categories:
+        header = category.name
+        if not uniform_threshold:
+            header = '{} (diff less that {} omitted)'.format(header, _format_threshold(category.threshold))
+        yield from iter_category_report(header, category.total_diff, category.lines)
+
+
+def iter_apk_compare_result(report_lines: list[ReportLine], index: Optional[CategoryIndex] = None) -> Iterator[str]:
+    yield from iter_files_section(categorize_compare_result(report_lines, index))
+
+
+def process_apk_compare_result(report_lines: list[ReportLine], index: Optional[CategoryIndex] = None) -> str:
+    return '\n'.join(iter_apk_compare_result(report_lines, index))
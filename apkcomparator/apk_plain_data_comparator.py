@@ -1,25 +1,34 @@
+from typing import Iterator, Optional
+
 from apkcomparator.data import ApkPlainData
 from utils.numbers import get_sign, human_readable_size
 
 
-def compare_plain_data(prev: ApkPlainData, curr: ApkPlainData) -> str:
+def iter_plain_data(prev: ApkPlainData, curr: ApkPlainData, patch_size: Optional[int] = None) -> Iterator[str]:
     diff_download_size = curr.download_size - prev.download_size
     diff_file_size = curr.file_size - prev.file_size
     diff_methods_count = curr.methods_count - prev.methods_count
-    lines = [
-        'Download size: {size} (diff: {sign}{diff})'.format(
-            size=human_readable_size(curr.download_size),
-            sign=get_sign(diff_download_size),
-            diff=human_readable_size(diff_download_size)
-        ),
-        'File size: {size} (diff: {sign}{diff})'.format(
-            size=human_readable_size(curr.file_size),
-            sign=get_sign(diff_file_size),
-            diff=human_readable_size(diff_file_size)
-        ),
-        'Methods count: {size} (diff: {sign}{diff})'.format(
-            size=curr.methods_count,
-            sign=get_sign(diff_methods_count),
-            diff=abs(diff_methods_count)
-        )]
-    return '\n'.join(lines)
+    yield 'Download size: {size} (diff: {sign}{diff})'.format(
+        size=human_readable_size(curr.download_size),
+        sign=get_sign(diff_download_size),
+        diff=human_readable_size(diff_download_size)
+    )
+    if patch_size is not None:
+        yield 'Update patch size: {size} ({percent:.1f}% of download size)'.format(
+            size=human_readable_size(patch_size),
+            percent=100.0 * patch_size / curr.download_size if curr.download_size > 0 else 0.0
+        )
+    yield 'File size: {size} (diff: {sign}{diff})'.format(
+        size=human_readable_size(curr.file_size),
+        sign=get_sign(diff_file_size),
+        diff=human_readable_size(diff_file_size)
+    )
+    yield 'Methods count: {size} (diff: {sign}{diff})'.format(
+        size=curr.methods_count,
+        sign=get_sign(diff_methods_count),
+        diff=abs(diff_methods_count)
+    )
+
+
+def compare_plain_data(prev: ApkPlainData, curr: ApkPlainData, patch_size: Optional[int] = None) -> str:
+    return '\n'.join(iter_plain_data(prev, curr, patch_size))
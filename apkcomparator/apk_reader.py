@@ -0,0 +1,172 @@
+import collections
+import contextlib
+import mmap
+import os
+import struct
+import zlib
+from typing import Iterator, Optional
+
+from utils.exceptions import BadApkError
+
+#
+# https://pkware.cachefly.net/webdocs/casestudies/APPNOTE.TXT
+#
+COMPRESSION_STORED = 0
+COMPRESSION_DEFLATED = 8
+
+_EOCD = struct.Struct('<IHHHHIIH')
+_EOCD_SIGNATURE = b'PK\x05\x06'
+_ZIP64_EOCD_LOCATOR = struct.Struct('<IIQI')
+_ZIP64_EOCD_LOCATOR_SIGNATURE = 0x07064b50
+_ZIP64_EOCD = struct.Struct('<IQHHIIQQQQ')
+_ZIP64_EOCD_SIGNATURE = 0x06064b50
+_ZIP64_EXTRA_ID = 0x0001
+_CENTRAL_DIRECTORY_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+_CENTRAL_DIRECTORY_SIGNATURE = 0x02014b50
+_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+_LOCAL_HEADER_SIGNATURE = 0x04034b50
+_MAX_COMMENT_SIZE = 0xffff
+_CHUNK_SIZE = 1 << 20
+
+ZipEntry = collections.namedtuple(
+    'ZipEntry', ('name', 'compression', 'crc', 'compressed_size', 'uncompressed_size', 'header_offset'))
+
+
+class ZipArchive(object):
+    def __init__(self, buffer, name: str, base: int = 0, size: Optional[int] = None):
+        self.name = name
+        self._buffer = buffer
+        self._base = base
+        self.size = len(buffer) - base if size is None else size
+        self.central_directory_offset, self.central_directory_size = self._find_central_directory()
+        self.entries = self._read_central_directory()
+
+    def _find_central_directory(self):
+        start = max(self._base, self._base + self.size - _EOCD.size - _MAX_COMMENT_SIZE)
+        eocd_offset = self._buffer.rfind(_EOCD_SIGNATURE, start, self._base + self.size)
+        if eocd_offset < 0:
+            raise BadApkError('{} is not a zip archive'.format(self.name))
+        _, _, _, _, entries, cd_size, cd_offset, _ = _EOCD.unpack_from(self._buffer, eocd_offset)
+        locator_offset = eocd_offset - _ZIP64_EOCD_LOCATOR.size
+        if (cd_offset == 0xffffffff or entries == 0xffff) and locator_offset >= self._base:
+            signature, _, zip64_eocd_offset, _ = _ZIP64_EOCD_LOCATOR.unpack_from(self._buffer, locator_offset)
+            if signature == _ZIP64_EOCD_LOCATOR_SIGNATURE:
+                zip64_eocd = _ZIP64_EOCD.unpack_from(self._buffer, self._base + zip64_eocd_offset)
+                if zip64_eocd[0] != _ZIP64_EOCD_SIGNATURE:
+                    raise BadApkError('{} has a corrupted zip64 directory'.format(self.name))
+                cd_size, cd_offset = zip64_eocd[8], zip64_eocd[9]
+        if cd_offset + cd_size > self.size:
+            raise BadApkError('{} has a truncated central directory'.format(self.name))
+        return cd_offset, cd_size
+
+    def _read_central_directory(self) -> dict[str, ZipEntry]:
+        entries = {}
+        offset = self._base + self.central_directory_offset
+        end = offset + self.central_directory_size
+        while offset < end:
+            (signature, _, _, _, compression, _, _, crc, compressed_size, uncompressed_size,
+             name_length, extra_length, comment_length, _, _, _,
+             header_offset) = _CENTRAL_DIRECTORY_HEADER.unpack_from(self._buffer, offset)
+            if signature != _CENTRAL_DIRECTORY_SIGNATURE:
+                raise BadApkError('{} has a corrupted central directory'.format(self.name))
+            offset += _CENTRAL_DIRECTORY_HEADER.size
+            name = bytes(self._buffer[offset:offset + name_length]).decode('utf-8', 'replace')
+            offset += name_length
+            if 0xffffffff in (compressed_size, uncompressed_size, header_offset):
+                uncompressed_size, compressed_size, header_offset = self._read_zip64_extra(
+                    offset, extra_length, uncompressed_size, compressed_size, header_offset)
+            offset += extra_length + comment_length
+            if not name.endswith('/'):
+                entries[name] = ZipEntry(name, compression, crc, compressed_size, uncompressed_size, header_offset)
+        return entries
+
+    def _read_zip64_extra(self, offset, length, *values):
+        end = offset + length
+        while offset + 4 <= end:
+            header_id, size = struct.unpack_from('<HH', self._buffer, offset)
+            offset += 4
+            if header_id == _ZIP64_EXTRA_ID:
+                result = []
+                for value in values:
+                    if value == 0xffffffff:
+                        value = struct.unpack_from('<Q', self._buffer, offset)[0]
+                        offset += 8
+                    result.append(value)
+                return result
+            offset += size
+        return values
+
+    def central_directory(self) -> bytes:
+        start = self._base + self.central_directory_offset
+        return self._buffer[start:start + self.central_directory_size]
+
+    def data_offset(self, entry: ZipEntry) -> int:
+        offset = self._base + entry.header_offset
+        signature, _, _, _, _, _, _, _, _, name_length, extra_length = _LOCAL_HEADER.unpack_from(
+            self._buffer, offset)
+        if signature != _LOCAL_HEADER_SIGNATURE:
+            raise BadApkError('{} has a corrupted local header for {}'.format(self.name, entry.name))
+        return offset + _LOCAL_HEADER.size + name_length + extra_length
+
+    def iter_raw_chunks(self, entry: ZipEntry) -> Iterator[bytes]:
+        start = self.data_offset(entry)
+        end = start + entry.compressed_size
+        for offset in range(start, end, _CHUNK_SIZE):
+            yield self._buffer[offset:min(offset + _CHUNK_SIZE, end)]
+
+    def iter_chunks(self, entry: ZipEntry) -> Iterator[bytes]:
+        if entry.compression == COMPRESSION_STORED:
+            yield from self.iter_raw_chunks(entry)
+        elif entry.compression == COMPRESSION_DEFLATED:
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            for chunk in self.iter_raw_chunks(entry):
+                yield decompressor.decompress(chunk)
+            yield decompressor.flush()
+        else:
+            raise BadApkError('{} uses unsupported compression {} for {}'.format(
+                self.name, entry.compression, entry.name))
+
+    def buffer_range(self, entry: ZipEntry) -> tuple[object, int, int]:
+        # Stored entries are parsed in place from the mapped archive, without
+        # a copy. Views are not handed out, so the mapping can still be closed.
+        if entry.compression == COMPRESSION_STORED:
+            start = self.data_offset(entry)
+            return self._buffer, start, start + entry.uncompressed_size
+        data = self.read(entry)
+        return data, 0, len(data)
+
+    def open_nested(self, entry: ZipEntry) -> 'ZipArchive':
+        # Splits of an apk set are stored, so they are read from the outer
+        # mapping at their offset and nothing is extracted
+        buffer, start, end = self.buffer_range(entry)
+        return ZipArchive(buffer, '{}!{}'.format(self.name, entry.name), base=start, size=end - start)
+
+    def read(self, entry: ZipEntry, limit: Optional[int] = None) -> bytes:
+        if limit is None:
+            return b''.join(self.iter_chunks(entry))
+        result = bytearray()
+        if entry.compression == COMPRESSION_DEFLATED:
+            # Inflate only as much as needed to get the first `limit` bytes
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            for chunk in self.iter_raw_chunks(entry):
+                result += decompressor.decompress(chunk, limit - len(result))
+                if len(result) >= limit or decompressor.unconsumed_tail:
+                    break
+            return bytes(result[:limit])
+        for chunk in self.iter_chunks(entry):
+            result += chunk
+            if len(result) >= limit:
+                break
+        return bytes(result[:limit])
+
+
+@contextlib.contextmanager
+def open_archive(path: str) -> Iterator[ZipArchive]:
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            raise BadApkError('{} is empty'.format(path))
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield ZipArchive(buffer, path)
+        finally:
+            buffer.close()
@@ -0,0 +1,267 @@
+import atexit
+import functools
+import hashlib
+import os.path
+import queue
+import re
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Optional
+
+from utils.concurrency import get_parallelism
+from utils.environment import android_tools_bin_dir, get_temp_file
+from utils.exceptions import WorkerError, WorkerTimeoutError
+from utils.logger import log
+
+DAEMON_CLASS = 'ApkAnalyzerDaemon'
+DAEMON_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'daemon', DAEMON_CLASS + '.java')
+DAEMON_LOG = 'apkanalyzer-daemon.log'
+DEFAULT_MAX_WORKERS = 4
+# Workers idle for longer are pinged before they get the next request
+PING_INTERVAL = 30
+STOP_TIMEOUT = 5
+
+_INT = struct.Struct('>i')
+
+
+def _remaining(timeout: Optional[float], started: float) -> Optional[float]:
+    if timeout is None:
+        return None
+    return max(0.0, timeout - (time.monotonic() - started))
+
+
+def _java_tool(name: str) -> str:
+    return os.path.join(os.environ.get('JAVA_HOME', ''), 'bin', name)
+
+
+def _tools_dir() -> str:
+    return os.path.dirname(android_tools_bin_dir())
+
+
+def _classpath(classes_directory: str) -> str:
+    return os.pathsep.join((classes_directory, os.path.join(_tools_dir(), 'lib', '*')))
+
+
+@functools.lru_cache(maxsize=None)
+def _java_major_version() -> int:
+    rc = subprocess.run([_java_tool('java'), '-version'], capture_output=True)
+    match = re.search(r'version "(\d+)(?:\.(\d+))?', rc.stderr.decode())
+    if not match:
+        raise WorkerError('Cannot parse java version: {}'.format(rc.stderr.decode()))
+    major = int(match.group(1))
+    # Java 8 and older report themselves as 1.x
+    return int(match.group(2) or 0) if major == 1 else major
+
+
+def compile_daemon() -> str:
+    with open(DAEMON_SOURCE, 'rb') as source:
+        digest = hashlib.sha256(source.read()).hexdigest()[:16]
+    classes_directory = get_temp_file('apkanalyzer-daemon-{}'.format(digest))
+    if os.path.exists(os.path.join(classes_directory, DAEMON_CLASS + '.class')):
+        return classes_directory
+    log().info('Compiling {}'.format(DAEMON_SOURCE))
+    build_directory = tempfile.mkdtemp(dir=os.path.dirname(classes_directory))
+    try:
+        rc = subprocess.run([_java_tool('javac'), '-nowarn', '-d', build_directory, '-cp',
+                             _classpath(build_directory), DAEMON_SOURCE], capture_output=True)
+        if rc.returncode != 0:
+            raise WorkerError('Cannot compile {}: {}'.format(DAEMON_SOURCE, rc.stderr.decode()))
+        try:
+            os.rename(build_directory, classes_directory)
+        except OSError:
+            # Another run compiled the same source first
+            pass
+    finally:
+        shutil.rmtree(build_directory, ignore_errors=True)
+    return classes_directory
+
+
+def worker_command(classes_directory: str) -> list[str]:
+    command = [_java_tool('java')]
+    # Since Java 18 System.exit of apkanalyzer can only be trapped with an opt-in
+    if _java_major_version() >= 12:
+        command.append('-Djava.security.manager=allow')
+    command.extend(['-Dcom.android.sdklib.toolsdir={}'.format(_tools_dir()),
+                    '-cp', _classpath(classes_directory), DAEMON_CLASS])
+    return command
+
+
+class ApkAnalyzerWorker(object):
+    def __init__(self, command: list[str]):
+        self._command = command
+        self._process = None
+        self._last_used = 0.0
+
+    def alive(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    def start(self):
+        self.stop()
+        with open(get_temp_file(DAEMON_LOG), 'ab') as errors:
+            self._process = subprocess.Popen(self._command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                             stderr=errors)
+        if not self.ping():
+            self.stop()
+            raise WorkerError('apkanalyzer worker did not start, see {}'.format(get_temp_file(DAEMON_LOG)))
+        log().info('Started apkanalyzer worker {}'.format(self._process.pid))
+
+    def stop(self):
+        if self._process is None:
+            return
+        process, self._process = self._process, None
+        try:
+            process.stdin.close()
+            process.wait(timeout=STOP_TIMEOUT)
+        except (OSError, subprocess.TimeoutExpired):
+            process.kill()
+            process.wait()
+        process.stdout.close()
+
+    def _read(self, size: int) -> bytes:
+        data = self._process.stdout.read(size)
+        if len(data) != size:
+            raise WorkerError('apkanalyzer worker {} exited with {}'.format(
+                self._process.pid, self._process.wait()))
+        return data
+
+    def _read_int(self) -> int:
+        return _INT.unpack(self._read(_INT.size))[0]
+
+    def _request(self, arguments: list[str], timeout: Optional[float] = None) -> tuple[int, bytes, bytes]:
+        payload = [_INT.pack(len(arguments))]
+        for argument in arguments:
+            encoded = argument.encode()
+            payload.append(_INT.pack(len(encoded)))
+            payload.append(encoded)
+        process = self._process
+        expired = threading.Event()
+
+        def expire():
+            # The read of the answer fails once the worker is killed, the next call starts a new one
+            expired.set()
+            process.kill()
+
+        timer = threading.Timer(timeout, expire) if timeout is not None else None
+        if timer is not None:
+            timer.start()
+        try:
+            try:
+                process.stdin.write(b''.join(payload))
+                process.stdin.flush()
+            except OSError as e:
+                raise WorkerError('apkanalyzer worker {} is gone: {}'.format(process.pid, e))
+            status = self._read_int()
+            output = self._read(self._read_int())
+            error = self._read(self._read_int())
+        except WorkerError:
+            if expired.is_set():
+                raise WorkerTimeoutError('apkanalyzer worker {} timed out after {:.1f} s'.format(process.pid, timeout))
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+        self._last_used = time.monotonic()
+        return status, output, error
+
+    def ping(self) -> bool:
+        try:
+            return self._request([])[0] == 0
+        except WorkerError:
+            return False
+
+    def call(self, arguments: list[str], timeout: Optional[float] = None) -> tuple[int, bytes, bytes]:
+        if not self.alive() or (time.monotonic() - self._last_used > PING_INTERVAL and not self.ping()):
+            self.start()
+        started = time.monotonic()
+        try:
+            return self._request(arguments, timeout)
+        except WorkerTimeoutError:
+            raise
+        except WorkerError as e:
+            # The request may have crashed the JVM, it is retried once on a fresh one
+            log().warning('{}, restarting'.format(e))
+            self.start()
+            return self._request(arguments, _remaining(timeout, started))
+
+
+class ApkAnalyzerWorkerPool(object):
+    def __init__(self, size: int, command: list[str]):
+        self._workers = [ApkAnalyzerWorker(command) for _ in range(size)]
+        # Most recently used workers are reused first, so the rest are only
+        # started when calls actually overlap
+        self._idle = queue.LifoQueue()
+        for worker in reversed(self._workers):
+            self._idle.put(worker)
+        self.served = False
+
+    def call(self, arguments: list[str], timeout: Optional[float] = None) -> tuple[int, bytes, bytes]:
+        started = time.monotonic()
+        try:
+            worker = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise WorkerTimeoutError('No apkanalyzer worker was free within {:.1f} s'.format(timeout))
+        try:
+            result = worker.call(arguments, _remaining(timeout, started))
+            self.served = True
+            return result
+        finally:
+            self._idle.put(worker)
+
+    def close(self):
+        for worker in self._workers:
+            worker.stop()
+
+
+_size = None
+_pool = None
+_disabled = False
+_lock = threading.Lock()
+
+
+def set_worker_count(count: Optional[int]):
+    # None picks a default from the parallelism, 0 starts apkanalyzer per call
+    global _size, _disabled
+    if count is not None and count < 0:
+        raise ValueError('Worker count must not be negative, got {}'.format(count))
+    _size = count
+    _disabled = count == 0
+
+
+def get_pool() -> Optional[ApkAnalyzerWorkerPool]:
+    global _pool, _disabled
+    with _lock:
+        if _disabled:
+            return None
+        if _pool is None:
+            try:
+                command = worker_command(compile_daemon())
+            except (OSError, WorkerError) as e:
+                log().warning('apkanalyzer workers are unavailable, starting a process per call: {}'.format(e))
+                _disabled = True
+                return None
+            _pool = ApkAnalyzerWorkerPool(_size or min(get_parallelism(), DEFAULT_MAX_WORKERS), command)
+            atexit.register(_pool.close)
+        return _pool
+
+
+def run_apkanalyzer(arguments: list[str], timeout: Optional[float] = None) -> Optional[tuple[int, bytes, bytes]]:
+    global _disabled
+    pool = get_pool()
+    if pool is None:
+        return None
+    try:
+        return pool.call(arguments, timeout)
+    except WorkerTimeoutError as e:
+        # Starting a process instead would only run past the same deadline
+        log().warning(str(e))
+        return -1, b'', str(e).encode()
+    except WorkerError as e:
+        log().warning('apkanalyzer worker failed, starting a process instead: {}'.format(e))
+        if not pool.served:
+            # Workers never worked in this environment, stop trying
+            _disabled = True
+        return None
@@ -0,0 +1,159 @@
+import argparse
+import collections
+import glob
+import os.path
+import shlex
+
+from apkcomparator.apk_comparator import (
+    build_bundle_report, build_report, check_bundle_sections, get_sections, is_bundle_pair, required_analyses,
+    submit_analysis, submit_bundle_comparison, submit_comparisons)
+from apkcomparator.budget import get_budget
+from apkcomparator.data import Apk, ApkPlainData
+from apkcomparator.report_renderers import EXTENSIONS, FORMAT_TEXT
+from apkcomparator.start import (
+    add_common_arguments, apply_common_arguments, get_result_directory, save_report, save_report_to_file)
+from utils.concurrency import create_executor
+from utils.logger import log
+from utils.tracing import finish_tracing
+
+INDEX_FILE = 'index.tsv'
+INDEX_HEADER = ('name', 'prev_apk', 'curr_apk', 'download_size_diff', 'file_size_diff', 'methods_count_diff',
+                'report')
+
+ApkPair = collections.namedtuple('ApkPair', ('name', 'prev', 'curr'))
+
+
+def _apk_name(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def _make_pair(prev_path: str, curr_path: str, name: str = None) -> ApkPair:
+    return ApkPair(
+        name=name or '{}-vs-{}'.format(_apk_name(prev_path), _apk_name(curr_path)),
+        prev=Apk(os.path.abspath(prev_path)),
+        curr=Apk(os.path.abspath(curr_path)))
+
+
+def read_pairs_file(file: str) -> list[ApkPair]:
+    # Every line is "<prev apk> <curr apk> [report name]", shell quoting is supported
+    pairs = []
+    with open(file) as stream:
+        for number, line in enumerate(stream, start=1):
+            terms = shlex.split(line, comments=True)
+            if not terms:
+                continue
+            if len(terms) not in (2, 3):
+                raise RuntimeError('{}:{}: expected "<prev apk> <curr apk> [name]"'.format(file, number))
+            pairs.append(_make_pair(*terms))
+    return pairs
+
+
+def baseline_pairs(baseline: str, patterns: list[str]) -> list[ApkPair]:
+    candidates = sorted({path for pattern in patterns for path in glob.glob(pattern)})
+    return [_make_pair(baseline, candidate) for candidate in candidates
+            if os.path.abspath(candidate) != os.path.abspath(baseline)]
+
+
+def _unique_names(pairs: list[ApkPair]) -> list[ApkPair]:
+    # Repeated names get a suffix that is neither a given name nor taken by an earlier pair
+    given = {pair.name for pair in pairs}
+    used = set()
+    result = []
+    for pair in pairs:
+        name = pair.name
+        suffix = 1
+        while name in used or (name != pair.name and name in given):
+            suffix += 1
+            name = '{}-{}'.format(pair.name, suffix)
+        used.add(name)
+        result.append(pair._replace(name=name))
+    return result
+
+
+def run_batch(pairs: list[ApkPair], output_directory: str, formats: list[str] = (FORMAT_TEXT,)) -> str:
+    if get_budget() is not None:
+        raise ValueError('Budgets are only checked by apkcomparator.start, not in batch mode')
+    pairs = _unique_names(pairs)
+    if not os.path.exists(output_directory):
+        os.makedirs(output_directory)
+    index_lines = ['\t'.join(INDEX_HEADER)]
+    sections = get_sections()
+    analyses = required_analyses(sections)
+    with create_executor('batch') as executor:
+        comparisons = {pair.name: (submit_bundle_comparison(pair.prev, pair.curr, executor)
+                                   if is_bundle_pair(pair.prev, pair.curr) else
+                                   submit_comparisons(pair.prev, pair.curr, executor, sections))
+                       for pair in pairs}
+        # Every distinct apk is analyzed once and shared by all of its pairs
+        apk_analyses = {}
+        for pair in pairs:
+            if is_bundle_pair(pair.prev, pair.curr):
+                continue
+            for apk in (pair.prev, pair.curr):
+                if apk.apk_path not in apk_analyses:
+                    apk_analyses[apk.apk_path] = submit_analysis(apk, executor, analyses)
+        results = {}
+        for pair in pairs:
+            report_file = os.path.join(output_directory, pair.name + EXTENSIONS[formats[0]])
+            # Without the plain data section sizes are not analyzed and left empty
+            diffs = [''] * len(ApkPlainData._fields)
+            if is_bundle_pair(pair.prev, pair.curr):
+                save_report(build_bundle_report(comparisons[pair.name]), report_file, formats)
+            else:
+                prev_analysis = apk_analyses[pair.prev.apk_path]
+                curr_analysis = apk_analyses[pair.curr.apk_path]
+                report = build_report(prev_analysis, curr_analysis, comparisons[pair.name], sections)
+                save_report(report, report_file, formats)
+                prev_data, curr_data = prev_analysis().plain_data, curr_analysis().plain_data
+                if prev_data is not None and curr_data is not None:
+                    diffs = [now - was for was, now in zip(prev_data, curr_data)]
+            results[pair.name] = (pair.name, pair.prev.apk_path, pair.curr.apk_path, *diffs,
+                                  os.path.basename(report_file))
+    for pair in pairs:
+        index_lines.append('\t'.join(str(term) for term in results[pair.name]))
+    index_file = os.path.join(output_directory, INDEX_FILE)
+    save_report_to_file([index_lines], index_file)
+    return index_file
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compare many apk pairs in one run')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--pairs', type=str,
+                        dest='pairs', default=None,
+                        help='File with one "<prev apk> <curr apk> [report name]" pair per line')
+    source.add_argument('--baseline', type=str,
+                        dest='baseline', default=None,
+                        help='Apk every candidate is compared with')
+    parser.add_argument('--candidates', type=str, action='append',
+                        dest='candidates', default=[],
+                        help='Glob of candidate apks compared with --baseline, can be repeated')
+    parser.add_argument('--output-dir', type=str, required=False,
+                        dest='outdir', default=None,
+                        help='Directory for reports and {}. By default result/batch is used.'.format(INDEX_FILE))
+    add_common_arguments(parser)
+    args = parser.parse_args()
+    if args.baseline and not args.candidates:
+        parser.error('--baseline requires at least one --candidates glob')
+    return args
+
+
+def main():
+    args = parse_args()
+    apply_common_arguments(args)
+    if args.pairs:
+        pairs = read_pairs_file(args.pairs)
+    else:
+        pairs = baseline_pairs(args.baseline, args.candidates)
+    if not pairs:
+        raise RuntimeError('Nothing to compare, check --pairs or --candidates.')
+    for pair in pairs:
+        check_bundle_sections(pair.prev, pair.curr, args.sections)
+    output_directory = args.outdir or os.path.join(get_result_directory(), 'batch')
+    index_file = run_batch(pairs, output_directory, args.formats)
+    log().info('Compared {} pairs, summary saved to {}'.format(len(pairs), index_file))
+    finish_tracing()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+import struct
+from xml.sax.saxutils import escape, quoteattr
+
+from utils.exceptions import BadApkError
+
+#
+# https://android.googlesource.com/platform/frameworks/base/+/master/libs/androidfw/include/androidfw/ResourceTypes.h
+#
+RES_STRING_POOL_TYPE = 0x0001
+RES_XML_TYPE = 0x0003
+RES_XML_START_NAMESPACE_TYPE = 0x0100
+RES_XML_END_NAMESPACE_TYPE = 0x0101
+RES_XML_START_ELEMENT_TYPE = 0x0102
+RES_XML_END_ELEMENT_TYPE = 0x0103
+RES_XML_CDATA_TYPE = 0x0104
+RES_XML_RESOURCE_MAP_TYPE = 0x0180
+
+TYPE_REFERENCE = 0x01
+TYPE_ATTRIBUTE = 0x02
+TYPE_STRING = 0x03
+TYPE_FLOAT = 0x04
+TYPE_DIMENSION = 0x05
+TYPE_FRACTION = 0x06
+TYPE_INT_DEC = 0x10
+TYPE_INT_HEX = 0x11
+TYPE_INT_BOOLEAN = 0x12
+TYPE_FIRST_COLOR_INT = 0x1c
+TYPE_LAST_COLOR_INT = 0x1f
+
+# Chunks referencing the string pool
+_STRING_CHUNK_TYPES = (RES_XML_START_NAMESPACE_TYPE, RES_XML_START_ELEMENT_TYPE, RES_XML_END_ELEMENT_TYPE,
+                       RES_XML_CDATA_TYPE)
+
+UTF8_FLAG = 0x100
+NO_ENTRY = 0xffffffff
+
+_CHUNK_HEADER = struct.Struct('<HHI')
+_STRING_POOL_HEADER = struct.Struct('<IIIII')
+_XML_NAMESPACE = struct.Struct('<II')
+_XML_ELEMENT = struct.Struct('<IIHHHHHH')
+_XML_ATTRIBUTE = struct.Struct('<IIIHBBI')
+_XML_END_ELEMENT = struct.Struct('<II')
+_XML_CDATA = struct.Struct('<I')
+
+_DIMENSION_UNITS = ('px', 'dp', 'sp', 'pt', 'in', 'mm')
+_FRACTION_UNITS = ('%', '%p')
+_RADIX_MULTIPLIERS = (1.0 / (1 << 8), 1.0 / (1 << 15), 1.0 / (1 << 23), 1.0 / (1 << 31))
+
+# Release builds strip attribute names from the string pool, leaving only
+# the resource id, so the attributes used in manifests are resolved here.
+ANDROID_ATTRIBUTES = {
+    0x01010000: 'theme',
+    0x01010001: 'label',
+    0x01010002: 'icon',
+    0x01010003: 'name',
+    0x01010006: 'permission',
+    0x01010007: 'readPermission',
+    0x01010008: 'writePermission',
+    0x01010009: 'protectionLevel',
+    0x0101000a: 'permissionGroup',
+    0x0101000b: 'sharedUserId',
+    0x0101000c: 'hasCode',
+    0x0101000e: 'enabled',
+    0x0101000f: 'debuggable',
+    0x01010010: 'exported',
+    0x01010011: 'process',
+    0x01010012: 'taskAffinity',
+    0x01010018: 'authorities',
+    0x0101001b: 'grantUriPermissions',
+    0x0101001c: 'priority',
+    0x0101001d: 'launchMode',
+    0x0101001e: 'screenOrientation',
+    0x0101001f: 'configChanges',
+    0x01010020: 'description',
+    0x01010021: 'targetPackage',
+    0x01010024: 'value',
+    0x01010025: 'resource',
+    0x01010026: 'mimeType',
+    0x01010027: 'scheme',
+    0x01010028: 'host',
+    0x01010029: 'port',
+    0x0101002a: 'path',
+    0x0101002b: 'pathPrefix',
+    0x0101002c: 'pathPattern',
+    0x0101020c: 'minSdkVersion',
+    0x0101021b: 'versionCode',
+    0x0101021c: 'versionName',
+    0x01010261: 'sharedUserLabel',
+    0x0101026c: 'anyDensity',
+    0x01010270: 'targetSdkVersion',
+    0x01010271: 'maxSdkVersion',
+    0x01010272: 'testOnly',
+    0x01010280: 'allowBackup',
+    0x01010281: 'glEsVersion',
+    0x01010284: 'smallScreens',
+    0x01010285: 'normalScreens',
+    0x01010286: 'largeScreens',
+    0x0101028d: 'resizeable',
+    0x0101028e: 'required',
+    0x010102b7: 'installLocation',
+    0x010102bf: 'xlargeScreens',
+    0x010102ca: 'screenSize',
+    0x010102cb: 'screenDensity',
+    0x01010364: 'requiresSmallestWidthDp',
+    0x01010365: 'compatibleWidthLimitDp',
+    0x01010366: 'largestWidthLimitDp',
+    0x010103a9: 'isolatedProcess',
+    0x010103af: 'supportsRtl',
+    0x010104ea: 'extractNativeLibs',
+    0x010104ec: 'usesCleartextTraffic',
+    0x01010505: 'directBootAware',
+    0x01010527: 'networkSecurityConfig',
+    0x0101052c: 'roundIcon',
+    0x0101057a: 'appComponentFactory',
+    0x01010599: 'foregroundServiceType',
+}
+
+
+class StringPool(object):
+    def __init__(self, data: bytes, offset: int):
+        string_count, _, flags, strings_start, _ = _STRING_POOL_HEADER.unpack_from(
+            data, offset + _CHUNK_HEADER.size)
+        self._data = data
+        self._utf8 = bool(flags & UTF8_FLAG)
+        self._strings_start = offset + strings_start
+        self._offsets = struct.unpack_from('<{}I'.format(string_count), data, offset + 28)
+        self._cache = {}
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def get(self, index: int) -> str:
+        if index == NO_ENTRY or index >= len(self._offsets):
+            return ''
+        value = self._cache.get(index)
+        if value is None:
+            offset = self._strings_start + self._offsets[index]
+            value = self._decode_utf8(offset) if self._utf8 else self._decode_utf16(offset)
+            self._cache[index] = value
+        return value
+
+    def _decode_utf8(self, offset: int) -> str:
+        _, offset = self._read_utf8_length(offset)
+        length, offset = self._read_utf8_length(offset)
+        return self._data[offset:offset + length].decode('utf-8', 'replace')
+
+    def _read_utf8_length(self, offset: int):
+        length = self._data[offset]
+        if length & 0x80:
+            return ((length & 0x7f) << 8) | self._data[offset + 1], offset + 2
+        return length, offset + 1
+
+    def _decode_utf16(self, offset: int) -> str:
+        length = struct.unpack_from('<H', self._data, offset)[0]
+        offset += 2
+        if length & 0x8000:
+            length = ((length & 0x7fff) << 16) | struct.unpack_from('<H', self._data, offset)[0]
+            offset += 2
+        return self._data[offset:offset + length * 2].decode('utf-16-le', 'replace')
+
+
+def _format_complex(data: int, units) -> str:
+    mantissa = (data & 0xffffff00) - (1 << 32 if data & 0x80000000 else 0)
+    value = mantissa * _RADIX_MULTIPLIERS[(data >> 4) & 0x3]
+    if units is _FRACTION_UNITS:
+        value *= 100
+    return '{:g}{}'.format(value, units[data & 0xf] if (data & 0xf) < len(units) else '')
+
+
+def format_value(strings: StringPool, raw_value: int, data_type: int, data: int) -> str:
+    if raw_value != NO_ENTRY:
+        return strings.get(raw_value)
+    if data_type == TYPE_STRING:
+        return strings.get(data)
+    if data_type == TYPE_REFERENCE:
+        return '@ref/0x{:08x}'.format(data)
+    if data_type == TYPE_ATTRIBUTE:
+        return '?attr/0x{:08x}'.format(data)
+    if data_type == TYPE_INT_DEC:
+        return str(struct.unpack('<i', struct.pack('<I', data))[0])
+    if data_type == TYPE_INT_HEX:
+        return '0x{:x}'.format(data)
+    if data_type == TYPE_INT_BOOLEAN:
+        return 'true' if data else 'false'
+    if data_type == TYPE_FLOAT:
+        return '{:g}'.format(struct.unpack('<f', struct.pack('<I', data))[0])
+    if data_type == TYPE_DIMENSION:
+        return _format_complex(data, _DIMENSION_UNITS)
+    if data_type == TYPE_FRACTION:
+        return _format_complex(data, _FRACTION_UNITS)
+    if TYPE_FIRST_COLOR_INT <= data_type <= TYPE_LAST_COLOR_INT:
+        return '#{:08x}'.format(data)
+    return '0x{:08x}'.format(data)
+
+
+def decode_xml(data: bytes) -> str:
+    # Truncated or inconsistent chunks fail to unpack or index out of range
+    try:
+        return _decode_chunks(data)
+    except (struct.error, IndexError) as e:
+        raise BadApkError('Corrupted binary xml: {}'.format(e))
+
+
+def _decode_chunks(data: bytes) -> str:
+    chunk_type, header_size, size = _CHUNK_HEADER.unpack_from(data, 0)
+    if chunk_type != RES_XML_TYPE:
+        raise BadApkError('Not a binary xml, chunk type 0x{:04x}'.format(chunk_type))
+
+    strings = None
+    resource_ids = ()
+    prefixes = {}
+    pending_namespaces = []
+    lines = ['<?xml version="1.0" encoding="utf-8"?>']
+    depth = 0
+    open_element = False
+
+    offset = header_size
+    end = min(size, len(data))
+    while offset + _CHUNK_HEADER.size <= end:
+        chunk_type, header_size, chunk_size = _CHUNK_HEADER.unpack_from(data, offset)
+        if chunk_size < _CHUNK_HEADER.size:
+            raise BadApkError('Corrupted binary xml chunk at 0x{:x}'.format(offset))
+        if offset + chunk_size > end:
+            raise BadApkError('Truncated binary xml chunk at 0x{:x}'.format(offset))
+        body = offset + header_size
+        if strings is None and chunk_type in _STRING_CHUNK_TYPES:
+            raise BadApkError('Binary xml chunk at 0x{:x} precedes the string pool'.format(offset))
+        if chunk_type == RES_STRING_POOL_TYPE:
+            strings = StringPool(data, offset)
+        elif chunk_type == RES_XML_RESOURCE_MAP_TYPE:
+            count = (chunk_size - header_size) // 4
+            resource_ids = struct.unpack_from('<{}I'.format(count), data, body)
+        elif chunk_type == RES_XML_START_NAMESPACE_TYPE:
+            prefix, uri = _XML_NAMESPACE.unpack_from(data, body)
+            prefixes[strings.get(uri)] = strings.get(prefix)
+            pending_namespaces.append((strings.get(prefix), strings.get(uri)))
+        elif chunk_type == RES_XML_START_ELEMENT_TYPE:
+            if open_element:
+                lines[-1] += '>'
+            _, name, attribute_start, attribute_size, attribute_count, _, _, _ = _XML_ELEMENT.unpack_from(
+                data, body)
+            parts = [strings.get(name)]
+            for prefix, uri in pending_namespaces:
+                parts.append('xmlns:{}={}'.format(prefix, quoteattr(uri)))
+            pending_namespaces = []
+            attribute_offset = body + attribute_start
+            for _ in range(attribute_count):
+                ns, attribute_name, raw_value, _, _, data_type, value = _XML_ATTRIBUTE.unpack_from(
+                    data, attribute_offset)
+                attribute_offset += attribute_size
+                local_name = strings.get(attribute_name)
+                if not local_name and attribute_name < len(resource_ids):
+                    local_name = ANDROID_ATTRIBUTES.get(resource_ids[attribute_name], '')
+                if not local_name:
+                    local_name = 'attr_0x{:08x}'.format(
+                        resource_ids[attribute_name] if attribute_name < len(resource_ids) else attribute_name)
+                prefix = prefixes.get(strings.get(ns)) if ns != NO_ENTRY else None
+                qualified_name = '{}:{}'.format(prefix, local_name) if prefix else local_name
+                parts.append('{}={}'.format(
+                    qualified_name, quoteattr(format_value(strings, raw_value, data_type, value))))
+            lines.append('{}<{}'.format('    ' * depth, ' '.join(parts)))
+            open_element = True
+            depth += 1
+        elif chunk_type == RES_XML_END_ELEMENT_TYPE:
+            depth -= 1
+            _, name = _XML_END_ELEMENT.unpack_from(data, body)
+            if open_element:
+                lines[-1] += ' />'
+            else:
+                lines.append('{}</{}>'.format('    ' * depth, strings.get(name)))
+            open_element = False
+        elif chunk_type == RES_XML_CDATA_TYPE:
+            text = strings.get(_XML_CDATA.unpack_from(data, body)[0]).strip()
+            if text:
+                if open_element:
+                    lines[-1] += '>'
+                    open_element = False
+                lines.append('{}{}'.format('    ' * depth, escape(text)))
+        offset += chunk_size
+    return '\n'.join(lines) + '\n'
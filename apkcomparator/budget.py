@@ -0,0 +1,305 @@
+import collections
+import fnmatch
+import json
+import re
+from typing import Callable, Iterable, Iterator, Optional
+
+from apkcomparator.apk_compare_result_processor import ReportLine
+from apkcomparator.categories import CategoryIndex, get_category_index
+from apkcomparator.data import ApkPlainData, BudgetSection, BudgetViolation, ManifestSection
+from apkcomparator.patch_size import set_patch_estimation
+from utils.numbers import get_sign, human_readable_size
+
+# A budget is a JSON file of rules checked against the comparison:
+# {"fail_fast": true, "rules": [
+#   {"name": "download", "metric": "download_size", "max_diff": 102400, "max": 52428800},
+#   {"name": "methods", "metric": "methods_count", "max_diff_percent": 1},
+#   {"name": "native code", "category": "Libraries", "max_diff": 51200},
+#   {"name": "big files", "glob": "assets/**", "per_entry": true, "max_diff": 204800},
+#   {"name": "no new so", "glob": "*.so", "forbid": ["added"], "severity": "warning"},
+#   {"name": "permissions", "manifest": "uses-permission", "forbid": ["added"],
+#    "allow": ["android.permission.VIBRATE"]}]}
+PATCH_SIZE = 'patch_size'
+METRICS = ApkPlainData._fields + (PATCH_SIZE,)
+SEVERITY_ERROR = 'error'
+SEVERITY_WARNING = 'warning'
+SEVERITIES = (SEVERITY_ERROR, SEVERITY_WARNING)
+FORBID_ADDED = 'added'
+FORBID_REMOVED = 'removed'
+FORBID_CHANGED = 'changed'
+FORBIDS = (FORBID_ADDED, FORBID_REMOVED, FORBID_CHANGED)
+# Exit code of a run whose budget failed, crashes exit with 1 and usage errors with 2
+EXIT_CODE = 3
+
+BudgetRule = collections.namedtuple('BudgetRule', (
+    'name', 'severity', 'metric', 'category', 'glob', 'manifest', 'max', 'max_diff', 'max_diff_percent', 'per_entry',
+    'forbid', 'allow'))
+
+_KINDS = ('metric', 'category', 'glob', 'manifest')
+_WILDCARD = re.compile(r'[*?\[]')
+
+
+class _GlobNode(object):
+    __slots__ = ('children', 'suffixes', 'wildcards', 'globstar', 'rules')
+
+    def __init__(self):
+        self.children = {}
+        self.suffixes = collections.defaultdict(dict)
+        self.wildcards = {}
+        self.globstar = None
+        self.rules = []
+
+
+class GlobIndex(object):
+    # Globs are split into path segments and merged into a trie: literal
+    # segments are dict lookups and "*.so" like segments are hashed by the
+    # suffix length like in CategoryIndex, so only the other wildcards are
+    # matched one by one. "**" matches any number of segments, a glob
+    # without "/" matches the file name in any directory.
+    def __init__(self, globs: Iterable[str]):
+        self._root = _GlobNode()
+        for index, glob in enumerate(globs):
+            node = self._root
+            for segment in ('**/' + glob if '/' not in glob else glob.lstrip('/')).split('/'):
+                if segment == '**':
+                    node.globstar = node.globstar or _GlobNode()
+                    node = node.globstar
+                elif segment.startswith('*') and not _WILDCARD.search(segment[1:]):
+                    node = node.suffixes[len(segment) - 1].setdefault(segment[1:], _GlobNode())
+                elif _WILDCARD.search(segment):
+                    if segment not in node.wildcards:
+                        node.wildcards[segment] = (re.compile(fnmatch.translate(segment)), _GlobNode())
+                    node = node.wildcards[segment][1]
+                else:
+                    node = node.children.setdefault(segment, _GlobNode())
+            node.rules.append(index)
+
+    def match(self, path: str) -> set[int]:
+        segments = path.split('/')
+        matches = set()
+        visited = set()
+        pending = [(self._root, 0)]
+        while pending:
+            node, position = pending.pop()
+            if (id(node), position) in visited:
+                continue
+            visited.add((id(node), position))
+            if node.globstar is not None:
+                pending.extend((node.globstar, start) for start in range(position, len(segments) + 1))
+            if position == len(segments):
+                matches.update(node.rules)
+                continue
+            segment = segments[position]
+            child = node.children.get(segment)
+            if child is not None:
+                pending.append((child, position + 1))
+            for length, suffixes in node.suffixes.items():
+                child = suffixes.get(segment[len(segment) - length:]) if length <= len(segment) else None
+                if child is not None:
+                    pending.append((child, position + 1))
+            for pattern, child in node.wildcards.values():
+                if pattern.match(segment):
+                    pending.append((child, position + 1))
+        return matches
+
+
+def _parse_rule(rule: dict, file: str, categories: list[str]) -> BudgetRule:
+    kinds = [kind for kind in _KINDS if kind in rule]
+    name = rule.get('name') or (rule.get(kinds[0]) if len(kinds) == 1 else None)
+    if len(kinds) != 1:
+        raise RuntimeError('Budget rule {} in {} must have exactly one of {}'.format(name, file, ', '.join(_KINDS)))
+    severity = rule.get('severity', SEVERITY_ERROR)
+    forbid = tuple(rule.get('forbid', ()))
+    if severity not in SEVERITIES or any(term not in FORBIDS for term in forbid):
+        raise RuntimeError('Budget rule {} in {}: severity is one of {}, forbid a list of {}'.format(
+            name, file, ', '.join(SEVERITIES), ', '.join(FORBIDS)))
+    # Files can only be added or removed, sizes and counts are limited with max and max_diff
+    if forbid and 'glob' not in rule and 'manifest' not in rule:
+        raise RuntimeError('Budget rule {} in {}: forbid is only supported by glob and manifest rules'.format(
+            name, file))
+    if FORBID_CHANGED in forbid and 'manifest' not in rule:
+        raise RuntimeError('Budget rule {} in {}: forbid {} is only supported by manifest rules'.format(
+            name, file, FORBID_CHANGED))
+    if 'metric' in rule and rule['metric'] not in METRICS:
+        raise RuntimeError('Budget rule {} in {}: metric is one of {}'.format(name, file, ', '.join(METRICS)))
+    if 'category' in rule and rule['category'] not in categories:
+        raise RuntimeError('Budget rule {} in {}: category is one of {}'.format(name, file, ', '.join(categories)))
+    return BudgetRule(
+        name=name, severity=severity, metric=rule.get('metric'), category=rule.get('category'), glob=rule.get('glob'),
+        manifest=rule.get('manifest'), max=rule.get('max'), max_diff=rule.get('max_diff'),
+        max_diff_percent=rule.get('max_diff_percent'), per_entry=rule.get('per_entry', False), forbid=forbid,
+        allow=frozenset(rule.get('allow', ())))
+
+
+class Budget(object):
+    def __init__(self, rules: list[BudgetRule], fail_fast: bool = False, index: Optional[CategoryIndex] = None):
+        self.rules = rules
+        self.fail_fast = fail_fast
+        self._index = index or get_category_index()
+        self._metric_rules = [rule for rule in rules if rule.metric]
+        names = [category.name for category in self._index.categories] + [self._index.other.name]
+        self._category_rules = collections.defaultdict(list)
+        for rule in rules:
+            if rule.category:
+                self._category_rules[names.index(rule.category)].append(rule)
+        self._glob_rules = [rule for rule in rules if rule.glob]
+        self._globs = GlobIndex(rule.glob for rule in self._glob_rules)
+        self._manifest_rules = collections.defaultdict(list)
+        for rule in rules:
+            if rule.manifest:
+                self._manifest_rules[rule.manifest].append(rule)
+
+    def needs_plain_data(self) -> bool:
+        return any(rule.metric != PATCH_SIZE for rule in self._metric_rules)
+
+    def needs_patch_size(self) -> bool:
+        return any(rule.metric == PATCH_SIZE for rule in self._metric_rules)
+
+    def needs_manifest(self) -> bool:
+        return bool(self._manifest_rules)
+
+    def needs_files(self) -> bool:
+        return bool(self._category_rules or self._glob_rules)
+
+    def check_plain_data(self, prev: Optional[ApkPlainData], curr: Optional[ApkPlainData],
+                         patch_size: Optional[int]) -> list[BudgetViolation]:
+        violations = []
+        for rule in self._metric_rules:
+            if rule.metric == PATCH_SIZE:
+                # The patch is the growth itself, there is nothing to diff
+                was, now = 0, patch_size
+            else:
+                was, now = (getattr(prev, rule.metric), getattr(curr, rule.metric)) if prev and curr else (-1, -1)
+            if now is None or was < 0 or now < 0:
+                violations.append(_violation(rule, '{} is not available'.format(rule.metric)))
+                continue
+            violations.extend(_check_limits(rule, rule.metric, was, now, _format_metric(rule.metric)))
+        return violations
+
+    def check_manifest(self, section: ManifestSection) -> list[BudgetViolation]:
+        if section.error:
+            return [_violation(rule, section.error) for rules in self._manifest_rules.values() for rule in rules]
+        violations = []
+        for difference in section.differences:
+            for rule in self._manifest_rules.get(difference.description, ()):
+                violations.extend(_check_manifest_difference(rule, difference))
+        return violations
+
+    def check_files(self, lines: list[ReportLine]) -> list[BudgetViolation]:
+        category_totals = collections.Counter()
+        glob_totals = collections.Counter()
+        violations = []
+        other = len(self._index.categories)
+        for line in lines:
+            if self._category_rules:
+                for category in self._index.match(line.path) or (other,):
+                    category_totals[category] += line.diff
+            for index in self._globs.match(line.path) if self._glob_rules else ():
+                rule = self._glob_rules[index]
+                glob_totals[index] += line.diff
+                if FORBID_ADDED in rule.forbid and line.lhs_size == 0 and line.lhs_uncompressed_size == 0:
+                    violations.append(_violation(rule, '{} was added'.format(line.path)))
+                if FORBID_REMOVED in rule.forbid and line.rhs_size == 0 and line.rhs_uncompressed_size == 0:
+                    violations.append(_violation(rule, '{} was removed'.format(line.path)))
+                if rule.per_entry:
+                    violations.extend(_check_limits(rule, line.path, line.lhs_size, line.rhs_size, _format_size))
+        for category, rules in self._category_rules.items():
+            for rule in rules:
+                violations.extend(_check_diff(rule, rule.category, category_totals[category], _format_size))
+        for index, rule in enumerate(self._glob_rules):
+            if not rule.per_entry:
+                violations.extend(_check_diff(rule, rule.glob, glob_totals[index], _format_size))
+        return violations
+
+
+def _format_size(value: int) -> str:
+    return human_readable_size(value)
+
+
+def _format_metric(metric: str) -> Callable[[int], str]:
+    return str if metric == 'methods_count' else _format_size
+
+
+def _violation(rule: BudgetRule, message: str) -> BudgetViolation:
+    return BudgetViolation(rule=rule.name, severity=rule.severity, message=message)
+
+
+def _check_diff(rule: BudgetRule, subject: str, diff: int,
+                format_value: Callable[[int], str]) -> Iterator[BudgetViolation]:
+    if rule.max_diff is not None and diff > rule.max_diff:
+        yield _violation(rule, '{} grew by {}{}, limit {}'.format(
+            subject, get_sign(diff), format_value(diff), format_value(rule.max_diff)))
+
+
+def _check_limits(rule: BudgetRule, subject: str, was: int, now: int,
+                  format_value: Callable[[int], str]) -> Iterator[BudgetViolation]:
+    if rule.max is not None and now > rule.max:
+        yield _violation(rule, '{} is {}, limit {}'.format(subject, format_value(now), format_value(rule.max)))
+    yield from _check_diff(rule, subject, now - was, format_value)
+    if rule.max_diff_percent is not None and was > 0 and 100.0 * (now - was) / was > rule.max_diff_percent:
+        yield _violation(rule, '{} grew by {:.2f}%, limit {}%'.format(
+            subject, 100.0 * (now - was) / was, rule.max_diff_percent))
+
+
+def _check_manifest_difference(rule: BudgetRule, difference) -> Iterator[BudgetViolation]:
+    if FORBID_ADDED in rule.forbid:
+        for name in difference.added or ():
+            if name not in rule.allow:
+                yield _violation(rule, '{} {} was added'.format(difference.description, name))
+    if FORBID_REMOVED in rule.forbid:
+        for name in difference.removed or ():
+            if name not in rule.allow:
+                yield _violation(rule, '{} {} was removed'.format(difference.description, name))
+    if FORBID_CHANGED in rule.forbid and difference.added is None and difference.removed is None:
+        yield _violation(rule, '{} changed from {} to {}'.format(difference.description, difference.was,
+                                                                 difference.now))
+
+
+def load_budget(file: str, fail_fast: bool = False, index: Optional[CategoryIndex] = None) -> Budget:
+    index = index or get_category_index()
+    with open(file) as stream:
+        config = json.load(stream)
+    categories = [category.name for category in index.categories] + [index.other.name]
+    rules = [_parse_rule(rule, file, categories) for rule in config.get('rules', [])]
+    return Budget(rules, fail_fast or config.get('fail_fast', False), index)
+
+
+def evaluate_budget(budget: Budget, stages: list[tuple[str, Callable[[], list[BudgetViolation]]]]) -> BudgetSection:
+    # Stages come cheapest first. In fail-fast mode the first hard failure
+    # ends the evaluation, the stages after it are not waited for.
+    violations = []
+    for index, (_, check) in enumerate(stages):
+        violations.extend(check())
+        if budget.fail_fast and not budget_passed(violations):
+            return BudgetSection(rules=len(budget.rules), violations=violations,
+                                 skipped=[name for name, _ in stages[index + 1:]], stopped=True)
+    return BudgetSection(rules=len(budget.rules), violations=violations, skipped=[], stopped=False)
+
+
+def budget_passed(violations: Iterable[BudgetViolation]) -> bool:
+    return all(violation.severity != SEVERITY_ERROR for violation in violations)
+
+
+def iter_budget_section(section: BudgetSection) -> Iterator[str]:
+    passed = budget_passed(section.violations)
+    yield 'Budget: {} ({} rules, {} violations)'.format('passed' if passed else 'FAILED', section.rules,
+                                                        len(section.violations))
+    for violation in section.violations:
+        yield '\t[{}] {}: {}'.format(violation.severity, violation.rule, violation.message)
+    if section.stopped:
+        yield '\tStopped at the first failure{}'.format(
+            ', not checked: ' + ', '.join(section.skipped) if section.skipped else '')
+
+
+_budget = None
+
+
+def configure_budget(file: Optional[str], fail_fast: bool = False):
+    global _budget
+    _budget = load_budget(file, fail_fast) if file else None
+    if _budget is not None and _budget.needs_patch_size():
+        set_patch_estimation(True)
+
+
+def get_budget() -> Optional[Budget]:
+    return _budget
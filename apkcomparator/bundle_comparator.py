@@ -0,0 +1,228 @@
+import collections
+import os.path
+import re
+from typing import Iterator, Optional
+
+from apkcomparator.apk_reader import ZipArchive, ZipEntry
+from apkcomparator.data import BundleSection, DeviceConfigDiff, SplitDiff
+from apkcomparator.download_size import estimate_entry
+from apkcomparator.zip_differ import iter_changed
+from utils.concurrency import create_executor
+from utils.numbers import get_sign, human_readable_size
+
+# App bundles (.aab) hold one directory per module, apk sets (.apks) the
+# splits bundletool generated from them. Both are compared split by split:
+# a bundle module is split like bundletool does, by ABI, density and language.
+BUNDLE_EXTENSION = '.aab'
+APK_SET_EXTENSION = '.apks'
+BUNDLE_EXTENSIONS = (BUNDLE_EXTENSION, APK_SET_EXTENSION)
+SPLITS_DIRECTORY = 'splits/'
+BASE_MODULE = 'base'
+MASTER = 'master'
+
+DIMENSION_ABI = 'abi'
+DIMENSION_DENSITY = 'density'
+DIMENSION_LANGUAGE = 'language'
+DIMENSION_OTHER = 'other'
+DIMENSIONS = (DIMENSION_ABI, DIMENSION_DENSITY, DIMENSION_LANGUAGE, DIMENSION_OTHER)
+
+ABIS = ('armeabi', 'armeabi-v7a', 'arm64-v8a', 'x86', 'x86_64', 'mips', 'mips64', 'riscv64')
+DENSITIES = ('ldpi', 'mdpi', 'tvdpi', 'hdpi', 'xhdpi', 'xxhdpi', 'xxxhdpi')
+# Device configurations are listed for every ABI and density, with this
+# language if the splits have it
+DEFAULT_LANGUAGE = 'en'
+
+# ISO 639-1 codes, the three-letter languages Android has translations for
+# and the legacy codes Android still uses for Hebrew, Indonesian and Yiddish.
+# Other two and three letter suffixes (car, tv, etc) are not languages.
+LANGUAGES = frozenset('''
+    aa ab ae af ak am an ar as av ay az ba be bg bh bi bm bn bo br bs ca ce ch co cr cs cu cv cy da de dv dz ee el
+    en eo es et eu fa ff fi fj fo fr fy ga gd gl gn gu gv ha he hi ho hr ht hu hy hz ia id ie ig ii ik io is it iu
+    ja jv ka kg ki kj kk kl km kn ko kr ks ku kv kw ky la lb lg li ln lo lt lu lv mg mh mi mk ml mn mr ms mt my na
+    nb nd ne ng nl nn no nr nv ny oc oj om or os pa pi pl ps pt qu rm rn ro ru rw sa sc sd se sg si sk sl sm sn so
+    sq sr ss st su sv sw ta te tg th ti tk tl tn to tr ts tt tw ty ug uk ur uz ve vi vo wa wo xh yi yo za zh zu
+    ast brx chr ckb doi fil gsw haw kok mai mni nds sah sat yue zgh
+    in iw ji mo
+'''.split())
+
+# Files of a bundle that belong to no module
+_BUNDLE_METADATA = ('BundleConfig.pb', 'BUNDLE-METADATA/', 'META-INF/')
+# Split names use underscores: base-arm64_v8a.apk
+_SPLIT_ABIS = {abi.replace('-', '_'): abi for abi in ABIS}
+# Qualifiers that may precede the language: values-mcc310-mnc004-en
+_NETWORK_QUALIFIER = re.compile(r'^(mcc|mnc)[0-9]+$')
+
+# Entries are keyed by their path inside the split. Splits of an apk set are
+# nested archives, splits of a bundle share the bundle archive.
+Split = collections.namedtuple('Split', ('name', 'module', 'dimension', 'value', 'archive', 'entries', 'file_size'))
+
+
+def is_bundle(path: str) -> bool:
+    return path.endswith(BUNDLE_EXTENSIONS)
+
+
+def _split_name(module: str, dimension: Optional[str], value: Optional[str]) -> str:
+    return '{}-{}'.format(module, value.replace('-', '_') if dimension else MASTER)
+
+
+def _suffix_dimension(suffix: str) -> tuple[Optional[str], Optional[str]]:
+    if suffix == MASTER:
+        return None, None
+    if suffix in _SPLIT_ABIS:
+        return DIMENSION_ABI, _SPLIT_ABIS[suffix]
+    if suffix in DENSITIES:
+        return DIMENSION_DENSITY, suffix
+    if suffix in LANGUAGES:
+        return DIMENSION_LANGUAGE, suffix
+    # Texture compression formats, device tiers and the like
+    return DIMENSION_OTHER, suffix
+
+
+def _entry_dimension(path: str) -> tuple[Optional[str], Optional[str]]:
+    parts = path.split('/')
+    if len(parts) < 3:
+        return None, None
+    if parts[0] == 'lib':
+        return DIMENSION_ABI, parts[1]
+    if parts[0] == 'res':
+        qualifiers = [qualifier for qualifier in parts[1].split('-')[1:] if not _NETWORK_QUALIFIER.match(qualifier)]
+        # BCP 47 tags are written as b+sr+Latn
+        language = qualifiers[0].split('+')[1] if qualifiers and qualifiers[0].startswith('b+') else (
+            qualifiers[0] if qualifiers else None)
+        if language in LANGUAGES:
+            return DIMENSION_LANGUAGE, language
+        density = next((qualifier for qualifier in qualifiers if qualifier in DENSITIES), None)
+        if density is not None:
+            return DIMENSION_DENSITY, density
+    return None, None
+
+
+def _apk_set_splits(archive: ZipArchive) -> list[Split]:
+    apks = [entry for name, entry in archive.entries.items() if name.endswith('.apk')]
+    # Standalone and universal apks are only compared when there are no splits
+    splits = [entry for entry in apks if entry.name.startswith(SPLITS_DIRECTORY)] or apks
+    result = []
+    for entry in splits:
+        name = os.path.basename(entry.name)[:-len('.apk')]
+        module, _, suffix = name.rpartition('-')
+        if not module:
+            module, suffix = name, MASTER
+        dimension, value = _suffix_dimension(suffix)
+        nested = archive.open_nested(entry)
+        result.append(Split(name, module, dimension, value, nested, nested.entries, nested.size))
+    return result
+
+
+def _bundle_splits(archive: ZipArchive) -> list[Split]:
+    groups = {}
+    for path, entry in archive.entries.items():
+        if '/' not in path or path.startswith(_BUNDLE_METADATA):
+            continue
+        module, relative = path.split('/', 1)
+        groups.setdefault((module, *_entry_dimension(relative)), {})[relative] = entry
+    # A module split has no archive of its own, its size is the size of its entries
+    return [Split(_split_name(module, dimension, value), module, dimension, value, archive, entries,
+                  sum(entry.compressed_size for entry in entries.values()))
+            for (module, dimension, value), entries in groups.items()]
+
+
+def read_splits(archive: ZipArchive) -> list[Split]:
+    if archive.name.endswith(APK_SET_EXTENSION):
+        return _apk_set_splits(archive)
+    if archive.name.endswith(BUNDLE_EXTENSION):
+        return _bundle_splits(archive)
+    # A single apk is the master split of the base module
+    return [Split(_split_name(BASE_MODULE, None, None), BASE_MODULE, None, None, archive, archive.entries,
+                  archive.size)]
+
+
+def _estimate_growth(split: Split, entry: Optional[ZipEntry]) -> int:
+    # What store delivery adds to the compressed size of a stored entry, usually a negative number
+    return estimate_entry(split.archive, entry) - entry.compressed_size if entry is not None else 0
+
+
+def _diff_split(name: str, prev: Optional[Split], curr: Optional[Split]) -> SplitDiff:
+    # Entries with the same CRC and sizes are estimated the same in both
+    # splits, only the changed ones are compressed again
+    split = curr or prev
+    changed = list(iter_changed(prev.entries if prev else {}, curr.entries if curr else {}))
+    file_size_was, file_size_now = prev.file_size if prev else 0, curr.file_size if curr else 0
+    download_size_diff = file_size_now - file_size_was + sum(
+        _estimate_growth(curr, rhs) - _estimate_growth(prev, lhs) for _, lhs, rhs in changed)
+    return SplitDiff(
+        name=name, module=split.module, dimension=split.dimension, value=split.value, file_size_was=file_size_was,
+        file_size_now=file_size_now, download_size_diff=download_size_diff, changed_entries=len(changed))
+
+
+def _split_order(split: Split) -> tuple:
+    dimension = DIMENSIONS.index(split.dimension) + 1 if split.dimension else 0
+    value = DENSITIES.index(split.value) if split.dimension == DIMENSION_DENSITY else 0
+    return split.module != BASE_MODULE, split.module, dimension, value, split.value or ''
+
+
+def _device_configs(splits: list[SplitDiff]) -> list[DeviceConfigDiff]:
+    values = {dimension: {split.value for split in splits if split.dimension == dimension}
+              for dimension in (DIMENSION_ABI, DIMENSION_DENSITY, DIMENSION_LANGUAGE)}
+    languages = sorted(values[DIMENSION_LANGUAGE])
+    language = DEFAULT_LANGUAGE if DEFAULT_LANGUAGE in languages else next(iter(languages), None)
+    configs = []
+    for abi in sorted(values[DIMENSION_ABI]) or [None]:
+        for density in sorted(values[DIMENSION_DENSITY], key=DENSITIES.index) or [None]:
+            device = {DIMENSION_ABI: abi, DIMENSION_DENSITY: density, DIMENSION_LANGUAGE: language}
+            # Master splits of every module and the splits matching the device
+            installed = [split for split in splits
+                         if split.dimension is None or device.get(split.dimension) == split.value]
+            configs.append(DeviceConfigDiff(
+                abi=abi, density=density, language=language,
+                file_size_was=sum(split.file_size_was for split in installed),
+                file_size_now=sum(split.file_size_now for split in installed),
+                download_size_diff=sum(split.download_size_diff for split in installed)))
+    return configs
+
+
+def diff_bundles(prev: ZipArchive, curr: ZipArchive) -> BundleSection:
+    prev_splits = {split.name: split for split in read_splits(prev)}
+    curr_splits = {split.name: split for split in read_splits(curr)}
+    names = sorted(prev_splits.keys() | curr_splits.keys(),
+                   key=lambda name: _split_order(curr_splits.get(name) or prev_splits[name]))
+    # Matching splits are compared in parallel, zlib releases the GIL while
+    # stored entries are compressed for the download size
+    with create_executor('splits') as executor:
+        splits = list(executor.map(lambda name: _diff_split(name, prev_splits.get(name), curr_splits.get(name)),
+                                   names))
+    return BundleSection(error=None, splits=splits, configs=_device_configs(splits))
+
+
+def _format_size(was: int, now: int) -> str:
+    diff = now - was
+    return '{} -> {} ({})'.format(human_readable_size(was), human_readable_size(now), _format_diff(diff))
+
+
+def _format_diff(diff: int) -> str:
+    return '{}{}'.format(get_sign(diff), human_readable_size(diff))
+
+
+def device_config_name(config: DeviceConfigDiff) -> str:
+    return ' '.join(value for value in (config.abi, config.density, config.language) if value) or 'any device'
+
+
+def iter_bundle_section(section: BundleSection) -> Iterator[str]:
+    if section.error:
+        yield section.error
+        return
+    yield 'Splits:'
+    unchanged = 0
+    for split in section.splits:
+        if not split.changed_entries and split.file_size_was == split.file_size_now:
+            unchanged += 1
+            continue
+        yield '\t{}: {}, download {}, {} changed files'.format(
+            split.name, _format_size(split.file_size_was, split.file_size_now),
+            _format_diff(split.download_size_diff), split.changed_entries)
+    if unchanged:
+        yield '\t... and {} unchanged splits'.format(unchanged)
+    yield 'Device configurations:'
+    for config in section.configs:
+        yield '\t{}: install {}, download {}'.format(
+            device_config_name(config), _format_size(config.file_size_was, config.file_size_now),
+            _format_diff(config.download_size_diff))
@@ -0,0 +1,209 @@
+import argparse
+import collections
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+from typing import Optional
+
+from apkcomparator import __version__
+from apkcomparator.apk_reader import open_archive
+from apkcomparator.data import Apk, ApkAnalysis
+from utils.environment import get_temp_file
+from utils.exceptions import BadApkError
+from utils.logger import log
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+CACHE_SUFFIX = '.pickle'
+
+_directory = None
+_max_size = DEFAULT_MAX_SIZE
+_enabled = True
+# Analyses kept in memory by a long-running process, most recently used last
+_memory = collections.OrderedDict()
+_memory_entries = 0
+_memory_lock = threading.Lock()
+
+
+def configure_cache(directory: Optional[str] = None, max_size: int = DEFAULT_MAX_SIZE, enabled: bool = True):
+    global _directory, _max_size, _enabled
+    _directory = directory
+    _max_size = max_size
+    _enabled = enabled
+
+
+def configure_memory_cache(entries: int):
+    global _memory_entries
+    if entries < 0:
+        raise ValueError('Memory cache size must not be negative, got {}'.format(entries))
+    with _memory_lock:
+        _memory_entries = entries
+        while len(_memory) > entries:
+            _memory.popitem(last=False)
+
+
+def memory_cache_size() -> int:
+    with _memory_lock:
+        return len(_memory)
+
+
+def _load_from_memory(key: str) -> Optional[ApkAnalysis]:
+    with _memory_lock:
+        analysis = _memory.get(key)
+        if analysis is not None:
+            _memory.move_to_end(key)
+        return analysis
+
+
+def _store_in_memory(key: str, analysis: ApkAnalysis):
+    with _memory_lock:
+        if not _memory_entries:
+            return
+        _memory[key] = analysis
+        _memory.move_to_end(key)
+        while len(_memory) > _memory_entries:
+            _memory.popitem(last=False)
+
+
+def cache_directory() -> str:
+    directory = _directory or get_temp_file('cache')
+    if not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def apk_digest(apk: Apk) -> str:
+    # The central directory holds the name, CRC32 and sizes of every entry,
+    # so hashing it identifies the content without reading the whole APK.
+    with open_archive(apk.apk_path) as archive:
+        digest = hashlib.sha256(archive.central_directory())
+        digest.update(str(archive.size).encode())
+        return digest.hexdigest()
+
+
+def cache_key(apk: Apk, variant: str) -> Optional[str]:
+    if not _enabled and not _memory_entries:
+        return None
+    try:
+        return '{}-{}-{}'.format(apk_digest(apk), __version__, variant)
+    except (OSError, BadApkError) as e:
+        log().warning('Cannot cache analysis of {}: {}'.format(apk.apk_path, e))
+        return None
+
+
+def _cache_file(key: str) -> str:
+    return os.path.join(cache_directory(), key + CACHE_SUFFIX)
+
+
+def load_analysis(key: Optional[str]) -> Optional[ApkAnalysis]:
+    if key is None:
+        return None
+    analysis = _load_from_memory(key)
+    if analysis is not None:
+        log().info('Using analysis {} from memory'.format(key))
+        return analysis
+    if not _enabled:
+        return None
+    file = _cache_file(key)
+    try:
+        with open(file, 'rb') as stream:
+            analysis = pickle.load(stream)
+        # Touch the file so eviction drops the least recently used entries
+        os.utime(file)
+    except FileNotFoundError:
+        return None
+    except (OSError, pickle.UnpicklingError, AttributeError, EOFError, ImportError) as e:
+        log().warning('Dropping unreadable cache entry {}: {}'.format(file, e))
+        _remove(file)
+        return None
+    if not isinstance(analysis, ApkAnalysis):
+        _remove(file)
+        return None
+    log().info('Using cached analysis {}'.format(key))
+    _store_in_memory(key, analysis)
+    return analysis
+
+
+def store_analysis(key: Optional[str], analysis: ApkAnalysis):
+    if key is None:
+        return
+    _store_in_memory(key, analysis)
+    if not _enabled:
+        return
+    directory = cache_directory()
+    descriptor, temp_file = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as stream:
+            pickle.dump(analysis, stream, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, _cache_file(key))
+    except OSError as e:
+        log().warning('Failed to store cache entry {}: {}'.format(key, e))
+        _remove(temp_file)
+        return
+    evict(_max_size)
+
+
+def _cache_files() -> list[os.DirEntry]:
+    return [entry for entry in os.scandir(cache_directory())
+            if entry.is_file() and entry.name.endswith(CACHE_SUFFIX)]
+
+
+def _remove(file: str) -> bool:
+    try:
+        os.remove(file)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def evict(max_size: int):
+    files = []
+    for entry in _cache_files():
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, entry.path))
+    total_size = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total_size <= max_size:
+            break
+        if _remove(path):
+            log().info('Evicted cache entry {}'.format(os.path.basename(path)))
+        total_size -= size
+
+
+def invalidate(apk: Optional[Apk] = None) -> int:
+    prefix = apk_digest(apk) + '-' if apk else ''
+    removed = 0
+    for entry in _cache_files():
+        if entry.name.startswith(prefix) and _remove(entry.path):
+            removed += 1
+    return removed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Manage cached APK analyses')
+    parser.add_argument('--cache-dir', type=str, required=False,
+                        dest='cachedir', default=None,
+                        help='Cache directory. By default the cache is stored in utils/tmp/cache.')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--clear', action='store_true',
+                       dest='clear', default=False,
+                       help='Remove all cached analyses')
+    group.add_argument('--invalidate', type=str,
+                       dest='invalidate', default=None,
+                       help='Remove cached analyses of the given apk file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    configure_cache(args.cachedir)
+    removed = invalidate(Apk(args.invalidate) if args.invalidate else None)
+    log().info('Removed {} cache entries from {}'.format(removed, cache_directory()))
+
+
+if __name__ == '__main__':
+    main()
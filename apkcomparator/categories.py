@@ -0,0 +1,102 @@
+import collections
+import json
+from typing import Iterable, Optional
+
+DEFAULT_THRESHOLD = 1024
+OTHER_CATEGORY = 'Other'
+
+# Entries are kept in a category when abs(diff) is greater than the threshold
+Category = collections.namedtuple('Category', ('name', 'prefixes', 'suffixes', 'threshold'))
+
+DEFAULT_CATEGORIES = (
+    Category('Dex files', (), ('.dex',), DEFAULT_THRESHOLD),
+    Category('Libraries', ('lib/',), (), DEFAULT_THRESHOLD),
+    Category('Assets', ('assets/',), (), DEFAULT_THRESHOLD),
+    Category('Resources', ('res/',), (), DEFAULT_THRESHOLD),
+)
+
+
+class CategoryIndex(object):
+    # Rules are hashed by their length, so matching a path costs one dict
+    # lookup per distinct prefix (suffix) length instead of a scan of all rules.
+    def __init__(self, categories: Iterable[Category] = DEFAULT_CATEGORIES,
+                 other_threshold: int = DEFAULT_THRESHOLD):
+        self.categories = list(categories)
+        self.other = Category(OTHER_CATEGORY, (), (), other_threshold)
+        self._prefixes = collections.defaultdict(lambda: collections.defaultdict(list))
+        self._suffixes = collections.defaultdict(lambda: collections.defaultdict(list))
+        for index, category in enumerate(self.categories):
+            for prefix in category.prefixes:
+                self._prefixes[len(prefix)][prefix].append(index)
+            for suffix in category.suffixes:
+                self._suffixes[len(suffix)][suffix].append(index)
+        self._prefix_lengths = sorted(self._prefixes)
+        self._suffix_lengths = sorted(self._suffixes)
+
+    def match(self, path: str) -> set[int]:
+        matches = set()
+        path_length = len(path)
+        for length in self._prefix_lengths:
+            if length > path_length:
+                break
+            indices = self._prefixes[length].get(path[:length])
+            if indices:
+                matches.update(indices)
+        for length in self._suffix_lengths:
+            if length > path_length:
+                break
+            indices = self._suffixes[length].get(path[-length:])
+            if indices:
+                matches.update(indices)
+        return matches
+
+    def thresholds(self) -> set[int]:
+        return {category.threshold for category in self.categories} | {self.other.threshold}
+
+    def bucket(self, lines: Iterable) -> list[list]:
+        # An entry matching several rules is reported in each of them, like
+        # the original per-category filters did. The last bucket is "Other".
+        buckets = [[] for _ in range(len(self.categories) + 1)]
+        other = len(self.categories)
+        for line in lines:
+            matches = self.match(line.path)
+            size = abs(line.diff)
+            if not matches:
+                if size > self.other.threshold:
+                    buckets[other].append(line)
+                continue
+            for index in matches:
+                if size > self.categories[index].threshold:
+                    buckets[index].append(line)
+        return buckets
+
+
+def load_categories(file: str) -> CategoryIndex:
+    # {"threshold": 1024, "replace_defaults": false,
+    #  "categories": [{"name": "arm64", "prefixes": ["lib/arm64-v8a/"], "threshold": 0}]}
+    with open(file) as stream:
+        config = json.load(stream)
+    threshold = config.get('threshold', DEFAULT_THRESHOLD)
+    categories = [] if config.get('replace_defaults', False) else [
+        category._replace(threshold=threshold) for category in DEFAULT_CATEGORIES]
+    for category in config.get('categories', []):
+        if 'name' not in category:
+            raise RuntimeError('Category without name in {}'.format(file))
+        categories.append(Category(
+            name=category['name'],
+            prefixes=tuple(category.get('prefixes', ())),
+            suffixes=tuple(category.get('suffixes', ())),
+            threshold=category.get('threshold', threshold)))
+    return CategoryIndex(categories, config.get('other_threshold', threshold))
+
+
+_index = CategoryIndex()
+
+
+def configure_categories(file: Optional[str]):
+    global _index
+    _index = load_categories(file) if file else CategoryIndex()
+
+
+def get_category_index() -> CategoryIndex:
+    return _index
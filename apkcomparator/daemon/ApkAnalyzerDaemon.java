@@ -0,0 +1,110 @@
+import java.io.BufferedInputStream;
+import java.io.BufferedOutputStream;
+import java.io.ByteArrayOutputStream;
+import java.io.DataInputStream;
+import java.io.DataOutputStream;
+import java.io.EOFException;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.PrintStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.nio.charset.StandardCharsets;
+import java.security.Permission;
+
+// Keeps apkanalyzer loaded in one JVM and runs its command line entry point
+// once per request.
+//
+// Request:  int argc, then argc times (int length, UTF-8 bytes). argc == 0 is a ping.
+// Response: int exit status, int length, stdout bytes, int length, stderr bytes.
+// All integers are big-endian.
+public final class ApkAnalyzerDaemon {
+    private static final String CLI = "com.android.tools.apk.analyzer.ApkAnalyzerCli";
+
+    private static final class ExitException extends SecurityException {
+        final int status;
+
+        ExitException(int status) {
+            super("System.exit(" + status + ")");
+            this.status = status;
+        }
+    }
+
+    public static void main(String[] args) throws Exception {
+        DataInputStream requests = new DataInputStream(new BufferedInputStream(System.in));
+        DataOutputStream responses = new DataOutputStream(
+                new BufferedOutputStream(new FileOutputStream(FileDescriptor.out)));
+        PrintStream stderr = System.err;
+        // Anything printed outside of a request must not corrupt the protocol
+        System.setOut(stderr);
+        Method cli = Class.forName(CLI).getMethod("main", String[].class);
+        System.setSecurityManager(new SecurityManager() {
+            @Override
+            public void checkPermission(Permission permission) {
+            }
+
+            @Override
+            public void checkExit(int status) {
+                throw new ExitException(status);
+            }
+        });
+
+        while (true) {
+            String[] request;
+            try {
+                request = readRequest(requests);
+            } catch (EOFException e) {
+                return;
+            }
+            ByteArrayOutputStream out = new ByteArrayOutputStream();
+            ByteArrayOutputStream err = new ByteArrayOutputStream();
+            int status = 0;
+            if (request.length > 0) {
+                System.setOut(new PrintStream(out, true, "UTF-8"));
+                System.setErr(new PrintStream(err, true, "UTF-8"));
+                try {
+                    cli.invoke(null, (Object) request);
+                } catch (InvocationTargetException e) {
+                    status = statusOf(e.getCause());
+                } catch (ExitException e) {
+                    status = e.status;
+                } finally {
+                    System.out.flush();
+                    System.err.flush();
+                    System.setOut(stderr);
+                    System.setErr(stderr);
+                }
+            }
+            writeResponse(responses, status, out.toByteArray(), err.toByteArray());
+        }
+    }
+
+    private static int statusOf(Throwable error) {
+        if (error instanceof ExitException) {
+            return ((ExitException) error).status;
+        }
+        error.printStackTrace(System.err);
+        return 1;
+    }
+
+    private static String[] readRequest(DataInputStream requests) throws IOException {
+        String[] request = new String[requests.readInt()];
+        for (int i = 0; i < request.length; i++) {
+            byte[] argument = new byte[requests.readInt()];
+            requests.readFully(argument);
+            request[i] = new String(argument, StandardCharsets.UTF_8);
+        }
+        return request;
+    }
+
+    private static void writeResponse(DataOutputStream responses, int status, byte[] out, byte[] err)
+            throws IOException {
+        responses.writeInt(status);
+        responses.writeInt(out.length);
+        responses.write(out);
+        responses.writeInt(err.length);
+        responses.write(err);
+        responses.flush();
+    }
+}
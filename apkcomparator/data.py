@@ -1,4 +1,5 @@
 import collections
+from typing import Callable, Iterable, Iterator
 
 from utils.stringify import stringify
 
@@ -10,9 +11,104 @@ class Apk(object):
 
 
 class ApkCompareReport(object):
-    def __init__(self, report: str):
-        self.report = report
+    # Sections are computed lazily and in order, so the first ones can be
+    # rendered while the analyses behind the later ones are still running.
+    def __init__(self, sections: Iterable[Callable[[], object]]):
+        self.sections = list(sections)
+        self._resolved = []
+
+    def iter_sections(self) -> Iterator[object]:
+        for index, section in enumerate(self.sections):
+            if index == len(self._resolved):
+                self._resolved.append(section())
+            yield self._resolved[index]
 
 
 ApkPlainData = collections.namedtuple(
     'ApkPlainData', ('download_size', 'file_size', 'methods_count'))
+
+ApkAnalysis = collections.namedtuple(
+    'ApkAnalysis', ('plain_data', 'manifest', 'parsed_manifest', 'dex_packages', 'duplicates'), defaults=(None, None))
+
+# patch_size is only estimated on request
+PlainDataSection = collections.namedtuple(
+    'PlainDataSection', ('prev', 'curr', 'patch_size'), defaults=(None,))
+
+# Lines of a category are the changed entries above its threshold, sorted by diff
+CategoryReport = collections.namedtuple('CategoryReport', ('name', 'threshold', 'total_diff', 'lines'))
+
+FilesSection = collections.namedtuple('FilesSection', ('thresholds', 'categories'))
+
+# Set differences fill added/removed, single values fill was/now
+ManifestDifference = collections.namedtuple(
+    'ManifestDifference', ('description', 'was', 'now', 'added', 'removed'))
+
+ManifestSection = collections.namedtuple('ManifestSection', ('error', 'differences', 'manual_checks'))
+
+# kind is "added", "removed" or "changed", attribute is only set for changed attributes
+ManifestChange = collections.namedtuple('ManifestChange', ('kind', 'path', 'attribute', 'was', 'now'))
+
+ExportedComponentChange = collections.namedtuple(
+    'ExportedComponentChange', ('path', 'exported_was', 'exported_now', 'permission_was', 'permission_now'))
+
+ManifestTreeSection = collections.namedtuple('ManifestTreeSection', ('error', 'changes', 'exported'))
+
+PackageDiff = collections.namedtuple('PackageDiff', (
+    'package', 'classes_was', 'classes_now', 'methods_was', 'methods_now', 'fields_was', 'fields_now',
+    'size_was', 'size_now'))
+
+# Packages are ranked by the absolute size diff, then by the method diff
+DexPackagesSection = collections.namedtuple('DexPackagesSection', ('error', 'packages'))
+
+StringPoolDiff = collections.namedtuple('StringPoolDiff', (
+    'name', 'strings_was', 'strings_now', 'size_was', 'size_now'))
+
+# Resources are compared by name, entries are counted over all configurations
+ResourceTypeDiff = collections.namedtuple('ResourceTypeDiff', (
+    'type', 'entries_was', 'entries_now', 'added', 'removed', 'configs_added', 'configs_removed'))
+
+ResourcesSection = collections.namedtuple('ResourcesSection', ('error', 'string_pools', 'types'))
+
+SizeDiff = collections.namedtuple('SizeDiff', ('name', 'size_was', 'size_now'))
+
+# Sections and symbols are sorted by the absolute size diff, symbols are the top growing ones
+NativeLibraryDiff = collections.namedtuple(
+    'NativeLibraryDiff', ('path', 'abi', 'size_was', 'size_now', 'sections', 'symbols'))
+
+# Rollup of the changed libraries of one ABI, sections are summed over them
+AbiDiff = collections.namedtuple('AbiDiff', ('abi', 'libraries', 'size_was', 'size_now', 'sections'))
+
+NativeLibrariesSection = collections.namedtuple('NativeLibrariesSection', ('error', 'abis', 'libraries'))
+
+# Download sizes are estimated per entry, category diffs sum the entries of each category
+EntryDownloadDiff = collections.namedtuple('EntryDownloadDiff', ('path', 'size_was', 'size_now'))
+
+CategoryDownloadDiff = collections.namedtuple('CategoryDownloadDiff', ('name', 'diff'))
+
+DownloadSizeSection = collections.namedtuple('DownloadSizeSection', ('error', 'categories', 'entries'))
+
+# Splits of bundles are matched by name, an absent split has zero sizes. Only
+# changed entries are compressed again, so the download size is a diff.
+SplitDiff = collections.namedtuple('SplitDiff', (
+    'name', 'module', 'dimension', 'value', 'file_size_was', 'file_size_now', 'download_size_diff',
+    'changed_entries'))
+
+# Sizes of all splits a device with this ABI, density and language installs
+DeviceConfigDiff = collections.namedtuple('DeviceConfigDiff', (
+    'abi', 'density', 'language', 'file_size_was', 'file_size_now', 'download_size_diff'))
+
+BundleSection = collections.namedtuple('BundleSection', ('error', 'splits', 'configs'))
+
+# Entries with the same SHA-256, wasted is the compressed size of all copies but the smallest
+DuplicateGroup = collections.namedtuple('DuplicateGroup', ('digest', 'crc', 'size', 'paths', 'wasted'))
+
+IntroducedDuplicate = collections.namedtuple('IntroducedDuplicate', ('path', 'size', 'copy_of'))
+
+DuplicatesSection = collections.namedtuple(
+    'DuplicatesSection', ('error', 'wasted_was', 'wasted_now', 'groups', 'introduced'))
+
+# severity is "error" or "warning", only errors fail the budget
+BudgetViolation = collections.namedtuple('BudgetViolation', ('rule', 'severity', 'message'))
+
+# A fail-fast evaluation stops at the first failing check, skipped lists the checks after it
+BudgetSection = collections.namedtuple('BudgetSection', ('rules', 'violations', 'skipped', 'stopped'))
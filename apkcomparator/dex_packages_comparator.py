@@ -0,0 +1,54 @@
+from typing import Iterator, Optional
+
+from apkcomparator.data import DexPackagesSection, PackageDiff
+from apkcomparator.dex_reader import DexPackages
+from utils.numbers import get_sign, human_readable_size
+
+# The text report only lists the packages that changed the most
+TEXT_LIMIT = 30
+
+
+def _rows(table: DexPackages) -> dict[str, tuple[int, int, int, int]]:
+    return {name: (table.classes[index], table.methods[index], table.fields[index], table.sizes[index])
+            for index, name in enumerate(table.names)}
+
+
+def diff_dex_packages(prev: Optional[DexPackages], curr: Optional[DexPackages]) -> DexPackagesSection:
+    if prev is None or curr is None:
+        return DexPackagesSection(error='Cannot get dex packages', packages=[])
+    prev_rows = _rows(prev)
+    curr_rows = _rows(curr)
+    empty = (0, 0, 0, 0)
+    packages = []
+    for package in prev_rows.keys() | curr_rows.keys():
+        was = prev_rows.get(package, empty)
+        now = curr_rows.get(package, empty)
+        if was != now:
+            packages.append(PackageDiff(package, was[0], now[0], was[1], now[1], was[2], now[2], was[3], now[3]))
+    packages.sort(key=lambda diff: (-abs(diff.size_now - diff.size_was), -abs(diff.methods_now - diff.methods_was),
+                                    diff.package))
+    return DexPackagesSection(error=None, packages=packages)
+
+
+def _format_count(was: int, now: int) -> str:
+    diff = now - was
+    return '{} -> {} ({}{})'.format(was, now, get_sign(diff), abs(diff))
+
+
+def iter_dex_packages_section(section: DexPackagesSection) -> Iterator[str]:
+    if section.error:
+        yield section.error
+        return
+    if not section.packages:
+        return
+    yield 'Dex packages:'
+    for diff in section.packages[:TEXT_LIMIT]:
+        size_diff = diff.size_now - diff.size_was
+        yield '\t{}'.format(diff.package or '<default package>')
+        yield '\t\tSize: {} -> {} ({}{})'.format(human_readable_size(diff.size_was), human_readable_size(diff.size_now),
+                                                 get_sign(size_diff), human_readable_size(size_diff))
+        yield '\t\tMethods: {}'.format(_format_count(diff.methods_was, diff.methods_now))
+        yield '\t\tFields: {}'.format(_format_count(diff.fields_was, diff.fields_now))
+        yield '\t\tClasses: {}'.format(_format_count(diff.classes_was, diff.classes_now))
+    if len(section.packages) > TEXT_LIMIT:
+        yield '\t... and {} more changed packages'.format(len(section.packages) - TEXT_LIMIT)
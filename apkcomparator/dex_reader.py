@@ -0,0 +1,204 @@
+import collections
+import re
+import struct
+import sys
+from array import array
+
+from apkcomparator.apk_reader import ZipArchive
+from utils.exceptions import BadApkError
+
+#
+# https://source.android.com/docs/core/runtime/dex-format#header-item
+#
+DEX_MAGIC = b'dex\n'
+HEADER_SIZE = 0x70
+ENDIAN_CONSTANT = 0x12345678
+
+_DEX_ENTRY_PATTERN = re.compile(r'^classes(\d*)\.dex$')
+_HEADER = struct.Struct('<8sI20s20I')
+
+DexHeader = collections.namedtuple('DexHeader', (
+    'string_ids_size', 'string_ids_off', 'type_ids_size', 'type_ids_off',
+    'proto_ids_size', 'proto_ids_off', 'field_ids_size', 'field_ids_off',
+    'method_ids_size', 'method_ids_off', 'class_defs_size', 'class_defs_off',
+    'data_size', 'data_off'))
+
+DexCounts = collections.namedtuple(
+    'DexCounts', ('name', 'methods', 'fields', 'classes', 'strings', 'types'))
+
+DexReferences = collections.namedtuple('DexReferences', ('dex_counts', 'methods', 'fields', 'packages'))
+
+
+def dex_entry_names(archive: ZipArchive) -> list[str]:
+    names = [name for name in archive.entries if _DEX_ENTRY_PATTERN.match(name)]
+    return sorted(names, key=lambda name: int(_DEX_ENTRY_PATTERN.match(name).group(1) or 1))
+
+
+def parse_header(data: bytes, name: str) -> DexHeader:
+    if len(data) < HEADER_SIZE or not data.startswith(DEX_MAGIC):
+        raise BadApkError('{} is not a dex file'.format(name))
+    fields = _HEADER.unpack_from(data, 0)
+    if fields[5] != ENDIAN_CONSTANT:
+        raise BadApkError('{} has unsupported endianness'.format(name))
+    # Skip magic, checksum, signature, file and header sizes, endian tag, link and map
+    return DexHeader(*fields[9:])
+
+
+def _read_uleb128(data: bytes, offset: int):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, offset
+        shift += 7
+
+
+def read_string(data: bytes, string_ids_off: int, index: int) -> str:
+    string_data_off = struct.unpack_from('<I', data, string_ids_off + index * 4)[0]
+    _, offset = _read_uleb128(data, string_data_off)
+    end = data.index(b'\0', offset)
+    return data[offset:end].decode('utf-8', 'replace')
+
+
+def package_of(descriptor: str) -> str:
+    # Lcom/example/Foo; -> com.example, arrays and primitives have no package
+    if not descriptor.startswith('L'):
+        return ''
+    return descriptor[1:descriptor.rfind('/')].replace('/', '.') if '/' in descriptor else ''
+
+
+def count_methods_by_package(data: bytes, header: DexHeader) -> collections.Counter:
+    # method_id_item is (class_idx: u16, proto_idx: u16, name_idx: u32)
+    class_indices = array('H', data[header.method_ids_off:header.method_ids_off + header.method_ids_size * 8])
+    if sys.byteorder != 'little':
+        class_indices.byteswap()
+    references_by_type = collections.Counter(class_indices[::4])
+    packages = collections.Counter()
+    for type_index, count in references_by_type.items():
+        descriptor_index = struct.unpack_from('<I', data, header.type_ids_off + type_index * 4)[0]
+        packages[package_of(read_string(data, header.string_ids_off, descriptor_index))] += count
+    return packages
+
+
+# Columns of a per-package table, row i of every array belongs to names[i]
+DexPackages = collections.namedtuple('DexPackages', ('names', 'classes', 'methods', 'fields', 'sizes'))
+
+_CODE_ITEM = struct.Struct('<4H2I')
+_CODE_ITEM_HEADER_SIZE = 16
+_TRY_ITEM_SIZE = 8
+
+
+class DexPackagesBuilder(object):
+    # Methods and fields are the references declared by classes of a package,
+    # like methods_count. Sizes are the class data and code items of the
+    # classes defined in a package; exception handler lists are not counted.
+    def __init__(self):
+        self._index = {}
+        self.table = DexPackages(names=[], classes=array('q'), methods=array('q'), fields=array('q'),
+                                 sizes=array('q'))
+
+    def _package_index(self, package: str) -> int:
+        index = self._index.get(package)
+        if index is None:
+            index = self._index[package] = len(self.table.names)
+            self.table.names.append(package)
+            for column in self.table[1:]:
+                column.append(0)
+        return index
+
+    def add_dex(self, data: bytes, header: DexHeader):
+        type_packages = {}
+
+        def package_index(type_index: int) -> int:
+            index = type_packages.get(type_index)
+            if index is None:
+                descriptor_index = struct.unpack_from('<I', data, header.type_ids_off + type_index * 4)[0]
+                index = type_packages[type_index] = self._package_index(
+                    package_of(read_string(data, header.string_ids_off, descriptor_index)))
+            return index
+
+        # method_id_item and field_id_item both start with class_idx: u16 and take 8 bytes
+        for column, offset, size in ((self.table.methods, header.method_ids_off, header.method_ids_size),
+                                     (self.table.fields, header.field_ids_off, header.field_ids_size)):
+            class_indices = array('H', data[offset:offset + size * 8])
+            if sys.byteorder != 'little':
+                class_indices.byteswap()
+            for type_index, count in collections.Counter(class_indices[::4]).items():
+                column[package_index(type_index)] += count
+
+        # class_def_item is 8 u32: class_idx, ..., class_data_off at 6, ...
+        class_defs = array('I', data[header.class_defs_off:header.class_defs_off + header.class_defs_size * 32])
+        if sys.byteorder != 'little':
+            class_defs.byteswap()
+        classes, sizes = self.table.classes, self.table.sizes
+        for class_index, class_data_off in zip(class_defs[::8], class_defs[6::8]):
+            index = package_index(class_index)
+            classes[index] += 1
+            if class_data_off:
+                sizes[index] += _class_data_size(data, class_data_off)
+
+
+def _class_data_size(data: bytes, offset: int) -> int:
+    start = offset
+    counts = []
+    for _ in range(4):
+        value, offset = _read_uleb128(data, offset)
+        counts.append(value)
+    static_fields, instance_fields, direct_methods, virtual_methods = counts
+    # encoded_field is two ulebs, their last bytes are the only ones below 0x80
+    for _ in range((static_fields + instance_fields) * 2):
+        while data[offset] >= 0x80:
+            offset += 1
+        offset += 1
+    size = 0
+    for _ in range(direct_methods + virtual_methods):
+        # encoded_method: method_idx_diff, access_flags, code_off
+        for _ in range(2):
+            while data[offset] >= 0x80:
+                offset += 1
+            offset += 1
+        code_off, offset = _read_uleb128(data, offset)
+        if code_off:
+            _, _, _, tries_size, _, insns_size = _CODE_ITEM.unpack_from(data, code_off)
+            size += _CODE_ITEM_HEADER_SIZE + insns_size * 2
+            if tries_size:
+                size += (insns_size & 1) * 2 + tries_size * _TRY_ITEM_SIZE
+    return size + offset - start
+
+
+def count_packages(archive: ZipArchive) -> DexPackages:
+    builder = DexPackagesBuilder()
+    for name in dex_entry_names(archive):
+        data = archive.read(archive.entries[name])
+        builder.add_dex(data, parse_header(data, name))
+    return builder.table
+
+
+def count_references(archive: ZipArchive, by_package: bool = False) -> DexReferences:
+    dex_counts = []
+    packages = collections.Counter() if by_package else None
+    for name in dex_entry_names(archive):
+        entry = archive.entries[name]
+        data = archive.read(entry) if by_package else archive.read(entry, HEADER_SIZE)
+        header = parse_header(data, name)
+        dex_counts.append(DexCounts(
+            name=name,
+            methods=header.method_ids_size,
+            fields=header.field_ids_size,
+            classes=header.class_defs_size,
+            strings=header.string_ids_size,
+            types=header.type_ids_size))
+        if by_package:
+            packages.update(count_methods_by_package(data, header))
+    return DexReferences(
+        dex_counts=dex_counts,
+        methods=sum(counts.methods for counts in dex_counts),
+        fields=sum(counts.fields for counts in dex_counts),
+        packages=packages)
+
+
+def count_methods(archive: ZipArchive) -> int:
+    return count_references(archive).methods
@@ -0,0 +1,100 @@
+import zlib
+from typing import Iterable, Iterator, Optional
+
+from apkcomparator.apk_reader import COMPRESSION_STORED, ZipArchive, ZipEntry
+from apkcomparator.categories import CategoryIndex, get_category_index
+from apkcomparator.data import CategoryDownloadDiff, DownloadSizeSection, EntryDownloadDiff
+from apkcomparator.zip_differ import iter_changed_entries
+from utils.concurrency import create_executor, get_parallelism
+from utils.lru import LruCache
+from utils.numbers import get_sign, human_readable_size
+
+# Store delivery compresses the whole file, so already deflated entries
+# are taken as is and only stored entries are compressed again.
+COMPRESSION_LEVEL = 9
+# The text report only lists the entries that changed the most
+TEXT_LIMIT = 20
+
+# Estimates remembered by a long-running process, about 25 MB
+MAX_ESTIMATES = 100000
+
+# (crc, uncompressed size) -> download size of a stored entry, shared by
+# every archive in the process, so a baseline is compressed once per batch
+_estimates = LruCache(MAX_ESTIMATES)
+
+
+def _compress_entry(archive: ZipArchive, entry: ZipEntry) -> int:
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+    compressed_size = 0
+    for chunk in archive.iter_raw_chunks(entry):
+        compressed_size += len(compressor.compress(chunk))
+    compressed_size += len(compressor.flush())
+    return min(compressed_size, entry.compressed_size)
+
+
+def estimate_entry(archive: ZipArchive, entry: ZipEntry) -> int:
+    if entry.compression != COMPRESSION_STORED or entry.compressed_size == 0:
+        return entry.compressed_size
+    key = (entry.crc, entry.uncompressed_size)
+    size = _estimates.get(key)
+    if size is None:
+        size = _compress_entry(archive, entry)
+        _estimates.put(key, size)
+    return size
+
+
+def estimate_entries(archive: ZipArchive, entries: Iterable[Optional[ZipEntry]]) -> list[int]:
+    # zlib releases the GIL while compressing, so entries are compressed in
+    # parallel threads straight from the mapped archive
+    entries = list(entries)
+    pending = sum(1 for entry in entries if entry is not None and entry.compression == COMPRESSION_STORED)
+    if pending < 2 or get_parallelism() < 2:
+        return [estimate_entry(archive, entry) if entry is not None else 0 for entry in entries]
+    with create_executor('zlib') as executor:
+        return list(executor.map(lambda entry: estimate_entry(archive, entry) if entry is not None else 0, entries))
+
+
+def estimate_download_size(archive: ZipArchive) -> int:
+    entries = list(archive.entries.values())
+    return archive.size - sum(entry.compressed_size for entry in entries) + sum(estimate_entries(archive, entries))
+
+
+def diff_download_sizes(prev: ZipArchive, curr: ZipArchive,
+                        index: Optional[CategoryIndex] = None) -> DownloadSizeSection:
+    index = index or get_category_index()
+    changed = list(iter_changed_entries(prev, curr))
+    prev_sizes = estimate_entries(prev, (lhs for _, lhs, _ in changed))
+    curr_sizes = estimate_entries(curr, (rhs for _, _, rhs in changed))
+    entries = [EntryDownloadDiff(path=path, size_was=was, size_now=now)
+               for (path, _, _), was, now in zip(changed, prev_sizes, curr_sizes) if was != now]
+    entries.sort(key=lambda entry: (-abs(entry.size_now - entry.size_was), entry.path))
+    names = [category.name for category in index.categories] + [index.other.name]
+    totals = [0] * len(names)
+    for entry in entries:
+        # An entry matching several categories counts in each of them, like in the files section
+        for category in index.match(entry.path) or (len(names) - 1,):
+            totals[category] += entry.size_now - entry.size_was
+    categories = [CategoryDownloadDiff(name=name, diff=diff) for name, diff in zip(names, totals) if diff]
+    return DownloadSizeSection(error=None, categories=categories, entries=entries)
+
+
+def _format_size(was: int, now: int) -> str:
+    diff = now - was
+    return '{} -> {} ({}{})'.format(human_readable_size(was), human_readable_size(now), get_sign(diff),
+                                    human_readable_size(diff))
+
+
+def iter_download_size_section(section: DownloadSizeSection) -> Iterator[str]:
+    if section.error:
+        yield section.error
+        return
+    if not section.entries:
+        return
+    yield 'Download size by category:'
+    for category in section.categories:
+        yield '\t{}: {}{}'.format(category.name, get_sign(category.diff), human_readable_size(category.diff))
+    yield 'Download size by entry:'
+    for entry in section.entries[:TEXT_LIMIT]:
+        yield '\t{}: {}'.format(entry.path, _format_size(entry.size_was, entry.size_now))
+    if len(section.entries) > TEXT_LIMIT:
+        yield '\t... and {} more changed entries'.format(len(section.entries) - TEXT_LIMIT)
@@ -0,0 +1,119 @@
+import hashlib
+from typing import Iterable, Iterator, Optional
+
+from apkcomparator.apk_reader import ZipArchive, ZipEntry
+from apkcomparator.data import DuplicateGroup, DuplicatesSection, IntroducedDuplicate
+from utils.concurrency import create_executor, get_parallelism
+from utils.lru import LruCache
+from utils.numbers import get_sign, human_readable_size
+
+# The text report only lists the groups that waste the most
+TEXT_LIMIT = 20
+
+# Digests remembered by a long-running process, about 40 MB
+MAX_DIGESTS = 100000
+
+# (path, crc, uncompressed size) -> SHA-256 of the entry. Filled by every
+# hashed entry and by the groups of cached analyses, so an entry that did not
+# change since an analyzed apk is not hashed again.
+_digests = LruCache(MAX_DIGESTS)
+
+
+def remember_duplicates(groups: Optional[Iterable[DuplicateGroup]]):
+    for group in groups or ():
+        for path in group.paths:
+            _digests.put((path, group.crc, group.size), group.digest)
+
+
+def hash_entry(archive: ZipArchive, entry: ZipEntry) -> str:
+    key = (entry.name, entry.crc, entry.uncompressed_size)
+    digest = _digests.get(key)
+    if digest is None:
+        sha256 = hashlib.sha256()
+        for chunk in archive.iter_chunks(entry):
+            sha256.update(chunk)
+        digest = sha256.hexdigest()
+        _digests.put(key, digest)
+    return digest
+
+
+def _hash_entries(archive: ZipArchive, entries: list[ZipEntry]) -> list[str]:
+    # hashlib and zlib release the GIL on large buffers
+    if len(entries) < 2 or get_parallelism() < 2:
+        return [hash_entry(archive, entry) for entry in entries]
+    with create_executor('sha256') as executor:
+        return list(executor.map(lambda entry: hash_entry(archive, entry), entries))
+
+
+def find_duplicates(archive: ZipArchive) -> list[DuplicateGroup]:
+    # Entries can only be equal with equal CRC and size, only those are hashed
+    candidates = {}
+    for entry in archive.entries.values():
+        if entry.uncompressed_size > 0:
+            candidates.setdefault((entry.crc, entry.uncompressed_size), []).append(entry)
+    colliding = [entry for entries in candidates.values() if len(entries) > 1 for entry in entries]
+    by_digest = {}
+    for entry, digest in zip(colliding, _hash_entries(archive, colliding)):
+        by_digest.setdefault(digest, []).append(entry)
+    groups = []
+    for digest, entries in by_digest.items():
+        if len(entries) < 2:
+            continue
+        entries.sort(key=lambda entry: entry.name)
+        sizes = [entry.compressed_size for entry in entries]
+        # One copy is needed, the rest is wasted
+        groups.append(DuplicateGroup(digest=digest, crc=entries[0].crc, size=entries[0].uncompressed_size,
+                                     paths=[entry.name for entry in entries], wasted=sum(sizes) - min(sizes)))
+    groups.sort(key=lambda group: (-group.wasted, group.paths[0]))
+    return groups
+
+
+def entry_contents(archive: ZipArchive) -> dict[str, tuple[int, int]]:
+    return {entry.name: (entry.crc, entry.uncompressed_size) for entry in archive.entries.values()}
+
+
+def _introduced(group: DuplicateGroup, prev_contents: dict[str, tuple[int, int]],
+                prev_partners: dict[str, list[str]]) -> list[IntroducedDuplicate]:
+    # A path is an old copy when it already had this content, like in the files
+    # section the CRC and size tell, or when it was a duplicate of another path
+    # of the group and both changed together
+    content = (group.crc, group.size)
+    paths = set(group.paths)
+    old = [path for path in group.paths
+           if prev_contents.get(path) == content or paths.intersection(prev_partners.get(path, ()))]
+    originals = old or group.paths[:1]
+    return [IntroducedDuplicate(path=path, size=group.size, copy_of=originals[0])
+            for path in group.paths if path not in originals]
+
+
+def diff_duplicates(prev: Optional[list[DuplicateGroup]], curr: Optional[list[DuplicateGroup]],
+                    prev_contents: Optional[dict[str, tuple[int, int]]]) -> DuplicatesSection:
+    if prev is None or curr is None or prev_contents is None:
+        return DuplicatesSection(error='Cannot find duplicates', wasted_was=0, wasted_now=0, groups=[], introduced=[])
+    prev_partners = {path: [partner for partner in group.paths if partner != path]
+                     for group in prev for path in group.paths}
+    introduced = [duplicate for group in curr for duplicate in _introduced(group, prev_contents, prev_partners)]
+    return DuplicatesSection(error=None, wasted_was=sum(group.wasted for group in prev),
+                             wasted_now=sum(group.wasted for group in curr), groups=curr, introduced=introduced)
+
+
+def iter_duplicates_section(section: DuplicatesSection) -> Iterator[str]:
+    if section.error:
+        yield section.error
+        return
+    if not section.groups and not section.wasted_was:
+        return
+    diff = section.wasted_now - section.wasted_was
+    yield 'Duplicates: {} groups, wasted {} (diff: {}{})'.format(
+        len(section.groups), human_readable_size(section.wasted_now), get_sign(diff), human_readable_size(diff))
+    for group in section.groups[:TEXT_LIMIT]:
+        yield '\t{} x{}, wasted {}'.format(human_readable_size(group.size), len(group.paths),
+                                           human_readable_size(group.wasted))
+        for path in group.paths:
+            yield '\t\t{}'.format(path)
+    if len(section.groups) > TEXT_LIMIT:
+        yield '\t... and {} more groups'.format(len(section.groups) - TEXT_LIMIT)
+    if section.introduced:
+        yield 'New duplicates:'
+        for duplicate in section.introduced:
+            yield '\t{}: copy of {} ({})'.format(duplicate.path, duplicate.copy_of, human_readable_size(duplicate.size))
@@ -0,0 +1,102 @@
+import collections
+import struct
+
+from apkcomparator.apk_reader import ZipArchive, ZipEntry
+from utils.exceptions import BadApkError
+
+#
+# https://refspecs.linuxfoundation.org/elf/gabi4+/ch4.eheader.html
+#
+ELF_MAGIC = b'\x7fELF'
+ELF_CLASS_32 = 1
+ELF_CLASS_64 = 2
+ELF_DATA_LITTLE = 1
+ELF_DATA_BIG = 2
+
+SHT_SYMTAB = 2
+SHT_NOBITS = 8
+SHT_DYNSYM = 11
+SHN_UNDEF = 0
+SHN_LORESERVE = 0xff00
+STT_OBJECT = 1
+STT_FUNC = 2
+
+_IDENT = struct.Struct('4sBB')
+_IDENT_SIZE = 16
+# Per class: ELF header after e_ident, section header and symbol layouts
+_LAYOUTS = {
+    ELF_CLASS_32: ('HHIIIIIHHHHHH', 'IIIIIIIIII', 'IIIBBH'),
+    ELF_CLASS_64: ('HHIQQQIHHHHHH', 'IIQQQQIIQQ', 'IBBHQQ'),
+}
+_BYTE_ORDERS = {ELF_DATA_LITTLE: '<', ELF_DATA_BIG: '>'}
+
+# Sizes are the bytes the section takes in the file, .bss and other NOBITS
+# sections are skipped. Symbols are functions and objects by raw name.
+ElfSummary = collections.namedtuple('ElfSummary', ('sections', 'symbols'))
+
+EMPTY_SUMMARY = ElfSummary(sections={}, symbols={})
+
+
+def _read_string(strings: bytes, offset: int) -> bytes:
+    end = strings.find(b'\0', offset)
+    return strings[offset:end if end >= 0 else len(strings)]
+
+
+def _symbol_sizes(data, start: int, end: int, header: struct.Struct, table, strings, name: str) -> dict[bytes, int]:
+    _, _, _, _, offset, size, _, _, _, entry_size = table
+    _, _, _, _, strings_offset, strings_size, _, _, _, _ = strings
+    if entry_size != header.size or start + offset + size > end or start + strings_offset + strings_size > end:
+        raise BadApkError('{} has a corrupted symbol table'.format(name))
+    names = bytes(data[start + strings_offset:start + strings_offset + strings_size])
+    symbols = {}
+    for fields in header.iter_unpack(data[start + offset:start + offset + size]):
+        if header.size == 16:
+            name_offset, _, symbol_size, info, _, section = fields
+        else:
+            name_offset, info, _, section, _, symbol_size = fields
+        if not symbol_size or section == SHN_UNDEF or section >= SHN_LORESERVE or info & 0xf not in (
+                STT_FUNC, STT_OBJECT):
+            continue
+        key = _read_string(names, name_offset)
+        symbols[key] = symbols.get(key, 0) + symbol_size
+    return symbols
+
+
+def parse_elf(data, start: int, end: int, name: str) -> ElfSummary:
+    magic, elf_class, byte_order = _IDENT.unpack_from(data, start)
+    if magic != ELF_MAGIC or elf_class not in _LAYOUTS or byte_order not in _BYTE_ORDERS:
+        raise BadApkError('{} is not an ELF file'.format(name))
+    prefix = _BYTE_ORDERS[byte_order]
+    elf_header, section_layout, symbol_layout = (struct.Struct(prefix + layout) for layout in _LAYOUTS[elf_class])
+    header = elf_header.unpack_from(data, start + _IDENT_SIZE)
+    section_offset, section_entry_size, section_count, names_index = header[5], header[10], header[11], header[12]
+    if not section_count:
+        return EMPTY_SUMMARY
+    if (section_entry_size != section_layout.size or names_index >= section_count or
+            start + section_offset + section_count * section_entry_size > end):
+        raise BadApkError('{} has a corrupted section header table'.format(name))
+    headers = list(section_layout.iter_unpack(
+        data[start + section_offset:start + section_offset + section_count * section_entry_size]))
+    names = headers[names_index]
+    if start + names[4] + names[5] > end:
+        raise BadApkError('{} has a corrupted section name table'.format(name))
+    section_names = bytes(data[start + names[4]:start + names[4] + names[5]])
+    sections = {}
+    symbol_table = None
+    for section in headers:
+        section_type, section_size = section[1], section[5]
+        if section_type == SHT_NOBITS or not section_size:
+            continue
+        section_name = _read_string(section_names, section[0]).decode('utf-8', 'replace')
+        sections[section_name] = sections.get(section_name, 0) + section_size
+        # The full symbol table is preferred, stripped libraries only have the dynamic one
+        if section_type == SHT_SYMTAB or (section_type == SHT_DYNSYM and symbol_table is None):
+            symbol_table = section
+    symbols = {}
+    if symbol_table is not None and symbol_table[6] < section_count:
+        symbols = _symbol_sizes(data, start, end, symbol_layout, symbol_table, headers[symbol_table[6]], name)
+    return ElfSummary(sections=sections, symbols=symbols)
+
+
+def read_elf(archive: ZipArchive, entry: ZipEntry) -> ElfSummary:
+    return parse_elf(*archive.buffer_range(entry), entry.name)
@@ -0,0 +1,240 @@
+import collections
+from typing import Iterator, Optional
+from xml.parsers import expat
+
+from apkcomparator.android_manifest_comparator import ANDROID_NAMESPACE, ANDROID_PREFIX, TAG_MANIFEST
+from apkcomparator.data import ExportedComponentChange, ManifestChange, ManifestTreeSection
+
+ATTR_NAME = ANDROID_PREFIX + ':name'
+ATTR_EXPORTED = ANDROID_PREFIX + ':exported'
+ATTR_PERMISSION = ANDROID_PREFIX + ':permission'
+TAG_INTENT_FILTER = 'intent-filter'
+COMPONENT_TAGS = ('activity', 'activity-alias', 'service', 'receiver', 'provider')
+
+CHANGE_ADDED = 'added'
+CHANGE_REMOVED = 'removed'
+CHANGE_CHANGED = 'changed'
+
+
+class ManifestNode(object):
+    __slots__ = ('tag', 'attrib', 'children', 'digest')
+
+    def __init__(self, tag: str, attrib: dict[str, str]):
+        self.tag = tag
+        self.attrib = attrib
+        self.children = []
+        self.digest = None
+
+    @property
+    def key(self) -> tuple[str, Optional[str]]:
+        return self.tag, self.attrib.get(ATTR_NAME)
+
+    def label(self) -> str:
+        name = self.attrib.get(ATTR_NAME)
+        return '{}[{}]'.format(self.tag, name) if name else self.tag
+
+
+class _TreeBuilder(object):
+    # Attributes of the android namespace are stored as "android:<name>"
+    # whatever prefix the document declares
+    __slots__ = ('root', '_stack', '_prefix')
+
+    def __init__(self):
+        self.root = None
+        self._stack = []
+        self._prefix = None
+
+    def start(self, tag: str, attrib: dict[str, str]):
+        if self.root is None:
+            for key, value in attrib.items():
+                if key.startswith('xmlns:') and value == ANDROID_NAMESPACE:
+                    self._prefix = key[len('xmlns:'):] + ':'
+        prefix = self._prefix
+        if prefix and prefix != ANDROID_PREFIX + ':':
+            attrib = {ANDROID_PREFIX + ':' + key[len(prefix):] if key.startswith(prefix) else key: value
+                      for key, value in attrib.items()}
+        node = ManifestNode(tag, attrib)
+        if self._stack:
+            self._stack[-1].children.append(node)
+        else:
+            self.root = node
+        self._stack.append(node)
+
+    def end(self, tag: str):
+        node = self._stack.pop()
+        # Equal digests mean equal subtrees, so unchanged parts are skipped
+        # without being visited
+        node.digest = hash((node.tag, tuple(node.attrib.items()), tuple([child.digest for child in node.children])))
+
+
+def parse_manifest_tree(manifest: Optional[str]) -> Optional[ManifestNode]:
+    if not manifest:
+        return None
+    builder = _TreeBuilder()
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = builder.start
+    parser.EndElementHandler = builder.end
+    try:
+        parser.Parse(manifest.encode(), True)
+    except expat.ExpatError as e:
+        raise RuntimeError('Cannot parse manifest: {}'.format(e))
+    if builder.root is None or builder.root.tag != TAG_MANIFEST:
+        raise RuntimeError('Expected <{}> as root tag'.format(TAG_MANIFEST))
+    return builder.root
+
+
+def _group_children(node: ManifestNode) -> dict[tuple, list[ManifestNode]]:
+    groups = collections.defaultdict(list)
+    for child in node.children:
+        groups[child.key].append(child)
+    return groups
+
+
+def _pair_group(lhs: list[ManifestNode], rhs: list[ManifestNode]):
+    # Elements without a name (intent filters, actions, ...) share a key.
+    # Identical ones are paired by digest first, the rest by position.
+    if len(lhs) == 1 and len(rhs) == 1:
+        yield lhs[0], rhs[0]
+        return
+    unmatched = collections.defaultdict(collections.deque)
+    for node in rhs:
+        unmatched[node.digest].append(node)
+    lhs_rest = []
+    for node in lhs:
+        same = unmatched.get(node.digest)
+        if same:
+            yield node, same.popleft()
+        else:
+            lhs_rest.append(node)
+    rest = {id(node) for nodes in unmatched.values() for node in nodes}
+    rhs_rest = [node for node in rhs if id(node) in rest]
+    for index in range(max(len(lhs_rest), len(rhs_rest))):
+        yield (lhs_rest[index] if index < len(lhs_rest) else None,
+               rhs_rest[index] if index < len(rhs_rest) else None)
+
+
+def _labels(group: list[ManifestNode]) -> dict[int, str]:
+    # Unnamed siblings sharing a tag are told apart by their position
+    if len(group) == 1:
+        return {id(group[0]): group[0].label()}
+    return {id(node): '{}#{}'.format(node.tag, index + 1) if ATTR_NAME not in node.attrib else node.label()
+            for index, node in enumerate(group)}
+
+
+def iter_tree_changes(lhs: ManifestNode, rhs: ManifestNode, path: str = TAG_MANIFEST) -> Iterator[ManifestChange]:
+    stack = [(lhs, rhs, path)]
+    while stack:
+        lhs, rhs, path = stack.pop()
+        if lhs.digest == rhs.digest:
+            continue
+        for attribute in sorted(lhs.attrib.keys() | rhs.attrib.keys()):
+            was = lhs.attrib.get(attribute)
+            now = rhs.attrib.get(attribute)
+            if was != now:
+                yield ManifestChange(kind=CHANGE_CHANGED, path=path, attribute=attribute, was=was, now=now)
+        lhs_groups = _group_children(lhs)
+        rhs_groups = _group_children(rhs)
+        nested = []
+        for key in sorted(lhs_groups.keys() | rhs_groups.keys(), key=lambda key: (key[0], key[1] or '')):
+            lhs_group = lhs_groups.get(key, [])
+            rhs_group = rhs_groups.get(key, [])
+            if len(lhs_group) == len(rhs_group) == 1 and lhs_group[0].digest == rhs_group[0].digest:
+                continue
+            lhs_labels = _labels(lhs_group)
+            rhs_labels = _labels(rhs_group)
+            for was, now in _pair_group(lhs_group, rhs_group):
+                if was is None:
+                    yield ManifestChange(kind=CHANGE_ADDED, path='{}/{}'.format(path, rhs_labels[id(now)]),
+                                         attribute=None, was=None, now=_format_attributes(now))
+                elif now is None:
+                    yield ManifestChange(kind=CHANGE_REMOVED, path='{}/{}'.format(path, lhs_labels[id(was)]),
+                                         attribute=None, was=_format_attributes(was), now=None)
+                elif was.digest != now.digest:
+                    nested.append((was, now, '{}/{}'.format(path, rhs_labels[id(now)])))
+        # Children of this element are reported before the next sibling
+        stack.extend(reversed(nested))
+
+
+def _format_attributes(node: ManifestNode) -> str:
+    return ' '.join('{}="{}"'.format(key, value) for key, value in sorted(node.attrib.items()))
+
+
+def _components(root: ManifestNode) -> dict[tuple, ManifestNode]:
+    components = {}
+    for child in root.children:
+        if child.tag != 'application':
+            continue
+        for component in child.children:
+            if component.tag in COMPONENT_TAGS and ATTR_NAME in component.attrib:
+                components.setdefault(component.key, component)
+        break
+    return components
+
+
+def exported_state(component: ManifestNode) -> str:
+    # Without an explicit flag a component with intent filters used to be exported
+    exported = component.attrib.get(ATTR_EXPORTED)
+    if exported is not None:
+        return exported
+    if any(child.tag == TAG_INTENT_FILTER for child in component.children):
+        return 'true (implicit)'
+    return 'false (implicit)'
+
+
+def is_exported(state: Optional[str]) -> bool:
+    return state is not None and state.startswith('true')
+
+
+def iter_exported_changes(lhs: ManifestNode, rhs: ManifestNode) -> Iterator[ExportedComponentChange]:
+    lhs_components = _components(lhs)
+    rhs_components = _components(rhs)
+    for key in sorted(rhs_components):
+        now = rhs_components[key]
+        was = lhs_components.get(key)
+        exported_now = exported_state(now)
+        if not is_exported(exported_now):
+            continue
+        exported_was = exported_state(was) if was is not None else None
+        permission_was = was.attrib.get(ATTR_PERMISSION) if was is not None else None
+        permission_now = now.attrib.get(ATTR_PERMISSION)
+        if is_exported(exported_was) and permission_was == permission_now:
+            continue
+        yield ExportedComponentChange(path='{}/application/{}'.format(TAG_MANIFEST, now.label()),
+                                      exported_was=exported_was, exported_now=exported_now,
+                                      permission_was=permission_was, permission_now=permission_now)
+
+
+def diff_manifest_trees(prev_manifest: Optional[str], curr_manifest: Optional[str]) -> ManifestTreeSection:
+    try:
+        lhs = parse_manifest_tree(prev_manifest)
+        rhs = parse_manifest_tree(curr_manifest)
+    except RuntimeError as e:
+        return ManifestTreeSection(error=str(e), changes=[], exported=[])
+    if lhs is None or rhs is None:
+        return ManifestTreeSection(error='Cannot get manifests for the attribute level diff', changes=[],
+                                   exported=[])
+    return ManifestTreeSection(error=None, changes=list(iter_tree_changes(lhs, rhs)),
+                               exported=list(iter_exported_changes(lhs, rhs)))
+
+
+def format_change(change: ManifestChange) -> str:
+    if change.kind == CHANGE_ADDED:
+        return '\tAdded {} {}'.format(change.path, change.now).rstrip()
+    if change.kind == CHANGE_REMOVED:
+        return '\tRemoved {} {}'.format(change.path, change.was).rstrip()
+    return '\tChanged {} {}:\n\t\tWas: {}\n\t\tNow: {}'.format(change.path, change.attribute, change.was, change.now)
+
+
+def iter_manifest_tree_section(section: ManifestTreeSection) -> Iterator[str]:
+    if section.error:
+        yield section.error
+        return
+    if section.exported:
+        yield 'Exported components to review:'
+        for change in section.exported:
+            yield '\t{}:\n\t\tExported: {} -> {}\n\t\tPermission: {} -> {}'.format(
+                change.path, change.exported_was, change.exported_now, change.permission_was, change.permission_now)
+    if section.changes:
+        yield 'Manifest changes:'
+        for change in section.changes:
+            yield format_change(change)
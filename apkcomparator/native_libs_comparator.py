@@ -0,0 +1,103 @@
+import re
+import struct
+import zlib
+from typing import Iterator, Optional
+
+from apkcomparator.apk_reader import ZipArchive, ZipEntry
+from apkcomparator.data import AbiDiff, NativeLibrariesSection, NativeLibraryDiff, SizeDiff
+from apkcomparator.elf_reader import EMPTY_SUMMARY, ElfSummary, read_elf
+from apkcomparator.zip_differ import iter_changed_entries
+from utils.exceptions import BadApkError
+from utils.logger import log
+from utils.numbers import get_sign, human_readable_size
+
+LIBRARIES_PREFIX = 'lib/'
+TOP_SYMBOLS = 10
+# The text report only lists the sections that changed the most
+TEXT_SECTIONS = 6
+
+_LIBRARY_PATTERN = re.compile(r'^lib/([^/]+)/[^/]+\.so$')
+
+
+def _summary(archive: ZipArchive, entry: Optional[ZipEntry]) -> ElfSummary:
+    if entry is None:
+        return EMPTY_SUMMARY
+    try:
+        return read_elf(archive, entry)
+    except (OSError, BadApkError, IndexError, struct.error, zlib.error) as e:
+        # A broken library still shows up with its file size
+        log().warning('Failed to read {} from {}, error: {}'.format(entry.name, archive.name, e))
+        return EMPTY_SUMMARY
+
+
+def _size_diffs(prev: dict, curr: dict) -> list[SizeDiff]:
+    diffs = [SizeDiff(name, prev.get(name, 0), curr.get(name, 0)) for name in prev.keys() | curr.keys()
+             if prev.get(name, 0) != curr.get(name, 0)]
+    diffs.sort(key=lambda diff: (-abs(diff.size_now - diff.size_was), diff.name))
+    return diffs
+
+
+def _growing_symbols(prev: dict[bytes, int], curr: dict[bytes, int]) -> list[SizeDiff]:
+    growing = [(size - prev.get(name, 0), name) for name, size in curr.items() if size > prev.get(name, 0)]
+    growing.sort(key=lambda item: (-item[0], item[1]))
+    # Only the reported names are decoded
+    return [SizeDiff(name.decode('utf-8', 'replace'), prev.get(name, 0), curr[name])
+            for _, name in growing[:TOP_SYMBOLS]]
+
+
+def _rollup(abi: str, libraries: list[NativeLibraryDiff]) -> AbiDiff:
+    prev_sections, curr_sections = {}, {}
+    for library in libraries:
+        for section in library.sections:
+            prev_sections[section.name] = prev_sections.get(section.name, 0) + section.size_was
+            curr_sections[section.name] = curr_sections.get(section.name, 0) + section.size_now
+    return AbiDiff(abi=abi, libraries=len(libraries), size_was=sum(library.size_was for library in libraries),
+                   size_now=sum(library.size_now for library in libraries),
+                   sections=_size_diffs(prev_sections, curr_sections))
+
+
+def diff_native_libraries(prev: ZipArchive, curr: ZipArchive) -> NativeLibrariesSection:
+    # Libraries with equal CRC and sizes in both central directories are never read
+    libraries = []
+    for path, lhs, rhs in iter_changed_entries(prev, curr, LIBRARIES_PREFIX):
+        match = _LIBRARY_PATTERN.match(path)
+        if match is None:
+            continue
+        was, now = _summary(prev, lhs), _summary(curr, rhs)
+        libraries.append(NativeLibraryDiff(
+            path=path, abi=match.group(1), size_was=lhs.uncompressed_size if lhs is not None else 0,
+            size_now=rhs.uncompressed_size if rhs is not None else 0,
+            sections=_size_diffs(was.sections, now.sections), symbols=_growing_symbols(was.symbols, now.symbols)))
+    libraries.sort(key=lambda library: (-abs(library.size_now - library.size_was), library.path))
+    by_abi = {}
+    for library in libraries:
+        by_abi.setdefault(library.abi, []).append(library)
+    abis = [_rollup(abi, by_abi[abi]) for abi in sorted(by_abi)]
+    return NativeLibrariesSection(error=None, abis=abis, libraries=libraries)
+
+
+def _format_size(was: int, now: int) -> str:
+    diff = now - was
+    return '{} -> {} ({}{})'.format(human_readable_size(was), human_readable_size(now), get_sign(diff),
+                                    human_readable_size(diff))
+
+
+def iter_native_libraries_section(section: NativeLibrariesSection) -> Iterator[str]:
+    if section.error:
+        yield section.error
+        return
+    if not section.libraries:
+        return
+    yield 'Native libraries:'
+    for abi in section.abis:
+        yield '\t{}: {} changed libraries, {}'.format(abi.abi, abi.libraries, _format_size(abi.size_was, abi.size_now))
+        for diff in abi.sections[:TEXT_SECTIONS]:
+            yield '\t\t{}: {}'.format(diff.name, _format_size(diff.size_was, diff.size_now))
+    for library in section.libraries:
+        yield '\t{}: {}'.format(library.path, _format_size(library.size_was, library.size_now))
+        for diff in library.sections[:TEXT_SECTIONS]:
+            yield '\t\t{}: {}'.format(diff.name, _format_size(diff.size_was, diff.size_now))
+        if library.symbols:
+            yield '\t\tTop growing symbols:'
+            for diff in library.symbols:
+                yield '\t\t\t{}: {}'.format(diff.name, _format_size(diff.size_was, diff.size_now))
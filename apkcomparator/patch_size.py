@@ -0,0 +1,232 @@
+import multiprocessing
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Optional
+
+from apkcomparator.apk_reader import ZipArchive, ZipEntry, open_archive
+from utils.concurrency import get_parallelism
+
+# Patches are estimated file by file like store updates: every entry of the
+# new APK is rebuilt from its uncompressed data and an entry of the old one.
+BLOCK_SIZE = 32
+# Old data is indexed every BLOCK_SIZE bytes, huge entries get a sparser
+# index so memory stays bounded. The stride stays a power of two.
+MAX_BLOCKS = 1 << 20
+# New data is probed every PROBE_STRIDE bytes instead of every byte. The
+# stride is odd, so any match longer than stride * PROBE_STRIDE + BLOCK_SIZE
+# has a probe on an indexed old block, and the match is extended both ways.
+PROBE_STRIDE = 15
+# New data is streamed through a window of about this size, literals are
+# compressed as soon as they leave it
+WINDOW = 1 << 20
+# A mismatching chunk still extends a match when most of its bytes are equal,
+# the XOR of both sides goes to the diff stream and compresses well
+FUZZY_CHUNK = 64
+FUZZY_MIN_EQUAL = FUZZY_CHUNK // 2
+COMPRESSION_LEVEL = 9
+# Entries at least this large are diffed in worker processes
+LARGE_ENTRY = 1 << 20
+
+# new offset, old offset, length of the copy, length of the literal before it
+_CONTROL = struct.Struct('<IIII')
+
+_enabled = False
+
+
+def set_patch_estimation(enabled: bool):
+    global _enabled
+    _enabled = enabled
+
+
+def is_patch_estimation_enabled() -> bool:
+    return _enabled
+
+
+def _compressed_size(data) -> int:
+    return len(zlib.compress(data, COMPRESSION_LEVEL)) if data else 0
+
+
+class _CompressedSize:
+    # Data is compressed as it comes, only the compressed size is kept
+    def __init__(self):
+        self._compressor = zlib.compressobj(COMPRESSION_LEVEL)
+        self._size = 0
+        self._empty = True
+
+    def write(self, data):
+        if data:
+            self._empty = False
+            self._size += len(self._compressor.compress(data))
+
+    def size(self) -> int:
+        return 0 if self._empty else self._size + len(self._compressor.flush())
+
+
+class _Window:
+    # The part of a chunk stream that is still needed, data[0] is at offset start
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self.data = b''
+        self.start = 0
+        self.eof = False
+
+    def fill(self, keep: int, end: int) -> int:
+        # Drops the data before keep and reads up to end, returns the end of the data
+        available = self.start + len(self.data)
+        if available >= end or self.eof:
+            return available
+        parts = [self.data[keep - self.start:]]
+        while available < end:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self.eof = True
+                break
+            parts.append(chunk)
+            available += len(chunk)
+        self.data = b''.join(parts)
+        self.start = keep
+        return available
+
+
+def _common_length(new: bytes, new_start: int, old: bytes, old_start: int, limit: int) -> int:
+    # Slices are compared in C, the step doubles while they keep matching
+    length = 0
+    step = BLOCK_SIZE
+    while length < limit:
+        step = min(step, limit - length)
+        if new[new_start + length:new_start + length + step] == old[old_start + length:old_start + length + step]:
+            length += step
+            step *= 2
+        elif step > 1:
+            step //= 2
+        else:
+            break
+    return length
+
+
+def _common_suffix_length(new: bytes, new_end: int, old: bytes, old_end: int, limit: int) -> int:
+    length = 0
+    step = BLOCK_SIZE
+    while length < limit:
+        step = min(step, limit - length)
+        if new[new_end - length - step:new_end - length] == old[old_end - length - step:old_end - length]:
+            length += step
+            step *= 2
+        elif step > 1:
+            step //= 2
+        else:
+            break
+    return length
+
+
+def _xor(lhs: bytes, rhs: bytes) -> bytes:
+    return (int.from_bytes(lhs, 'little') ^ int.from_bytes(rhs, 'little')).to_bytes(len(lhs), 'little')
+
+
+def _index_blocks(old: bytes) -> dict[int, int]:
+    stride = BLOCK_SIZE
+    while len(old) // stride > MAX_BLOCKS:
+        stride *= 2
+    index = {}
+    for offset in range(0, len(old) - BLOCK_SIZE + 1, stride):
+        index.setdefault(hash(old[offset:offset + BLOCK_SIZE]), offset)
+    return index
+
+
+def _find_block(index: dict[int, int], old: bytes, new: _Window, position: int, end: int) -> tuple[int, Optional[int]]:
+    # Returns the first probed position from `position` whose block is in the
+    # old data and the old offset of the block, or None if there is none before `end`
+    data, base = new.data, new.start
+    for start in range(position - base, end - base - BLOCK_SIZE + 1, PROBE_STRIDE):
+        block = data[start:start + BLOCK_SIZE]
+        old_position = index.get(hash(block))
+        if old_position is not None and old[old_position:old_position + BLOCK_SIZE] == block:
+            return base + start, old_position
+        position = base + start + PROBE_STRIDE
+    return position, None
+
+
+def _match_length(old: bytes, new: _Window, position: int, old_position: int, length: int,
+                  diff: _CompressedSize) -> int:
+    while True:
+        end = new.fill(position + length, position + length + WINDOW)
+        length += _common_length(new.data, position + length - new.start, old, old_position + length,
+                                 min(end - position - length, len(old) - old_position - length))
+        if position + length == end and not new.eof and old_position + length < len(old):
+            # The window ended inside the match
+            continue
+        new.fill(position + length, position + length + FUZZY_CHUNK)
+        new_chunk = new.data[position + length - new.start:position + length - new.start + FUZZY_CHUNK]
+        old_chunk = old[old_position + length:old_position + length + FUZZY_CHUNK]
+        if len(new_chunk) < FUZZY_CHUNK or len(old_chunk) < FUZZY_CHUNK:
+            return length
+        chunk_diff = _xor(new_chunk, old_chunk)
+        if chunk_diff.count(0) < FUZZY_MIN_EQUAL:
+            return length
+        diff.write(chunk_diff)
+        length += FUZZY_CHUNK
+
+
+def estimate_delta(old: bytes, new_chunks: Iterable[bytes]) -> int:
+    controls, diff, literals = _CompressedSize(), _CompressedSize(), _CompressedSize()
+    if not old:
+        for chunk in new_chunks:
+            literals.write(chunk)
+        return literals.size()
+    index = _index_blocks(old)
+    new = _Window(new_chunks)
+    # Literals before `flushed` are already compressed, the ones after it stay in the window
+    literal_start = flushed = position = 0
+    while True:
+        end = new.fill(flushed, position + WINDOW)
+        if position + BLOCK_SIZE > end:
+            break
+        position, old_position = _find_block(index, old, new, position, end)
+        if old_position is None:
+            literals.write(new.data[flushed - new.start:position - new.start])
+            flushed = position
+            continue
+        back = _common_suffix_length(new.data, position - new.start, old, old_position,
+                                     min(position - flushed, old_position))
+        position -= back
+        old_position -= back
+        literals.write(new.data[flushed - new.start:position - new.start])
+        length = _match_length(old, new, position, old_position, back + BLOCK_SIZE, diff)
+        controls.write(_CONTROL.pack(position, old_position, length, position - literal_start))
+        position += length
+        literal_start = flushed = position
+    literals.write(new.data[flushed - new.start:])
+    return controls.size() + diff.size() + literals.size()
+
+
+def _diff_entry(prev: ZipArchive, old_entry: Optional[ZipEntry], curr: ZipArchive, entry: ZipEntry) -> int:
+    return estimate_delta(prev.read(old_entry) if old_entry is not None else b'', curr.iter_chunks(entry))
+
+
+def _diff_entry_file(prev_apk: str, old_name: Optional[str], curr_apk: str, name: str) -> int:
+    with open_archive(prev_apk) as prev, open_archive(curr_apk) as curr:
+        return _diff_entry(prev, prev.entries[old_name] if old_name is not None else None, curr, curr.entries[name])
+
+
+def estimate_patch_size(prev: ZipArchive, curr: ZipArchive) -> int:
+    # Entries with the same content anywhere in the old APK are copied, the
+    # rest is diffed against the entry with the same path, if there is one
+    contents = {(entry.crc, entry.uncompressed_size) for entry in prev.entries.values()}
+    small, large = [], []
+    for entry in curr.entries.values():
+        if (entry.crc, entry.uncompressed_size) not in contents:
+            (large if entry.uncompressed_size >= LARGE_ENTRY else small).append((prev.entries.get(entry.name), entry))
+    size = _compressed_size(curr.central_directory())
+    if len(large) > 1 and get_parallelism() > 1:
+        # Workers are spawned, forking a process with running threads is not safe
+        with ProcessPoolExecutor(max_workers=min(get_parallelism(), len(large)),
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            size += sum(executor.map(
+                _diff_entry_file, [prev.name] * len(large), [old.name if old else None for old, _ in large],
+                [curr.name] * len(large), [entry.name for _, entry in large]))
+    else:
+        small.extend(large)
+    for old_entry, entry in small:
+        size += _diff_entry(prev, old_entry, curr, entry)
+    return size
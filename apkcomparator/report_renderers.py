@@ -0,0 +1,264 @@
+import json
+from typing import Iterable, Iterator
+
+from apkcomparator import __version__
+from apkcomparator.android_manifest_comparator import iter_manifest_section
+from apkcomparator.apk_compare_result_processor import iter_files_section
+from apkcomparator.apk_plain_data_comparator import iter_plain_data
+from apkcomparator.budget import budget_passed, iter_budget_section
+from apkcomparator.bundle_comparator import iter_bundle_section
+from apkcomparator.data import (
+    ApkCompareReport, BudgetSection, BundleSection, DexPackagesSection, DownloadSizeSection, DuplicatesSection,
+    FilesSection, ManifestSection, ManifestTreeSection, NativeLibrariesSection, PlainDataSection, ResourcesSection)
+from apkcomparator.dex_packages_comparator import iter_dex_packages_section
+from apkcomparator.download_size import iter_download_size_section
+from apkcomparator.duplicates import iter_duplicates_section
+from apkcomparator.manifest_tree import iter_manifest_tree_section
+from apkcomparator.native_libs_comparator import iter_native_libraries_section
+from apkcomparator.resource_table import iter_resources_section
+
+FORMAT_TEXT = 'text'
+FORMAT_JSON = 'json'
+FORMAT_NDJSON = 'ndjson'
+FORMATS = (FORMAT_TEXT, FORMAT_JSON, FORMAT_NDJSON)
+EXTENSIONS = {FORMAT_TEXT: '.txt', FORMAT_JSON: '.json', FORMAT_NDJSON: '.ndjson'}
+
+
+def _plain_data_json(section: PlainDataSection) -> dict:
+    return {
+        'prev': section.prev._asdict(),
+        'curr': section.curr._asdict(),
+        'diff': {field: getattr(section.curr, field) - getattr(section.prev, field)
+                 for field in section.curr._fields},
+        'patch_size': section.patch_size,
+    }
+
+
+def _category_json(category) -> dict:
+    return {'name': category.name, 'threshold': category.threshold, 'total_diff': category.total_diff}
+
+
+def _files_json(section: FilesSection) -> dict:
+    return {'categories': [{**_category_json(category), 'entries': [line._asdict() for line in category.lines]}
+                           for category in section.categories]}
+
+
+def _download_size_json(section: DownloadSizeSection) -> dict:
+    return {
+        'error': section.error,
+        'categories': [category._asdict() for category in section.categories],
+        'entries': [entry._asdict() for entry in section.entries],
+    }
+
+
+def _native_libraries_json(section: NativeLibrariesSection) -> dict:
+    return {
+        'error': section.error,
+        'abis': [_native_abi_json(abi) for abi in section.abis],
+        'libraries': [_native_library_json(library) for library in section.libraries],
+    }
+
+
+def _native_abi_json(abi) -> dict:
+    return {**abi._asdict(), 'sections': [diff._asdict() for diff in abi.sections]}
+
+
+def _native_library_json(library) -> dict:
+    return {**library._asdict(), 'sections': [diff._asdict() for diff in library.sections],
+            'symbols': [diff._asdict() for diff in library.symbols]}
+
+
+def _dex_packages_json(section: DexPackagesSection) -> dict:
+    return {'error': section.error, 'packages': [diff._asdict() for diff in section.packages]}
+
+
+def _resources_json(section: ResourcesSection) -> dict:
+    return {
+        'error': section.error,
+        'string_pools': [pool._asdict() for pool in section.string_pools],
+        'types': [diff._asdict() for diff in section.types],
+    }
+
+
+def _duplicates_json(section: DuplicatesSection) -> dict:
+    return {
+        'error': section.error,
+        'wasted_was': section.wasted_was,
+        'wasted_now': section.wasted_now,
+        'groups': [group._asdict() for group in section.groups],
+        'introduced': [duplicate._asdict() for duplicate in section.introduced],
+    }
+
+
+def _manifest_json(section: ManifestSection) -> dict:
+    return {
+        'error': section.error,
+        'differences': [difference._asdict() for difference in section.differences],
+        'manual_checks': section.manual_checks,
+    }
+
+
+def _manifest_tree_json(section: ManifestTreeSection) -> dict:
+    return {
+        'error': section.error,
+        'exported': [change._asdict() for change in section.exported],
+        'changes': [change._asdict() for change in section.changes],
+    }
+
+
+def _bundle_json(section: BundleSection) -> dict:
+    return {
+        'error': section.error,
+        'splits': [split._asdict() for split in section.splits],
+        'configs': [config._asdict() for config in section.configs],
+    }
+
+
+def _budget_json(section: BudgetSection) -> dict:
+    return {
+        'passed': budget_passed(section.violations),
+        'rules': section.rules,
+        'violations': [violation._asdict() for violation in section.violations],
+        'stopped': section.stopped,
+        'skipped': section.skipped,
+    }
+
+
+def _plain_data_records(section: PlainDataSection) -> Iterator[dict]:
+    yield {'record': 'plain_data', **_plain_data_json(section)}
+
+
+def _files_records(section: FilesSection) -> Iterator[dict]:
+    for category in section.categories:
+        yield {'record': 'category', **_category_json(category), 'entries': len(category.lines)}
+        for line in category.lines:
+            yield {'record': 'entry', 'category': category.name, **line._asdict()}
+
+
+def _download_size_records(section: DownloadSizeSection) -> Iterator[dict]:
+    if section.error:
+        yield {'record': 'download_size_error', 'error': section.error}
+    for category in section.categories:
+        yield {'record': 'download_category', **category._asdict()}
+    for entry in section.entries:
+        yield {'record': 'download_entry', **entry._asdict()}
+
+
+def _native_libraries_records(section: NativeLibrariesSection) -> Iterator[dict]:
+    if section.error:
+        yield {'record': 'native_libraries_error', 'error': section.error}
+    for abi in section.abis:
+        yield {'record': 'native_abi', **_native_abi_json(abi)}
+    for library in section.libraries:
+        yield {'record': 'native_library', **_native_library_json(library)}
+
+
+def _dex_packages_records(section: DexPackagesSection) -> Iterator[dict]:
+    if section.error:
+        yield {'record': 'dex_packages_error', 'error': section.error}
+    for diff in section.packages:
+        yield {'record': 'dex_package', **diff._asdict()}
+
+
+def _resources_records(section: ResourcesSection) -> Iterator[dict]:
+    if section.error:
+        yield {'record': 'resources_error', 'error': section.error}
+    for pool in section.string_pools:
+        yield {'record': 'string_pool', **pool._asdict()}
+    for diff in section.types:
+        yield {'record': 'resource_type', **diff._asdict()}
+
+
+def _duplicates_records(section: DuplicatesSection) -> Iterator[dict]:
+    if section.error:
+        yield {'record': 'duplicates_error', 'error': section.error}
+        return
+    yield {'record': 'duplicates', 'wasted_was': section.wasted_was, 'wasted_now': section.wasted_now,
+           'groups': len(section.groups)}
+    for group in section.groups:
+        yield {'record': 'duplicate_group', **group._asdict()}
+    for duplicate in section.introduced:
+        yield {'record': 'introduced_duplicate', **duplicate._asdict()}
+
+
+def _manifest_records(section: ManifestSection) -> Iterator[dict]:
+    if section.error:
+        yield {'record': 'manifest_error', 'error': section.error}
+    for difference in section.differences:
+        yield {'record': 'manifest_difference', **difference._asdict()}
+    for manual_check in section.manual_checks:
+        yield {'record': 'manifest_manual_check', 'section': manual_check}
+
+
+def _manifest_tree_records(section: ManifestTreeSection) -> Iterator[dict]:
+    if section.error:
+        yield {'record': 'manifest_tree_error', 'error': section.error}
+    for change in section.exported:
+        yield {'record': 'exported_component', **change._asdict()}
+    for change in section.changes:
+        yield {'record': 'manifest_change', **change._asdict()}
+
+
+def _bundle_records(section: BundleSection) -> Iterator[dict]:
+    if section.error:
+        yield {'record': 'splits_error', 'error': section.error}
+    for split in section.splits:
+        yield {'record': 'split', **split._asdict()}
+    for config in section.configs:
+        yield {'record': 'device_config', **config._asdict()}
+
+
+def _budget_records(section: BudgetSection) -> Iterator[dict]:
+    yield {'record': 'budget', 'passed': budget_passed(section.violations), 'rules': section.rules,
+           'stopped': section.stopped, 'skipped': section.skipped}
+    for violation in section.violations:
+        yield {'record': 'budget_violation', **violation._asdict()}
+
+
+# Section type -> (JSON key, text lines, JSON value, NDJSON records)
+RENDERERS = {
+    PlainDataSection: ('plain_data', lambda section: iter_plain_data(section.prev, section.curr, section.patch_size),
+                       _plain_data_json, _plain_data_records),
+    FilesSection: ('files', iter_files_section, _files_json, _files_records),
+    DownloadSizeSection: ('download_size', iter_download_size_section, _download_size_json, _download_size_records),
+    NativeLibrariesSection: ('native_libraries', iter_native_libraries_section, _native_libraries_json,
+                             _native_libraries_records),
+    DexPackagesSection: ('dex_packages', iter_dex_packages_section, _dex_packages_json, _dex_packages_records),
+    ResourcesSection: ('resources', iter_resources_section, _resources_json, _resources_records),
+    DuplicatesSection: ('duplicates', iter_duplicates_section, _duplicates_json, _duplicates_records),
+    ManifestSection: ('manifest', iter_manifest_section, _manifest_json, _manifest_records),
+    ManifestTreeSection: ('manifest_tree', iter_manifest_tree_section, _manifest_tree_json, _manifest_tree_records),
+    BundleSection: ('splits', iter_bundle_section, _bundle_json, _bundle_records),
+    BudgetSection: ('budget', iter_budget_section, _budget_json, _budget_records),
+}
+
+
+def render_text(report: ApkCompareReport) -> Iterator[Iterable[str]]:
+    for section in report.iter_sections():
+        yield RENDERERS[type(section)][1](section)
+
+
+def render_json(report: ApkCompareReport) -> Iterator[Iterable[str]]:
+    document = {'version': __version__}
+    for section in report.iter_sections():
+        key, _, to_json, _ = RENDERERS[type(section)]
+        document[key] = to_json(section)
+    yield [json.dumps(document)]
+
+
+def render_ndjson(report: ApkCompareReport) -> Iterator[Iterable[str]]:
+    yield [json.dumps({'record': 'report', 'version': __version__})]
+    for section in report.iter_sections():
+        yield (json.dumps(record) for record in RENDERERS[type(section)][3](section))
+
+
+def render(report: ApkCompareReport, report_format: str) -> Iterator[Iterable[str]]:
+    if report_format == FORMAT_JSON:
+        return render_json(report)
+    if report_format == FORMAT_NDJSON:
+        return render_ndjson(report)
+    return render_text(report)
+
+
+def render_text_report(report: ApkCompareReport) -> str:
+    return '\n'.join(line for section in render_text(report) for line in section)
@@ -0,0 +1,28 @@
+import contextlib
+import gzip
+import sys
+from typing import Iterable, Iterator, TextIO
+
+STDOUT = '-'
+
+
+@contextlib.contextmanager
+def open_sink(file: str) -> Iterator[TextIO]:
+    if file == STDOUT:
+        yield sys.stdout
+    elif file.endswith('.gz'):
+        with gzip.open(file, 'wt') as sink:
+            yield sink
+    else:
+        with open(file, 'w') as sink:
+            yield sink
+
+
+def write_sections(sections: Iterable[Iterable[str]], sink: TextIO):
+    # Every section is flushed as soon as it is rendered, so readers of a
+    # pipe see it before the slower sections are ready
+    for section in sections:
+        for line in section:
+            sink.write(line)
+            sink.write('\n')
+        sink.flush()
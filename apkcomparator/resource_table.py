@@ -0,0 +1,310 @@
+import collections
+import hashlib
+import struct
+import sys
+from array import array
+from typing import Iterator
+
+from apkcomparator.apk_reader import ZipArchive
+from apkcomparator.binary_xml import NO_ENTRY, RES_STRING_POOL_TYPE, StringPool
+from apkcomparator.data import ResourcesSection, ResourceTypeDiff, StringPoolDiff
+from utils.exceptions import BadApkError
+from utils.numbers import get_sign, human_readable_size
+
+#
+# https://android.googlesource.com/platform/frameworks/base/+/master/libs/androidfw/include/androidfw/ResourceTypes.h
+#
+RESOURCES_ENTRY = 'resources.arsc'
+RES_TABLE_TYPE = 0x0002
+RES_TABLE_PACKAGE_TYPE = 0x0200
+RES_TABLE_TYPE_TYPE = 0x0201
+APP_PACKAGE_ID = 0x7f
+
+TYPE_FLAG_SPARSE = 0x01
+TYPE_FLAG_OFFSET16 = 0x02
+ENTRY_FLAG_COMPACT = 0x0008
+NO_ENTRY16 = 0xffff
+DEFAULT_CONFIG = 'default'
+
+_CHUNK_HEADER = struct.Struct('<HHI')
+_STRING_COUNT = struct.Struct('<I')
+# id, name, typeStrings, lastPublicType, keyStrings, lastPublicKey
+_PACKAGE_HEADER = struct.Struct('<I256sIIII')
+# id, flags, reserved, entryCount, entriesStart, then ResTable_config
+_TYPE_HEADER = struct.Struct('<BBHII')
+_ENTRY = struct.Struct('<HHI')
+# ResTable_config up to colorMode, shorter configs of old tables are zero padded
+_CONFIG = struct.Struct('<IHH2s2sBBHBBBBHHHHBBHHH4s8sBB')
+
+_DENSITIES = {120: 'ldpi', 160: 'mdpi', 213: 'tvdpi', 240: 'hdpi', 320: 'xhdpi', 480: 'xxhdpi', 640: 'xxxhdpi',
+              0xfffe: 'anydpi', 0xffff: 'nodpi'}
+_ORIENTATIONS = {1: 'port', 2: 'land', 3: 'square'}
+_TOUCHSCREENS = {1: 'notouch', 2: 'stylus', 3: 'finger'}
+_KEYBOARDS = {1: 'nokeys', 2: 'qwerty', 3: '12key'}
+_NAVIGATIONS = {1: 'nonav', 2: 'dpad', 3: 'trackball', 4: 'wheel'}
+_UI_MODE_TYPES = {2: 'desk', 3: 'car', 4: 'television', 5: 'appliance', 6: 'watch', 7: 'vrheadset'}
+_SCREEN_SIZES = {1: 'small', 2: 'normal', 3: 'large', 4: 'xlarge'}
+
+StringPoolSummary = collections.namedtuple('StringPoolSummary', ('strings', 'size'))
+
+
+class TypeIndex(object):
+    # keys[entry index] is the key string of the entry, NO_ENTRY when the
+    # entry is not defined in any configuration. Names are decoded lazily.
+    __slots__ = ('name', 'keys', 'configs')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.keys = array('I')
+        self.configs = {}
+
+
+class PackageIndex(object):
+    __slots__ = ('id', 'name', 'type_strings', 'key_strings', 'key_pool', 'key_digest', 'types')
+
+    def __init__(self, package_id: int, name: str):
+        self.id = package_id
+        self.name = name
+        self.type_strings = None
+        self.key_strings = None
+        self.key_pool = None
+        self.key_digest = None
+        self.types = {}
+
+    def names(self, type_index: TypeIndex) -> set[str]:
+        return {self.key_pool.get(key) for key in type_index.keys if key != NO_ENTRY}
+
+
+ResourceTable = collections.namedtuple('ResourceTable', ('strings', 'packages'))
+
+EMPTY_TABLE = ResourceTable(strings=StringPoolSummary(0, 0), packages=[])
+
+
+def _unpack_chars(pair: bytes, base: str) -> str:
+    # Three letter codes are packed into two bytes with the high bit set
+    if not pair[0]:
+        return ''
+    if not pair[0] & 0x80:
+        return pair.decode('ascii', 'replace')
+    first = pair[1] & 0x1f
+    second = ((pair[1] & 0xe0) >> 5) | ((pair[0] & 0x03) << 3)
+    third = (pair[0] & 0x7c) >> 2
+    return ''.join(chr(ord(base) + value) for value in (first, second, third))
+
+
+def format_config(data, offset: int) -> str:
+    size = _STRING_COUNT.unpack_from(data, offset)[0]
+    raw = bytes(data[offset:offset + min(size, _CONFIG.size)]).ljust(_CONFIG.size, b'\0')
+    (_, mcc, mnc, language, country, orientation, touchscreen, density, keyboard, navigation, input_flags, _,
+     screen_width, screen_height, sdk_version, _, screen_layout, ui_mode, smallest_width_dp, width_dp, height_dp,
+     script, variant, screen_layout2, color_mode) = _CONFIG.unpack(raw)
+    qualifiers = []
+    if mcc:
+        qualifiers.append('mcc{}'.format(mcc))
+    if mnc:
+        qualifiers.append('mnc{}'.format(mnc))
+    language = _unpack_chars(language, 'a')
+    region = _unpack_chars(country, '0')
+    script = script.rstrip(b'\0').decode('ascii', 'replace')
+    variant = variant.rstrip(b'\0').decode('ascii', 'replace')
+    if script or variant:
+        qualifiers.append('+'.join(part for part in ('b', language, script, region, variant) if part))
+    elif language:
+        qualifiers.append(language + ('-r' + region if region else ''))
+    qualifiers.append({0x40: 'ldltr', 0x80: 'ldrtl'}.get(screen_layout & 0xc0))
+    if smallest_width_dp:
+        qualifiers.append('sw{}dp'.format(smallest_width_dp))
+    if width_dp:
+        qualifiers.append('w{}dp'.format(width_dp))
+    if height_dp:
+        qualifiers.append('h{}dp'.format(height_dp))
+    qualifiers.append(_SCREEN_SIZES.get(screen_layout & 0x0f))
+    qualifiers.append({0x10: 'notlong', 0x20: 'long'}.get(screen_layout & 0x30))
+    qualifiers.append({1: 'notround', 2: 'round'}.get(screen_layout2 & 0x03))
+    qualifiers.append({1: 'nowidecg', 2: 'widecg'}.get(color_mode & 0x03))
+    qualifiers.append({4: 'lowdr', 8: 'highdr'}.get(color_mode & 0x0c))
+    qualifiers.append(_ORIENTATIONS.get(orientation))
+    qualifiers.append(_UI_MODE_TYPES.get(ui_mode & 0x0f))
+    qualifiers.append({0x10: 'notnight', 0x20: 'night'}.get(ui_mode & 0x30))
+    if density:
+        qualifiers.append(_DENSITIES.get(density, '{}dpi'.format(density)))
+    qualifiers.append(_TOUCHSCREENS.get(touchscreen))
+    qualifiers.append({1: 'keysexposed', 2: 'keyshidden', 3: 'keyssoft'}.get(input_flags & 0x03))
+    qualifiers.append(_KEYBOARDS.get(keyboard))
+    qualifiers.append({4: 'navexposed', 8: 'navhidden'}.get(input_flags & 0x0c))
+    qualifiers.append(_NAVIGATIONS.get(navigation))
+    if screen_width or screen_height:
+        qualifiers.append('{}x{}'.format(max(screen_width, screen_height), min(screen_width, screen_height)))
+    if sdk_version:
+        qualifiers.append('v{}'.format(sdk_version))
+    return '-'.join(qualifier for qualifier in qualifiers if qualifier) or DEFAULT_CONFIG
+
+
+def _unpack_array(typecode: str, data, start: int, count: int) -> array:
+    values = array(typecode, bytes(data[start:start + count * array(typecode).itemsize]))
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+def _iter_chunks(data, start: int, end: int) -> Iterator[tuple[int, int, int, int]]:
+    offset = start
+    while offset + _CHUNK_HEADER.size <= end:
+        chunk_type, header_size, chunk_size = _CHUNK_HEADER.unpack_from(data, offset)
+        if chunk_size < _CHUNK_HEADER.size or offset + chunk_size > end:
+            raise BadApkError('Corrupted resource table chunk at 0x{:x}'.format(offset))
+        yield chunk_type, offset, header_size, chunk_size
+        offset += chunk_size
+
+
+def _pool_summary(data, offset: int) -> StringPoolSummary:
+    _, _, size = _CHUNK_HEADER.unpack_from(data, offset)
+    return StringPoolSummary(strings=_STRING_COUNT.unpack_from(data, offset + _CHUNK_HEADER.size)[0], size=size)
+
+
+def _add_type_chunk(package: PackageIndex, type_strings: StringPool, data, offset: int, header_size: int):
+    type_id, flags, _, entry_count, entries_start = _TYPE_HEADER.unpack_from(data, offset + _CHUNK_HEADER.size)
+    config = format_config(data, offset + _CHUNK_HEADER.size + _TYPE_HEADER.size)
+    index = package.types.get(type_id)
+    if index is None:
+        index = package.types[type_id] = TypeIndex(type_strings.get(type_id - 1))
+    offsets_start = offset + header_size
+    entries_base = offset + entries_start
+    if flags & TYPE_FLAG_SPARSE:
+        pairs = _unpack_array('H', data, offsets_start, entry_count * 2)
+        present = list(zip(pairs[::2], [entry_offset * 4 for entry_offset in pairs[1::2]]))
+        needed = max(pairs[::2]) + 1 if entry_count else 0
+    elif flags & TYPE_FLAG_OFFSET16:
+        offsets = _unpack_array('H', data, offsets_start, entry_count)
+        present = [(entry, entry_offset * 4) for entry, entry_offset in enumerate(offsets)
+                   if entry_offset != NO_ENTRY16]
+        needed = entry_count
+    else:
+        offsets = _unpack_array('I', data, offsets_start, entry_count)
+        present = [(entry, entry_offset) for entry, entry_offset in enumerate(offsets) if entry_offset != NO_ENTRY]
+        needed = entry_count
+    keys = index.keys
+    if len(keys) < needed:
+        keys.extend(array('I', [NO_ENTRY]) * (needed - len(keys)))
+    for entry, entry_offset in present:
+        if keys[entry] == NO_ENTRY:
+            size, entry_flags, key = _ENTRY.unpack_from(data, entries_base + entry_offset)
+            # Compact entries keep the key where regular ones keep their size
+            keys[entry] = size if entry_flags & ENTRY_FLAG_COMPACT else key
+    index.configs[config] = index.configs.get(config, 0) + len(present)
+
+
+def _parse_package(data, offset: int, header_size: int, chunk_size: int) -> PackageIndex:
+    package_id, raw_name, type_strings_offset, _, key_strings_offset, _ = _PACKAGE_HEADER.unpack_from(
+        data, offset + _CHUNK_HEADER.size)
+    package = PackageIndex(package_id, bytes(raw_name).decode('utf-16-le', 'replace').split('\0', 1)[0])
+    type_strings = StringPool(data, offset + type_strings_offset)
+    package.key_pool = StringPool(data, offset + key_strings_offset)
+    package.type_strings = _pool_summary(data, offset + type_strings_offset)
+    package.key_strings = _pool_summary(data, offset + key_strings_offset)
+    key_start = offset + key_strings_offset
+    package.key_digest = hashlib.sha256(data[key_start:key_start + package.key_strings.size]).digest()
+    for chunk_type, chunk_offset, chunk_header_size, _ in _iter_chunks(
+            data, offset + header_size, offset + chunk_size):
+        if chunk_type == RES_TABLE_TYPE_TYPE:
+            _add_type_chunk(package, type_strings, data, chunk_offset, chunk_header_size)
+    return package
+
+
+def parse_resource_table(data, start: int, end: int) -> ResourceTable:
+    chunk_type, header_size, size = _CHUNK_HEADER.unpack_from(data, start)
+    if chunk_type != RES_TABLE_TYPE:
+        raise BadApkError('Not a resource table, chunk type 0x{:04x}'.format(chunk_type))
+    strings = StringPoolSummary(0, 0)
+    packages = []
+    for chunk_type, offset, chunk_header_size, chunk_size in _iter_chunks(
+            data, start + header_size, min(end, start + size)):
+        if chunk_type == RES_STRING_POOL_TYPE:
+            strings = _pool_summary(data, offset)
+        elif chunk_type == RES_TABLE_PACKAGE_TYPE:
+            packages.append(_parse_package(data, offset, chunk_header_size, chunk_size))
+    return ResourceTable(strings=strings, packages=packages)
+
+
+def read_resource_table(archive: ZipArchive) -> ResourceTable:
+    entry = archive.entries.get(RESOURCES_ENTRY)
+    if entry is None:
+        return EMPTY_TABLE
+    return parse_resource_table(*archive.buffer_range(entry))
+
+
+def _type_name(package: PackageIndex, type_index: TypeIndex) -> str:
+    if package.id == APP_PACKAGE_ID:
+        return type_index.name
+    return '{}:{}'.format(package.name, type_index.name)
+
+
+def _pool_diff(name: str, was: StringPoolSummary, now: StringPoolSummary) -> Iterator[StringPoolDiff]:
+    if was != now:
+        yield StringPoolDiff(name=name, strings_was=was.strings, strings_now=now.strings, size_was=was.size,
+                             size_now=now.size)
+
+
+def diff_resource_tables(prev: ResourceTable, curr: ResourceTable) -> ResourcesSection:
+    string_pools = list(_pool_diff('global', prev.strings, curr.strings))
+    types = []
+    prev_packages = {(package.id, package.name): package for package in prev.packages}
+    curr_packages = {(package.id, package.name): package for package in curr.packages}
+    empty_pool = StringPoolSummary(0, 0)
+    for key in sorted(prev_packages.keys() | curr_packages.keys()):
+        lhs = prev_packages.get(key) or PackageIndex(*key)
+        rhs = curr_packages.get(key) or PackageIndex(*key)
+        string_pools.extend(_pool_diff('{} types'.format(key[1]), lhs.type_strings or empty_pool,
+                                       rhs.type_strings or empty_pool))
+        string_pools.extend(_pool_diff('{} keys'.format(key[1]), lhs.key_strings or empty_pool,
+                                       rhs.key_strings or empty_pool))
+        lhs_types = {type_index.name: type_index for type_index in lhs.types.values()}
+        rhs_types = {type_index.name: type_index for type_index in rhs.types.values()}
+        for name in sorted(lhs_types.keys() | rhs_types.keys()):
+            was = lhs_types.get(name) or TypeIndex(name)
+            now = rhs_types.get(name) or TypeIndex(name)
+            # Equal key pools and key columns mean equal names, nothing to decode
+            if lhs.key_digest == rhs.key_digest and was.keys == now.keys:
+                added, removed = [], []
+            else:
+                was_names = lhs.names(was) if was.keys else set()
+                now_names = rhs.names(now) if now.keys else set()
+                added, removed = sorted(now_names - was_names), sorted(was_names - now_names)
+            entries_was, entries_now = sum(was.configs.values()), sum(now.configs.values())
+            configs_added = sorted(now.configs.keys() - was.configs.keys())
+            configs_removed = sorted(was.configs.keys() - now.configs.keys())
+            if added or removed or configs_added or configs_removed or entries_was != entries_now:
+                types.append(ResourceTypeDiff(
+                    type=_type_name(rhs if name in rhs_types else lhs, now if name in rhs_types else was),
+                    entries_was=entries_was, entries_now=entries_now, added=added, removed=removed,
+                    configs_added=configs_added, configs_removed=configs_removed))
+    return ResourcesSection(error=None, string_pools=string_pools, types=types)
+
+
+def _format_count(was: int, now: int) -> str:
+    diff = now - was
+    return '{} -> {} ({}{})'.format(was, now, get_sign(diff), abs(diff))
+
+
+def iter_resources_section(section: ResourcesSection) -> Iterator[str]:
+    if section.error:
+        yield section.error
+        return
+    if not section.string_pools and not section.types:
+        return
+    yield 'Resource table:'
+    for pool in section.string_pools:
+        size_diff = pool.size_now - pool.size_was
+        yield '\t{} string pool: {} strings, {} -> {} ({}{})'.format(
+            pool.name, _format_count(pool.strings_was, pool.strings_now), human_readable_size(pool.size_was),
+            human_readable_size(pool.size_now), get_sign(size_diff), human_readable_size(size_diff))
+    for diff in section.types:
+        yield '\t{}: {} entries'.format(diff.type, _format_count(diff.entries_was, diff.entries_now))
+        if diff.added:
+            yield '\t\tAdded: {}'.format(' '.join(diff.added))
+        if diff.removed:
+            yield '\t\tRemoved: {}'.format(' '.join(diff.removed))
+        if diff.configs_added:
+            yield '\t\tAdded configs: {}'.format(' '.join(diff.configs_added))
+        if diff.configs_removed:
+            yield '\t\tRemoved configs: {}'.format(' '.join(diff.configs_removed))
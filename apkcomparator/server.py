@@ -0,0 +1,394 @@
+import argparse
+import collections
+import json
+import os
+import queue
+import re
+import signal
+import socketserver
+import threading
+import time
+import uuid
+from concurrent.futures import Executor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterable, Iterator, Optional
+
+from apkcomparator import __version__
+from apkcomparator.apk_comparator import SECTIONS, check_bundle_sections, generate_report, get_sections
+from apkcomparator.cache import configure_memory_cache, memory_cache_size
+from apkcomparator.data import Apk
+from apkcomparator.report_renderers import FORMAT_JSON, FORMAT_NDJSON, FORMAT_TEXT, FORMATS, render
+from apkcomparator.report_writer import write_sections
+from apkcomparator.start import add_common_arguments, apply_common_arguments
+from utils.concurrency import create_executor, set_deadline
+from utils.tracing import finish_tracing
+from utils.logger import log
+
+# One warm process serves the comparisons of many clients: jobs wait in a
+# bounded queue, run on a fixed number of workers and share the analyses of
+# frequently compared apks in memory.
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE_SIZE = 32
+DEFAULT_JOB_TIMEOUT = 1800
+DEFAULT_MEMORY_CACHE = 64
+# Finished jobs and their reports are kept for clients polling late, the oldest are dropped
+MAX_FINISHED_JOBS = 256
+MAX_REQUEST_SIZE = 64 * 1024
+# A timed out job whose in-process analyses still run after this is abandoned
+ABANDON_TIMEOUT = 30
+RETRY_AFTER = 5
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+STATUS_TIMEOUT = 'timeout'
+FINISHED_STATUSES = (STATUS_DONE, STATUS_FAILED, STATUS_TIMEOUT)
+
+CONTENT_TYPES = {FORMAT_TEXT: 'text/plain; charset=utf-8', FORMAT_JSON: 'application/json',
+                 FORMAT_NDJSON: 'application/x-ndjson'}
+
+_JOB_PATH = re.compile(r'^/jobs/([0-9a-f]+)(/report)?$')
+
+
+class Job(object):
+    # Rendered sections are appended as they are ready, so a report can be
+    # streamed while the slower sections are still computed
+    def __init__(self, prev: str, curr: str, sections: Iterable[str], report_format: str, timeout: float):
+        self.id = uuid.uuid4().hex[:16]
+        self.prev = prev
+        self.curr = curr
+        self.sections = tuple(sections)
+        self.format = report_format
+        self.timeout = timeout
+        self.status = STATUS_QUEUED
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._chunks = []
+        self._pending = []
+        self._condition = threading.Condition()
+
+    def to_json(self) -> dict:
+        with self._condition:
+            return {'id': self.id, 'status': self.status, 'error': self.error, 'prev': self.prev, 'curr': self.curr,
+                    'sections': list(self.sections), 'format': self.format, 'timeout': self.timeout,
+                    'created': self.created, 'started': self.started, 'finished': self.finished}
+
+    def is_finished(self) -> bool:
+        with self._condition:
+            return self.status in FINISHED_STATUSES
+
+    def start(self):
+        with self._condition:
+            self.status = STATUS_RUNNING
+            self.started = time.time()
+
+    def finish(self, status: str, error: Optional[str] = None) -> bool:
+        # The first outcome wins: a comparison finishing after its timeout is discarded
+        with self._condition:
+            if self.status in FINISHED_STATUSES:
+                return False
+            self.status = status
+            self.error = error
+            self.finished = time.time()
+            self._condition.notify_all()
+            return True
+
+    def is_cancelled(self) -> bool:
+        return self.is_finished()
+
+    # write() and flush() make the job a sink for write_sections
+    def write(self, text: str):
+        self._pending.append(text)
+
+    def flush(self):
+        with self._condition:
+            if self.status == STATUS_RUNNING:
+                self._chunks.append(''.join(self._pending))
+                self._condition.notify_all()
+        self._pending.clear()
+
+    def iter_output(self) -> Iterator[str]:
+        index = 0
+        while True:
+            with self._condition:
+                while index == len(self._chunks) and self.status not in FINISHED_STATUSES:
+                    self._condition.wait()
+                chunks = self._chunks[index:]
+                finished = self.status in FINISHED_STATUSES
+            index += len(chunks)
+            yield from chunks
+            if finished and not chunks:
+                return
+
+
+class ComparisonService(object):
+    def __init__(self, workers: int, queue_size: int, job_timeout: float):
+        self.job_timeout = job_timeout
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._jobs = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._workers = [threading.Thread(target=self._work, name='worker-{}'.format(index), daemon=True)
+                         for index in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, job: Job) -> bool:
+        with self._lock:
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                return False
+            self._jobs[job.id] = job
+            self._drop_finished()
+        log().info('Queued job {}: {} vs {}'.format(job.id, job.prev, job.curr))
+        return True
+
+    def _drop_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.is_finished()]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self) -> list[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def status(self) -> dict:
+        statuses = collections.Counter(job.to_json()['status'] for job in self.jobs())
+        return {'version': __version__, 'workers': len(self._workers), 'queued': self._queue.qsize(),
+                'queue_size': self._queue.maxsize, 'jobs': dict(statuses), 'memory_cache': memory_cache_size()}
+
+    def stop(self):
+        for _ in self._workers:
+            self._queue.put(None)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            job.start()
+            # Every job submits its analyses to its own pool, so a timed out
+            # job can be cancelled without touching the others. apkanalyzer
+            # calls of the job are killed at its deadline.
+            deadline = time.monotonic() + job.timeout
+            executor = create_executor('job-{}'.format(job.id), deadline)
+            runner = threading.Thread(target=self._run, args=(job, executor, deadline), name='job-{}'.format(job.id),
+                                      daemon=True)
+            runner.start()
+            runner.join(job.timeout)
+            if runner.is_alive() and job.finish(STATUS_TIMEOUT, 'Timed out after {} s'.format(job.timeout)):
+                log().warning('Job {} timed out after {} s'.format(job.id, job.timeout))
+                # Analyses that have not started are dropped, the report waiting
+                # for them fails and the runner stops
+                executor.shutdown(wait=False, cancel_futures=True)
+            # The runner stops when its running analyses finished, so a timed out
+            # job does not overlap the next one. In-process analyses cannot be
+            # interrupted, a job stuck in one is left behind after a grace period.
+            runner.join(ABANDON_TIMEOUT)
+            if runner.is_alive():
+                log().warning('Job {} still runs {} s after its timeout, abandoning it'.format(
+                    job.id, ABANDON_TIMEOUT))
+
+    @staticmethod
+    def _sections(job: Job, sections: Iterable[Iterable[str]]) -> Iterator[Iterable[str]]:
+        for section in sections:
+            if job.is_cancelled():
+                return
+            yield section
+
+    def _run(self, job: Job, executor: Executor, deadline: float):
+        set_deadline(deadline)
+        try:
+            report = generate_report(Apk(job.prev), Apk(job.curr), job.sections, executor)
+            write_sections(self._sections(job, render(report, job.format)), job)
+        except Exception as e:
+            # A timed out job fails on its cancelled analyses, that is not reported
+            if job.finish(STATUS_FAILED, str(e)):
+                log().exception('Job {} failed'.format(job.id))
+            return
+        finally:
+            executor.shutdown(wait=True)
+        if job.finish(STATUS_DONE):
+            log().info('Job {} done in {:.1f} s'.format(job.id, job.finished - job.started))
+
+
+class ComparisonRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'apkcomparator/' + __version__
+
+    @property
+    def service(self) -> ComparisonService:
+        return self.server.service
+
+    def log_message(self, format, *args):
+        # Unix socket clients have no address
+        log().debug(format % args)
+
+    def _send_json(self, code: int, document: dict, headers: Optional[dict] = None):
+        body = json.dumps(document).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, code: int, message: str, headers: Optional[dict] = None):
+        self._send_json(code, {'error': message}, headers)
+
+    def do_GET(self):
+        if self.path == '/status':
+            self._send_json(200, self.service.status())
+            return
+        if self.path == '/jobs':
+            self._send_json(200, {'jobs': [job.to_json() for job in self.service.jobs()]})
+            return
+        match = _JOB_PATH.match(self.path)
+        job = self.service.get(match.group(1)) if match else None
+        if job is None:
+            self._send_error(404, 'Unknown job')
+        elif match.group(2) is None:
+            self._send_json(200, job.to_json())
+        else:
+            self._stream_report(job)
+
+    def _stream_report(self, job: Job):
+        description = job.to_json()
+        if description['status'] in (STATUS_FAILED, STATUS_TIMEOUT):
+            self._send_json(409, description)
+            return
+        # No length is known up front, the report ends when the connection is closed
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPES[job.format])
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        for chunk in job.iter_output():
+            self.wfile.write(chunk.encode())
+            self.wfile.flush()
+
+    def do_POST(self):
+        if self.path != '/jobs':
+            self._send_error(404, 'Unknown path')
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_REQUEST_SIZE:
+            self._send_error(413, 'Request is larger than {} bytes'.format(MAX_REQUEST_SIZE))
+            return
+        try:
+            job = self._parse_job(json.loads(self.rfile.read(length) or b'{}'))
+        except (ValueError, TypeError) as e:
+            self._send_error(400, str(e))
+            return
+        if not self.service.submit(job):
+            # Backpressure: clients retry later instead of piling up work
+            self._send_error(503, 'Job queue is full', {'Retry-After': str(RETRY_AFTER)})
+            return
+        self._send_json(202, job.to_json(), {'Location': '/jobs/{}'.format(job.id)})
+
+    def _parse_job(self, request: dict) -> Job:
+        if not isinstance(request, dict):
+            raise ValueError('Expected a JSON object')
+        paths = [request.get('prev'), request.get('curr')]
+        for path in paths:
+            if not isinstance(path, str) or not os.path.isfile(path):
+                raise ValueError('prev and curr must be paths of existing files, got {}'.format(path))
+        sections = request.get('sections') or get_sections()
+        unknown = [section for section in sections if section not in SECTIONS]
+        if isinstance(sections, str) or unknown:
+            raise ValueError('sections must be a list of {}'.format(', '.join(SECTIONS)))
+        check_bundle_sections(Apk(paths[0]), Apk(paths[1]), request.get('sections'))
+        report_format = request.get('format') or self.server.default_format
+        if report_format not in FORMATS:
+            raise ValueError('format must be one of {}'.format(', '.join(FORMATS)))
+        timeout = float(request.get('timeout') or self.service.job_timeout)
+        if timeout <= 0:
+            raise ValueError('timeout must be positive')
+        return Job(*(os.path.abspath(path) for path in paths), sections, report_format,
+                   min(timeout, self.service.job_timeout))
+
+
+class ComparisonHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class ComparisonUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def create_server(service: ComparisonService, default_format: str, host: str = DEFAULT_HOST,
+                  port: int = DEFAULT_PORT, socket_path: Optional[str] = None) -> socketserver.BaseServer:
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ComparisonUnixServer(socket_path, ComparisonRequestHandler)
+    else:
+        server = ComparisonHTTPServer((host, port), ComparisonRequestHandler)
+    server.service = service
+    server.default_format = default_format
+    return server
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Serve apk comparisons over HTTP')
+    parser.add_argument('--host', type=str, required=False,
+                        dest='host', default=DEFAULT_HOST,
+                        help='Address to listen on, {} by default'.format(DEFAULT_HOST))
+    parser.add_argument('--port', type=int, required=False,
+                        dest='port', default=DEFAULT_PORT,
+                        help='Port to listen on, {} by default'.format(DEFAULT_PORT))
+    parser.add_argument('--socket', type=str, required=False,
+                        dest='socket', default=None,
+                        help='Unix socket to listen on instead of --host and --port')
+    parser.add_argument('--workers', type=int, required=False,
+                        dest='workers', default=DEFAULT_WORKERS,
+                        help='Number of comparisons running at once')
+    parser.add_argument('--queue-size', type=int, required=False,
+                        dest='queuesize', default=DEFAULT_QUEUE_SIZE,
+                        help='Number of waiting jobs, further jobs are rejected with 503')
+    parser.add_argument('--job-timeout', type=float, required=False,
+                        dest='jobtimeout', default=DEFAULT_JOB_TIMEOUT,
+                        help='Maximum seconds a job may run, jobs can only ask for less')
+    parser.add_argument('--memory-cache', type=int, required=False,
+                        dest='memorycache', default=DEFAULT_MEMORY_CACHE,
+                        help='Number of per-apk analyses kept in memory for frequently compared apks')
+    add_common_arguments(parser)
+    args = parser.parse_args()
+    if args.workers < 1 or args.queuesize < 1 or args.jobtimeout <= 0:
+        parser.error('--workers, --queue-size and --job-timeout must be positive')
+    if len(args.formats) > 1:
+        parser.error('only one default --format can be set')
+    return args
+
+
+def main():
+    args = parse_args()
+    apply_common_arguments(args)
+    configure_memory_cache(args.memorycache)
+    service = ComparisonService(args.workers, args.queuesize, args.jobtimeout)
+    server = create_server(service, args.formats[0], args.host, args.port, args.socket)
+    log().info('Serving on {}'.format(args.socket or 'http://{}:{}'.format(args.host, args.port)))
+    # shutdown() waits for serve_forever(), so it cannot run in the handler's thread
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+        finish_tracing()
+
+
+if __name__ == '__main__':
+    main()
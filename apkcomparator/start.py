@@ -1,26 +1,129 @@
 import argparse
 import os.path
+import sys
+from typing import Iterable
 
-from apkcomparator.apk_comparator import generate_report
-from apkcomparator.data import Apk
+from apkcomparator.apk_comparator import (
+    BACKEND_APKANALYZER, BACKEND_NATIVE, BACKENDS, DEFAULT_SECTIONS, SECTIONS, check_bundle_sections,
+    find_budget_section, generate_report, set_backend, set_sections)
+from apkcomparator.apkanalyzer_daemon import DEFAULT_MAX_WORKERS, set_worker_count
+from apkcomparator.budget import EXIT_CODE, SEVERITY_ERROR, budget_passed, configure_budget
+from apkcomparator.cache import DEFAULT_MAX_SIZE, configure_cache
+from apkcomparator.categories import configure_categories
+from apkcomparator.data import Apk, ApkCompareReport
+from apkcomparator.patch_size import set_patch_estimation
+from apkcomparator.report_renderers import EXTENSIONS, FORMAT_TEXT, FORMATS, render
+from apkcomparator.report_writer import STDOUT, open_sink, write_sections
+from apkcomparator.trend_db import connect, record_apks
+from utils.concurrency import DEFAULT_PARALLELISM, set_parallelism
 from utils.environment import check_environment_variable_set
 from utils.logger import log
+from utils.tracing import configure_tracing, finish_tracing, span
 
 
-def get_report_file(args):
-    if args.out:
-        return args.out
+def get_result_directory() -> str:
     directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'result')
     if not os.path.exists(directory):
         os.makedirs(directory)
-    return os.path.join(directory, 'report.txt')
+    return directory
+
+
+def get_format_file(file: str, report_format: str, formats: list[str]) -> str:
+    # With several formats the output path only gives the name, the
+    # extension is replaced per format: report.txt -> report.json
+    if len(formats) == 1:
+        return file
+    file, compressed = (file[:-len('.gz')], '.gz') if file.endswith('.gz') else (file, '')
+    return os.path.splitext(file)[0] + EXTENSIONS[report_format] + compressed
+
+
+def get_report_file(args):
+    if args.out:
+        return args.out
+    return os.path.join(get_result_directory(), 'report' + EXTENSIONS[args.formats[0]])
 
 
-def verify_environment():
+def verify_environment(backend: str):
+    if backend != BACKEND_APKANALYZER:
+        return
     check_environment_variable_set('ANDROID_HOME')
     check_environment_variable_set('JAVA_HOME')
 
 
+def parse_formats(value: str) -> list[str]:
+    formats = [term.strip() for term in value.split(',') if term.strip()]
+    unknown = [term for term in formats if term not in FORMATS]
+    if not formats or unknown:
+        raise argparse.ArgumentTypeError('expected a comma separated list of {}'.format(', '.join(FORMATS)))
+    return list(dict.fromkeys(formats))
+
+
+def parse_sections(value: str) -> list[str]:
+    sections = [term.strip() for term in value.split(',') if term.strip()]
+    unknown = [term for term in sections if term not in SECTIONS]
+    if not sections or unknown:
+        raise argparse.ArgumentTypeError('expected a comma separated list of {}'.format(', '.join(SECTIONS)))
+    return list(dict.fromkeys(sections))
+
+
+def add_common_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--jobs', type=int, required=False,
+                        dest='jobs', default=DEFAULT_PARALLELISM,
+                        help='Maximum number of analyses and apkanalyzer processes running at once. '
+                             'Defaults to the number of CPUs.')
+    parser.add_argument('--backend', type=str, required=False,
+                        dest='backend', default=BACKEND_NATIVE, choices=BACKENDS,
+                        help='How apks are analyzed and compared: in-process ({}) or with apkanalyzer.'.format(
+                            BACKEND_NATIVE))
+    parser.add_argument('--apkanalyzer-workers', type=int, required=False,
+                        dest='apkanalyzerworkers', default=None,
+                        help='Number of warm apkanalyzer JVMs reused by all calls, 0 starts a process per call. '
+                             'Defaults to --jobs, but at most {}.'.format(DEFAULT_MAX_WORKERS))
+    parser.add_argument('--cache-dir', type=str, required=False,
+                        dest='cachedir', default=None,
+                        help='Directory for cached per-apk analyses. By default utils/tmp/cache is used.')
+    parser.add_argument('--cache-max-size', type=int, required=False,
+                        dest='cachemaxsize', default=DEFAULT_MAX_SIZE,
+                        help='Maximum cache size in bytes, least recently used analyses are evicted first.')
+    parser.add_argument('--no-cache', action='store_true', required=False,
+                        dest='nocache', default=False,
+                        help='Analyze both apks from scratch and do not store the results.')
+    parser.add_argument('--format', type=parse_formats, required=False,
+                        dest='formats', default=[FORMAT_TEXT],
+                        help='Comma separated report formats: {}. Defaults to {}.'.format(
+                            ', '.join(FORMATS), FORMAT_TEXT))
+    parser.add_argument('--sections', type=parse_sections, required=False,
+                        dest='sections', default=None,
+                        help='Comma separated report sections: {}. Only the analyses they need are run. '
+                             'Defaults to {}.'.format(', '.join(SECTIONS), ', '.join(DEFAULT_SECTIONS)))
+    parser.add_argument('--categories', type=str, required=False,
+                        dest='categories', default=None,
+                        help='JSON file with additional file categories and their diff thresholds.')
+    parser.add_argument('--patch-size', action='store_true', required=False,
+                        dest='patchsize', default=False,
+                        help='Estimate the size of the update patch from the previous apk to the current one.')
+    parser.add_argument('--trace', type=str, required=False,
+                        dest='trace', default=None,
+                        help='Chrome trace JSON file with the timings of every stage, open it in chrome://tracing '
+                             'or Perfetto. A summary table is logged as well.')
+    parser.add_argument('--profile', type=str, required=False,
+                        dest='profile', default=None,
+                        help='File the cProfile statistics of the in-process stages are saved to, '
+                             'read it with python -m pstats.')
+
+
+def apply_common_arguments(args):
+    verify_environment(args.backend)
+    set_parallelism(args.jobs)
+    set_backend(args.backend)
+    set_sections(args.sections)
+    set_worker_count(args.apkanalyzerworkers)
+    configure_cache(args.cachedir, args.cachemaxsize, not args.nocache)
+    configure_categories(args.categories)
+    set_patch_estimation(args.patchsize)
+    configure_tracing(args.trace, args.profile)
+
+
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument('--prev-apk-path', type=str, required=True,
@@ -31,14 +134,36 @@ def parse_args():
                         help='Current apk file path to compare with')
     parser.add_argument('--output', type=str, required=False,
                         dest='out', default=None,
-                        help='Optional output file. By default reports are stored in result directory.')
-    return parser.parse_args()
+                        help='Optional output file, "{}" for stdout, files ending with .gz are compressed. '
+                             'By default reports are stored in result directory.'.format(STDOUT))
+    parser.add_argument('--trend-db', type=str, required=False,
+                        dest='trenddb', default=None,
+                        help='SQLite database both apks are recorded to for apkcomparator.trend_db queries.')
+    parser.add_argument('--budget', type=str, required=False,
+                        dest='budget', default=None,
+                        help='JSON file with size budget rules. The run exits with {} when a rule with error '
+                             'severity is violated.'.format(EXIT_CODE))
+    parser.add_argument('--fail-fast', action='store_true', required=False,
+                        dest='failfast', default=False,
+                        help='Stop at the first budget failure, the comparisons the budget does not read are skipped.')
+    add_common_arguments(parser)
+    args = parser.parse_args()
+    if args.failfast and not args.budget:
+        parser.error('--fail-fast needs a --budget')
+    if args.out == STDOUT and len(args.formats) > 1:
+        parser.error('only one --format can be written to stdout')
+    return args
 
 
-def save_report_to_file(report: str, file: str):
+def save_report_to_file(sections: Iterable[Iterable[str]], file: str):
     log().info('Saving report to {}'.format(file))
-    with open(file, 'w') as file:
-        file.write(report)
+    with span('save_report_to_file', 'report', profile=True, file=file), open_sink(file) as sink:
+        write_sections(sections, sink)
+
+
+def save_report(report: ApkCompareReport, file: str, formats: list[str]):
+    for report_format in formats:
+        save_report_to_file(render(report, report_format), get_format_file(file, report_format, formats))
 
 
 def fetch_apks(args):
@@ -47,12 +172,23 @@ def fetch_apks(args):
 
 def main():
     args = parse_args()
-    verify_environment()
+    apply_common_arguments(args)
+    configure_budget(args.budget, args.failfast)
     prev_apk, curr_apk = fetch_apks(args)
     if not prev_apk or not curr_apk:
         raise RuntimeError('Cannot get apk(s), check error logs.')
+    check_bundle_sections(prev_apk, curr_apk, args.sections)
     report = generate_report(prev_apk, curr_apk)
-    save_report_to_file(report.report, get_report_file(args))
+    save_report(report, get_report_file(args), args.formats)
+    if args.trenddb:
+        record_apks(connect(args.trenddb), [prev_apk, curr_apk])
+    finish_tracing()
+    budget = find_budget_section(report)
+    if budget is not None and not budget_passed(budget.violations):
+        log().error('Budget failed: {}'.format('; '.join(
+            '{}: {}'.format(violation.rule, violation.message) for violation in budget.violations
+            if violation.severity == SEVERITY_ERROR)))
+        sys.exit(EXIT_CODE)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,322 @@
+import argparse
+import bisect
+import collections
+import datetime
+import sqlite3
+import sys
+from array import array
+from typing import Iterator, Optional
+
+from apkcomparator.apk_compare_result_processor import ReportLine, categorize_compare_result
+from apkcomparator.apk_comparator import ANALYSIS_MANIFEST, ANALYSIS_PLAIN_DATA, submit_analysis
+from apkcomparator.apk_reader import open_archive
+from apkcomparator.cache import apk_digest
+from apkcomparator.categories import configure_categories, get_category_index
+from apkcomparator.data import Apk, ApkAnalysis, ApkCompareReport, ApkPlainData, PlainDataSection
+from apkcomparator.report_renderers import FORMAT_TEXT, FORMATS, render
+from apkcomparator.report_writer import STDOUT, open_sink, write_sections
+from utils.concurrency import create_executor
+from utils.environment import get_temp_file
+from utils.logger import log
+
+DEFAULT_DATABASE = 'trends.sqlite3'
+PLAIN_DATA_METRICS = ApkPlainData._fields
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS builds (
+    id INTEGER PRIMARY KEY,
+    digest TEXT NOT NULL UNIQUE,
+    apk_path TEXT NOT NULL,
+    package TEXT,
+    version_name TEXT,
+    version_code INTEGER,
+    download_size INTEGER NOT NULL,
+    file_size INTEGER NOT NULL,
+    methods_count INTEGER NOT NULL,
+    recorded_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS builds_version ON builds (version_code, version_name);
+CREATE TABLE IF NOT EXISTS paths (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE
+);
+-- One row per build, every column is a packed little-endian array ordered by path id
+CREATE TABLE IF NOT EXISTS build_entries (
+    build_id INTEGER PRIMARY KEY REFERENCES builds (id) ON DELETE CASCADE,
+    path_ids BLOB NOT NULL,
+    compressed_sizes BLOB NOT NULL,
+    uncompressed_sizes BLOB NOT NULL,
+    crcs BLOB NOT NULL
+);
+'''
+
+Build = collections.namedtuple('Build', (
+    'id', 'digest', 'apk_path', 'package', 'version_name', 'version_code',
+    'download_size', 'file_size', 'methods_count', 'recorded_at'))
+
+BuildEntries = collections.namedtuple(
+    'BuildEntries', ('path_ids', 'compressed_sizes', 'uncompressed_sizes', 'crcs'))
+
+
+def _pack(values, typecode: str) -> bytes:
+    packed = array(typecode, values)
+    if sys.byteorder != 'little':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _unpack(blob: bytes, typecode: str) -> array:
+    unpacked = array(typecode)
+    unpacked.frombytes(blob)
+    if sys.byteorder != 'little':
+        unpacked.byteswap()
+    return unpacked
+
+
+def connect(database: Optional[str] = None) -> sqlite3.Connection:
+    connection = sqlite3.connect(database or get_temp_file(DEFAULT_DATABASE))
+    connection.execute('PRAGMA foreign_keys = ON')
+    connection.executescript(_SCHEMA)
+    return connection
+
+
+def _path_ids(connection: sqlite3.Connection, paths: list[str]) -> dict[str, int]:
+    connection.executemany('INSERT OR IGNORE INTO paths (path) VALUES (?)', ((path,) for path in paths))
+    ids = {}
+    # Stay below the SQLite bound variables limit
+    for start in range(0, len(paths), 500):
+        chunk = paths[start:start + 500]
+        query = 'SELECT path, id FROM paths WHERE path IN ({})'.format(','.join('?' * len(chunk)))
+        ids.update(connection.execute(query, chunk))
+    return ids
+
+
+def _version_code(analysis: ApkAnalysis) -> Optional[int]:
+    manifest = analysis.parsed_manifest
+    if manifest is None or manifest.version_code is None:
+        return None
+    try:
+        return int(manifest.version_code)
+    except ValueError:
+        return None
+
+
+def record_build(connection: sqlite3.Connection, apk: Apk, analysis: ApkAnalysis) -> int:
+    digest = apk_digest(apk)
+    existing = connection.execute('SELECT id FROM builds WHERE digest = ?', (digest,)).fetchone()
+    if existing:
+        log().info('{} is already recorded as build {}'.format(apk.apk_path, existing[0]))
+        return existing[0]
+    with open_archive(apk.apk_path) as archive:
+        entries = list(archive.entries.values())
+    manifest = analysis.parsed_manifest
+    with connection:
+        cursor = connection.execute(
+            'INSERT INTO builds (digest, apk_path, package, version_name, version_code, download_size, file_size, '
+            'methods_count, recorded_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (digest, apk.apk_path,
+             manifest.package if manifest else None,
+             manifest.version_name if manifest else None,
+             _version_code(analysis),
+             analysis.plain_data.download_size, analysis.plain_data.file_size, analysis.plain_data.methods_count,
+             datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')))
+        build_id = cursor.lastrowid
+        ids = _path_ids(connection, [entry.name for entry in entries])
+        entries.sort(key=lambda entry: ids[entry.name])
+        connection.execute(
+            'INSERT INTO build_entries (build_id, path_ids, compressed_sizes, uncompressed_sizes, crcs) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (build_id,
+             _pack((ids[entry.name] for entry in entries), 'q'),
+             _pack((entry.compressed_size for entry in entries), 'q'),
+             _pack((entry.uncompressed_size for entry in entries), 'q'),
+             _pack((entry.crc for entry in entries), 'I')))
+    log().info('Recorded {} as build {}'.format(apk.apk_path, build_id))
+    return build_id
+
+
+def record_apks(connection: sqlite3.Connection, apks: list[Apk]) -> list[int]:
+    # Analyses of just compared apks are usually served from the cache, a
+    # build only stores its plain data and manifest
+    with create_executor('trends') as executor:
+        analyses = [submit_analysis(apk, executor, (ANALYSIS_PLAIN_DATA, ANALYSIS_MANIFEST)) for apk in apks]
+        return [record_build(connection, apk, analysis()) for apk, analysis in zip(apks, analyses)]
+
+
+def list_builds(connection: sqlite3.Connection) -> list[Build]:
+    return [Build(*row) for row in connection.execute(
+        'SELECT {} FROM builds ORDER BY version_code, id'.format(', '.join(Build._fields)))]
+
+
+def resolve_build(connection: sqlite3.Connection, reference: str) -> Build:
+    # A build is referenced by version name, then by version code, the newest one wins
+    query = 'SELECT {} FROM builds WHERE {{}} = ? ORDER BY id DESC LIMIT 1'.format(', '.join(Build._fields))
+    row = connection.execute(query.format('version_name'), (reference,)).fetchone()
+    if row is None and reference.isdigit():
+        row = connection.execute(query.format('version_code'), (int(reference),)).fetchone()
+    if row is None:
+        raise RuntimeError('No recorded build with version name or code {}'.format(reference))
+    return Build(*row)
+
+
+def load_entries(connection: sqlite3.Connection, build_id: int) -> BuildEntries:
+    row = connection.execute(
+        'SELECT path_ids, compressed_sizes, uncompressed_sizes, crcs FROM build_entries WHERE build_id = ?',
+        (build_id,)).fetchone()
+    if row is None:
+        return BuildEntries(array('q'), array('q'), array('q'), array('I'))
+    return BuildEntries(_unpack(row[0], 'q'), _unpack(row[1], 'q'), _unpack(row[2], 'q'), _unpack(row[3], 'I'))
+
+
+def _paths(connection: sqlite3.Connection, path_ids) -> dict[int, str]:
+    path_ids = list(path_ids)
+    paths = {}
+    for start in range(0, len(path_ids), 500):
+        chunk = path_ids[start:start + 500]
+        query = 'SELECT id, path FROM paths WHERE id IN ({})'.format(','.join('?' * len(chunk)))
+        paths.update(connection.execute(query, chunk))
+    return paths
+
+
+def metric_series(connection: sqlite3.Connection, metric: str) -> Iterator[tuple[Build, int]]:
+    if metric not in PLAIN_DATA_METRICS:
+        raise RuntimeError('Unknown metric {}, expected one of {}'.format(metric, ', '.join(PLAIN_DATA_METRICS)))
+    for build in list_builds(connection):
+        yield build, getattr(build, metric)
+
+
+def path_series(connection: sqlite3.Connection, path: str) -> Iterator[tuple[Build, int]]:
+    row = connection.execute('SELECT id FROM paths WHERE path = ?', (path,)).fetchone()
+    path_id = row[0] if row else -1
+    for build in list_builds(connection):
+        entries = load_entries(connection, build.id)
+        index = bisect.bisect_left(entries.path_ids, path_id)
+        found = index < len(entries.path_ids) and entries.path_ids[index] == path_id
+        yield build, entries.compressed_sizes[index] if found else 0
+
+
+def category_series(connection: sqlite3.Connection, category: str) -> Iterator[tuple[Build, int]]:
+    index = get_category_index()
+    names = [known.name for known in index.categories]
+    if category not in names and category != index.other.name:
+        raise RuntimeError('Unknown category {}, expected one of {}'.format(
+            category, ', '.join(names + [index.other.name])))
+    position = names.index(category) if category in names else None
+    membership = {}
+    for build in list_builds(connection):
+        entries = load_entries(connection, build.id)
+        unknown = [path_id for path_id in entries.path_ids if path_id not in membership]
+        for path_id, path in _paths(connection, unknown).items():
+            matches = index.match(path)
+            membership[path_id] = position in matches if position is not None else not matches
+        yield build, sum(size for path_id, size in zip(entries.path_ids, entries.compressed_sizes)
+                         if membership[path_id])
+
+
+def diff_builds(connection: sqlite3.Connection, prev: Build, curr: Build) -> list[ReportLine]:
+    lhs = load_entries(connection, prev.id)
+    rhs = load_entries(connection, curr.id)
+    lhs_index = {path_id: position for position, path_id in enumerate(lhs.path_ids)}
+    rhs_index = {path_id: position for position, path_id in enumerate(rhs.path_ids)}
+    changed = []
+    for path_id in lhs_index.keys() | rhs_index.keys():
+        left = lhs_index.get(path_id)
+        right = rhs_index.get(path_id)
+        if (left is not None and right is not None and lhs.crcs[left] == rhs.crcs[right] and
+                lhs.compressed_sizes[left] == rhs.compressed_sizes[right] and
+                lhs.uncompressed_sizes[left] == rhs.uncompressed_sizes[right]):
+            continue
+        changed.append((path_id, left, right))
+    paths = _paths(connection, (path_id for path_id, _, _ in changed))
+    lines = []
+    for path_id, left, right in changed:
+        lhs_size = lhs.compressed_sizes[left] if left is not None else 0
+        rhs_size = rhs.compressed_sizes[right] if right is not None else 0
+        lines.append(ReportLine(
+            lhs_size=lhs_size,
+            rhs_size=rhs_size,
+            diff=rhs_size - lhs_size,
+            path=paths[path_id],
+            lhs_uncompressed_size=lhs.uncompressed_sizes[left] if left is not None else 0,
+            rhs_uncompressed_size=rhs.uncompressed_sizes[right] if right is not None else 0))
+    return sorted(lines, key=lambda line: line.path)
+
+
+def _plain_data(build: Build) -> ApkPlainData:
+    return ApkPlainData(*(getattr(build, metric) for metric in PLAIN_DATA_METRICS))
+
+
+def build_diff_report(connection: sqlite3.Connection, prev: Build, curr: Build) -> ApkCompareReport:
+    return ApkCompareReport([
+        lambda: PlainDataSection(prev=_plain_data(prev), curr=_plain_data(curr)),
+        lambda: categorize_compare_result(diff_builds(connection, prev, curr)),
+    ])
+
+
+def _format_series(series: Iterator[tuple[Build, int]]) -> Iterator[str]:
+    yield '\t'.join(('build', 'version_name', 'version_code', 'recorded_at', 'value'))
+    for build, value in series:
+        yield '\t'.join(str(term) for term in (build.id, build.version_name, build.version_code,
+                                               build.recorded_at, value))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Size trends of recorded builds')
+    parser.add_argument('--db', type=str, required=False,
+                        dest='db', default=None,
+                        help='SQLite database. By default utils/tmp/{} is used.'.format(DEFAULT_DATABASE))
+    parser.add_argument('--categories', type=str, required=False,
+                        dest='categories', default=None,
+                        help='JSON file with additional file categories')
+    commands = parser.add_subparsers(dest='command', required=True)
+    record = commands.add_parser('record', help='Analyze apks and append them to the database')
+    record.add_argument('apks', nargs='+', help='Apk files to record')
+    commands.add_parser('builds', help='List recorded builds')
+    series = commands.add_parser('series', help='Print a size time series')
+    target = series.add_mutually_exclusive_group(required=True)
+    target.add_argument('--metric', type=str, choices=PLAIN_DATA_METRICS, default=None,
+                        help='Plain data metric')
+    target.add_argument('--path', type=str, default=None,
+                        help='Entry path inside the apk, for example lib/arm64-v8a/libapp.so')
+    target.add_argument('--category', type=str, default=None,
+                        help='File category, for example Libraries')
+    diff = commands.add_parser('diff', help='Compare two recorded builds without reading the apks')
+    diff.add_argument('prev', help='Version name or code of the previous build')
+    diff.add_argument('curr', help='Version name or code of the current build')
+    diff.add_argument('--format', type=str, choices=FORMATS, dest='format', default=FORMAT_TEXT,
+                      help='Report format')
+    diff.add_argument('--output', type=str, dest='out', default=STDOUT,
+                      help='Output file, stdout by default')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    configure_categories(args.categories)
+    connection = connect(args.db)
+    if args.command == 'record':
+        record_apks(connection, [Apk(path) for path in args.apks])
+        return
+    if args.command == 'builds':
+        lines = ['\t'.join(Build._fields)]
+        lines.extend('\t'.join(str(term) for term in build) for build in list_builds(connection))
+        with open_sink(STDOUT) as sink:
+            write_sections([lines], sink)
+        return
+    if args.command == 'series':
+        if args.metric:
+            series = metric_series(connection, args.metric)
+        elif args.path:
+            series = path_series(connection, args.path)
+        else:
+            series = category_series(connection, args.category)
+        with open_sink(STDOUT) as sink:
+            write_sections([_format_series(series)], sink)
+        return
+    report = build_diff_report(connection, resolve_build(connection, args.prev), resolve_build(connection, args.curr))
+    with open_sink(args.out) as sink:
+        write_sections(render(report, args.format), sink)
+
+
+if __name__ == '__main__':
+    main()
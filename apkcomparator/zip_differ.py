@@ -0,0 +1,42 @@
+from typing import Iterator, Optional
+
+from apkcomparator.apk_compare_result_processor import ReportLine
+from apkcomparator.apk_reader import ZipArchive, ZipEntry
+
+
+def _is_same(lhs: ZipEntry, rhs: ZipEntry) -> bool:
+    return (lhs.crc == rhs.crc and
+            lhs.compressed_size == rhs.compressed_size and
+            lhs.uncompressed_size == rhs.uncompressed_size)
+
+
+def iter_changed(prev: dict[str, ZipEntry], curr: dict[str, ZipEntry],
+                 prefix: str = '') -> Iterator[tuple[str, Optional[ZipEntry], Optional[ZipEntry]]]:
+    # Only central directory records are compared, entry data is never read
+    for path in sorted(prev.keys() | curr.keys()):
+        if not path.startswith(prefix):
+            continue
+        lhs = prev.get(path)
+        rhs = curr.get(path)
+        if lhs is None or rhs is None or not _is_same(lhs, rhs):
+            yield path, lhs, rhs
+
+
+def iter_changed_entries(prev: ZipArchive, curr: ZipArchive,
+                         prefix: str = '') -> Iterator[tuple[str, Optional[ZipEntry], Optional[ZipEntry]]]:
+    return iter_changed(prev.entries, curr.entries, prefix)
+
+
+def diff_archives(prev: ZipArchive, curr: ZipArchive) -> list[ReportLine]:
+    lines = []
+    for path, lhs, rhs in iter_changed_entries(prev, curr):
+        lhs_size = lhs.compressed_size if lhs is not None else 0
+        rhs_size = rhs.compressed_size if rhs is not None else 0
+        lines.append(ReportLine(
+            lhs_size=lhs_size,
+            rhs_size=rhs_size,
+            diff=rhs_size - lhs_size,
+            path=path,
+            lhs_uncompressed_size=lhs.uncompressed_size if lhs is not None else 0,
+            rhs_uncompressed_size=rhs.uncompressed_size if rhs is not None else 0))
+    return lines
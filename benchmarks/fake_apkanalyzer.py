@@ -0,0 +1,73 @@
+import os
+import stat
+import sys
+
+from apkcomparator.apk_reader import open_archive
+from apkcomparator.binary_xml import decode_xml
+from apkcomparator.dex_reader import count_packages, count_references
+from apkcomparator.download_size import estimate_download_size
+from apkcomparator.zip_differ import diff_archives
+
+# Answers the apkanalyzer commands apkcomparator runs with the in-process
+# readers, so the apkanalyzer backend can be measured without the Android SDK.
+# A process is still started per call, only the JVM is missing.
+_SCRIPT = '''#!/bin/sh
+PYTHONPATH="{root}${{PYTHONPATH:+:$PYTHONPATH}}" exec "{python}" -m benchmarks.fake_apkanalyzer "$@"
+'''
+
+
+def write_fake_sdk(directory: str) -> str:
+    # Returns the directory to use as ANDROID_HOME
+    bin_directory = os.path.join(directory, 'tools', 'bin')
+    os.makedirs(bin_directory, exist_ok=True)
+    script = os.path.join(bin_directory, 'apkanalyzer')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with open(script, 'w') as stream:
+        stream.write(_SCRIPT.format(root=root, python=sys.executable))
+    os.chmod(script, os.stat(script).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return directory
+
+
+def _dex_packages(archive) -> list[str]:
+    # One class row per package and one row per field, like "dex packages"
+    table = count_packages(archive)
+    lines = []
+    for index, package in enumerate(table.names):
+        name = '{}.Package'.format(package) if package else 'Package'
+        lines.append('C d {} {} {} {}'.format(table.methods[index], table.methods[index], table.sizes[index], name))
+        lines.extend('F d 0 0 0 {} int f{}'.format(name, field) for field in range(table.fields[index]))
+    return lines
+
+
+def run(args: list[str]) -> list[str]:
+    command = ' '.join(args[:2])
+    if command == 'apk compare':
+        paths = [arg for arg in args[2:] if not arg.startswith('--')]
+        with open_archive(paths[0]) as prev, open_archive(paths[1]) as curr:
+            return ['{}\t{}\t{}\t/{}'.format(line.lhs_size, line.rhs_size, line.diff, line.path)
+                    for line in diff_archives(prev, curr)]
+    with open_archive(args[-1]) as archive:
+        if command == 'apk download-size':
+            return [str(estimate_download_size(archive))]
+        if command == 'apk file-size':
+            return [str(archive.size)]
+        if command == 'dex references':
+            return ['{}\t{}'.format(counts.name, counts.methods) for counts in count_references(archive).dex_counts]
+        if command == 'dex packages':
+            return _dex_packages(archive)
+        if command == 'manifest print':
+            return [decode_xml(archive.read(archive.entries['AndroidManifest.xml']))]
+    raise RuntimeError('Unsupported command: apkanalyzer {}'.format(' '.join(args)))
+
+
+def main():
+    try:
+        lines = run(sys.argv[1:])
+    except Exception as e:
+        sys.stderr.write('{}\n'.format(e))
+        sys.exit(1)
+    sys.stdout.write('\n'.join(lines) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+import argparse
+import gc
+import time
+import tracemalloc
+import xml.etree.ElementTree as ElementTree
+from typing import Callable
+
+from apkcomparator.android_manifest_comparator import ANDROID_NAMESPACE, parse_manifest
+
+COMPONENT_TAGS = ('activity', 'activity-alias', 'service', 'receiver', 'provider', 'meta-data')
+
+
+def generate_manifest(components: int) -> str:
+    lines = ['<?xml version="1.0" encoding="utf-8"?>',
+             '<manifest xmlns:android="{}" package="com.example.benchmark" '
+             'android:versionCode="1" android:versionName="1.0">'.format(ANDROID_NAMESPACE),
+             '<uses-sdk android:minSdkVersion="21" android:targetSdkVersion="34"/>']
+    lines.extend('<uses-permission android:name="com.example.permission.P{}"/>'.format(i) for i in range(100))
+    lines.append('<application android:label="Benchmark">')
+    for i in range(components):
+        tag = COMPONENT_TAGS[i % len(COMPONENT_TAGS)]
+        lines.append('<{tag} android:name="com.example.component.{tag}{i}" android:exported="false">'
+                     '<intent-filter><action android:name="com.example.action.A{i}"/></intent-filter>'
+                     '<meta-data android:name="com.example.meta.M{i}" android:value="{i}"/></{tag}>'.format(
+                         tag=tag, i=i))
+    lines.append('</application></manifest>')
+    return '\n'.join(lines)
+
+
+def parse_manifest_dom(manifest: str) -> dict:
+    # What parse_manifest did before the streaming parser: a full DOM and
+    # one findall() walk per collected tag
+    name = '{{{}}}name'.format(ANDROID_NAMESPACE)
+
+    def names(tree, tag):
+        return {element.attrib[name] for element in tree.findall(tag) if element.attrib.get(name)}
+
+    tree = ElementTree.fromstring(manifest)
+    application = tree.find('application')
+    return {
+        'package': tree.attrib['package'],
+        'manifest': {tag: names(tree, tag) for tag in (
+            'permission', 'uses-feature', 'uses-permission', 'uses-permission-sdk-23', 'supports-gl-texture')},
+        'application': {tag: names(application, tag) for tag in COMPONENT_TAGS},
+        'uses_sdk': dict(tree.find('uses-sdk').attrib),
+        'tree': tree,
+    }
+
+
+def measure(parse: Callable[[str], object], manifest: str, repeat: int) -> tuple[float, int, int]:
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        parse(manifest)
+        timings.append(time.perf_counter() - started)
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    result = parse(manifest)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return min(timings), peak - baseline, retained - baseline
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manifest parsing time and memory')
+    parser.add_argument('--components', type=int, default=5000,
+                        help='Number of application components in the generated manifest')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Parses per parser, the fastest one is reported')
+    args = parser.parse_args()
+    manifest = generate_manifest(args.components)
+    print('Manifest: {} components, {:.1f} KB'.format(args.components, len(manifest) / 1024))
+    print('{:<12}{:>12}{:>14}{:>16}'.format('parser', 'time, ms', 'peak, KB', 'retained, KB'))
+    for name, parse in (('dom', parse_manifest_dom), ('streaming', parse_manifest)):
+        elapsed, peak, retained = measure(parse, manifest, args.repeat)
+        print('{:<12}{:>12.1f}{:>14.1f}{:>16.1f}'.format(name, elapsed * 1000, peak / 1024, retained / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+import argparse
+import collections
+import functools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Optional
+
+from apkcomparator import __version__
+from apkcomparator.android_manifest_comparator import diff_manifests, parse_manifest
+from apkcomparator.apk_compare_result_processor import categorize_compare_result
+from apkcomparator.apk_comparator import (
+    BACKEND_APKANALYZER, BACKEND_NATIVE, SECTIONS, generate_report, get_compare_report_lines, get_dex_packages,
+    get_download_size, get_download_size_diff, get_duplicates, get_manifest, get_methods_count,
+    get_native_libraries_diff, get_patch_size, get_resources_diff, set_backend)
+from apkcomparator.apkanalyzer_daemon import set_worker_count
+from apkcomparator.cache import configure_cache
+from apkcomparator.data import Apk
+from apkcomparator.dex_packages_comparator import diff_dex_packages
+from apkcomparator.manifest_tree import diff_manifest_trees
+from apkcomparator.patch_size import set_patch_estimation
+from apkcomparator.report_renderers import FORMAT_TEXT, render
+from benchmarks.fake_apkanalyzer import write_fake_sdk
+from benchmarks.synthetic_apk import ApkSpec, generate_apk
+from utils.concurrency import set_parallelism
+
+# Every run of a stage gets a fresh spawned process: nothing is warmed up by
+# an earlier run and the peak RSS belongs to that stage alone.
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.2
+# Differences below these are noise on any machine and never fail a comparison
+MIN_TIME_REGRESSION = 0.05
+MIN_RSS_REGRESSION = 4 << 20
+
+# prepare(prev, curr) does the untimed setup and returns the timed call
+Stage = collections.namedtuple('Stage', ('name', 'prepare'))
+
+
+def _consume(report) -> int:
+    return sum(len(line) for section in render(report, FORMAT_TEXT) for line in section)
+
+
+def _prepare_manifests(prev: Apk, curr: Apk) -> Callable[[], object]:
+    prev_manifest, curr_manifest = parse_manifest(get_manifest(prev)), parse_manifest(get_manifest(curr))
+    return functools.partial(diff_manifests, prev_manifest, curr_manifest)
+
+
+def _prepare_manifest_tree(prev: Apk, curr: Apk) -> Callable[[], object]:
+    return functools.partial(diff_manifest_trees, get_manifest(prev), get_manifest(curr))
+
+
+def _prepare_dex_packages_diff(prev: Apk, curr: Apk) -> Callable[[], object]:
+    return functools.partial(diff_dex_packages, get_dex_packages(prev), get_dex_packages(curr))
+
+
+def _prepare_report(backend: str, prev: Apk, curr: Apk) -> Callable[[], object]:
+    set_backend(backend)
+    set_patch_estimation(True)
+    return lambda: _consume(generate_report(prev, curr, SECTIONS))
+
+
+STAGES = (
+    Stage('download_size', lambda prev, curr: functools.partial(get_download_size, curr)),
+    Stage('methods_count', lambda prev, curr: functools.partial(get_methods_count, curr)),
+    Stage('dex_packages', lambda prev, curr: functools.partial(get_dex_packages, curr)),
+    Stage('manifest', lambda prev, curr: functools.partial(get_manifest, curr)),
+    Stage('duplicates', lambda prev, curr: functools.partial(get_duplicates, curr)),
+    Stage('files', lambda prev, curr: lambda: categorize_compare_result(get_compare_report_lines(prev, curr))),
+    Stage('download_entries', lambda prev, curr: functools.partial(get_download_size_diff, prev, curr)),
+    Stage('native_libraries', lambda prev, curr: functools.partial(get_native_libraries_diff, prev, curr)),
+    Stage('dex_packages_diff', _prepare_dex_packages_diff),
+    Stage('resources', lambda prev, curr: functools.partial(get_resources_diff, prev, curr)),
+    Stage('manifest_diff', _prepare_manifests),
+    Stage('manifest_tree', _prepare_manifest_tree),
+    Stage('patch_size', lambda prev, curr: functools.partial(get_patch_size, prev, curr)),
+    Stage('report', functools.partial(_prepare_report, BACKEND_NATIVE)),
+    Stage('report_apkanalyzer', functools.partial(_prepare_report, BACKEND_APKANALYZER)),
+)
+STAGE_NAMES = tuple(stage.name for stage in STAGES)
+
+
+def _peak_rss() -> int:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * scale
+
+
+def _run_stage(name: str, prev_path: str, curr_path: str, sdk: str, jobs: int) -> tuple[float, int]:
+    os.environ['ANDROID_HOME'] = sdk
+    set_parallelism(jobs)
+    set_worker_count(0)
+    configure_cache(enabled=False)
+    stage = STAGES[STAGE_NAMES.index(name)]
+    call = stage.prepare(Apk(prev_path), Apk(curr_path))
+    started = time.perf_counter()
+    call()
+    return time.perf_counter() - started, _peak_rss()
+
+
+def measure(name: str, prev_path: str, curr_path: str, sdk: str, jobs: int, repeat: int) -> dict:
+    timings, peaks = [], []
+    for _ in range(repeat):
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            elapsed, peak = executor.submit(_run_stage, name, prev_path, curr_path, sdk, jobs).result()
+        timings.append(elapsed)
+        peaks.append(peak)
+    return {'wall_time': min(timings), 'peak_rss': min(peaks)}
+
+
+def find_regressions(result: dict, baseline: dict, threshold: float) -> list[str]:
+    regressions = []
+    for name, stage in result['stages'].items():
+        base = baseline['stages'].get(name)
+        if base is None:
+            continue
+        for metric, noise in (('wall_time', MIN_TIME_REGRESSION), ('peak_rss', MIN_RSS_REGRESSION)):
+            if stage[metric] > base[metric] * (1 + threshold) and stage[metric] - base[metric] > noise:
+                regressions.append('{} {}: {:.3f} -> {:.3f} (+{:.0f}%)'.format(
+                    name, metric, base[metric], stage[metric], 100.0 * (stage[metric] / base[metric] - 1)))
+    return regressions
+
+
+def _change(value: float, base: Optional[float]) -> str:
+    return '{:+.0f}%'.format(100.0 * (value / base - 1)) if base else ''
+
+
+def print_table(result: dict, baseline: Optional[dict]):
+    base_stages = baseline['stages'] if baseline else {}
+    print('{:<22}{:>12}{:>9}{:>14}{:>9}'.format('stage', 'time, ms', '', 'peak RSS, MB', ''))
+    for name, stage in result['stages'].items():
+        base = base_stages.get(name, {})
+        print('{:<22}{:>12.1f}{:>9}{:>14.1f}{:>9}'.format(
+            name, stage['wall_time'] * 1000, _change(stage['wall_time'], base.get('wall_time')),
+            stage['peak_rss'] / (1 << 20), _change(stage['peak_rss'], base.get('peak_rss'))))
+
+
+def parse_stages(value: str) -> list[str]:
+    stages = [term.strip() for term in value.split(',') if term.strip()]
+    unknown = [term for term in stages if term not in STAGE_NAMES]
+    if not stages or unknown:
+        raise argparse.ArgumentTypeError('expected a comma separated list of {}'.format(', '.join(STAGE_NAMES)))
+    return list(dict.fromkeys(stages))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Wall time and peak memory of every apkcomparator stage')
+    for field in ApkSpec._fields:
+        parser.add_argument('--' + field.replace('_', '-'), type=int, dest=field,
+                            default=ApkSpec._field_defaults[field],
+                            help='Synthetic apk {}'.format(field.replace('_', ' ')))
+    parser.add_argument('--stages', type=parse_stages, default=list(STAGE_NAMES),
+                        help='Comma separated stages: {}. Defaults to all stages.'.format(', '.join(STAGE_NAMES)))
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help='Runs per stage, the fastest one is reported')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Parallelism of the measured stages, 1 keeps timings comparable between machines')
+    parser.add_argument('--workdir', type=str, default=None,
+                        help='Directory for the generated apks and the fake SDK. Defaults to a temporary one.')
+    parser.add_argument('--output', type=str, default=None,
+                        help='JSON file the results are written to, use it as a later --baseline')
+    parser.add_argument('--baseline', type=str, default=None,
+                        help='JSON results of an earlier run, the run fails when a stage regressed')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Relative slowdown or memory growth counted as a regression')
+    return parser.parse_args()
+
+
+def run(args, workdir: str) -> dict:
+    spec = ApkSpec(**{field: getattr(args, field) for field in ApkSpec._fields})
+    prev_path, curr_path = os.path.join(workdir, 'prev.apk'), os.path.join(workdir, 'curr.apk')
+    generate_apk(prev_path, spec, revision=0)
+    generate_apk(curr_path, spec, revision=1)
+    sdk = write_fake_sdk(os.path.join(workdir, 'sdk'))
+    return {
+        'version': __version__,
+        'python': platform.python_version(),
+        'spec': spec._asdict(),
+        'repeat': args.repeat,
+        'stages': {name: measure(name, prev_path, curr_path, sdk, args.jobs, args.repeat) for name in args.stages},
+    }
+
+
+def main():
+    args = parse_args()
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as stream:
+            baseline = json.load(stream)
+        if baseline['spec'] != ApkSpec(**{field: getattr(args, field) for field in ApkSpec._fields})._asdict():
+            sys.exit('Baseline {} was measured on other synthetic apks: {}'.format(args.baseline, baseline['spec']))
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+        result = run(args, args.workdir)
+    else:
+        with tempfile.TemporaryDirectory(prefix='apkcomparator-benchmark') as workdir:
+            result = run(args, workdir)
+    print_table(result, baseline)
+    if args.output:
+        with open(args.output, 'w') as stream:
+            json.dump(result, stream, indent=2)
+    if baseline:
+        regressions = find_regressions(result, baseline, args.threshold)
+        if regressions:
+            print('Regressions over {:.0f}%:'.format(args.threshold * 100))
+            print('\n'.join(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
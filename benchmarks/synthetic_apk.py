@@ -0,0 +1,268 @@
+import argparse
+import collections
+import random
+import struct
+import xml.etree.ElementTree as ElementTree
+import zipfile
+
+from apkcomparator.android_manifest_comparator import ANDROID_NAMESPACE
+from benchmarks.manifest_parsing import generate_manifest
+
+# Revision 0 is the previous build, revision 1 the current one: a share of the
+# files changes, classes, components and resources are added.
+ApkSpec = collections.namedtuple('ApkSpec', (
+    'entries', 'dex_files', 'classes', 'components', 'resources', 'libraries', 'seed'),
+    defaults=(1000, 2, 2000, 500, 1000, 2, 1))
+
+CHANGED_SHARE = 0.1
+ABIS = ('arm64-v8a', 'armeabi-v7a')
+METHODS_PER_CLASS = 8
+FIELDS_PER_CLASS = 4
+INSTRUCTIONS_PER_METHOD = 40
+PACKAGES = 50
+RESOURCE_TYPES = ('drawable', 'layout', 'string')
+
+
+def _string_pool(strings: list[str]) -> bytes:
+    # UTF-16 pool, lengths below 0x8000 take one u16
+    offsets = []
+    data = bytearray()
+    for string in strings:
+        offsets.append(len(data))
+        data += struct.pack('<H', len(string)) + string.encode('utf-16-le') + b'\0\0'
+    while len(data) % 4:
+        data += b'\0'
+    header_size = 28
+    body = struct.pack('<{}I'.format(len(offsets)), *offsets) + bytes(data)
+    return struct.pack('<HHIIIIII', 0x0001, header_size, header_size + len(body), len(strings), 0, 0,
+                       header_size + 4 * len(strings), 0) + body
+
+
+def encode_binary_xml(text: str) -> bytes:
+    root = ElementTree.fromstring(text)
+    strings = []
+    indices = {}
+
+    def string(value: str) -> int:
+        if value not in indices:
+            indices[value] = len(strings)
+            strings.append(value)
+        return indices[value]
+
+    namespace = '{{{}}}'.format(ANDROID_NAMESPACE)
+    prefix, uri = string('android'), string(ANDROID_NAMESPACE)
+    chunks = [struct.pack('<HHIIIII', 0x0100, 16, 24, 1, 0xffffffff, prefix, uri)]
+
+    def emit(element):
+        attributes = []
+        for name, value in element.attrib.items():
+            attribute_namespace = uri if name.startswith(namespace) else 0xffffffff
+            name_index = string(name[len(namespace):] if name.startswith(namespace) else name)
+            if value in ('true', 'false'):
+                typed = (0xffffffff, 0x12, 0xffffffff if value == 'true' else 0)
+            elif value.isdigit():
+                typed = (0xffffffff, 0x10, int(value))
+            else:
+                typed = (string(value), 0x03, string(value))
+            attributes.append(struct.pack('<IIIHBBI', attribute_namespace, name_index, typed[0], 8, 0, typed[1],
+                                          typed[2]))
+        tag = string(element.tag)
+        body = struct.pack('<IIHHHHHH', 0xffffffff, tag, 20, 20, len(attributes), 0, 0, 0) + b''.join(attributes)
+        chunks.append(struct.pack('<HHIII', 0x0102, 16, 16 + len(body), 1, 0xffffffff) + body)
+        for child in element:
+            emit(child)
+        chunks.append(struct.pack('<HHIIIII', 0x0103, 16, 24, 1, 0xffffffff, 0xffffffff, tag))
+
+    emit(root)
+    chunks.append(struct.pack('<HHIIIII', 0x0101, 16, 24, 1, 0xffffffff, prefix, uri))
+    body = _string_pool(strings) + b''.join(chunks)
+    return struct.pack('<HHI', 0x0003, 8, 8 + len(body)) + body
+
+
+def _uleb128(value: int) -> bytes:
+    result = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            result.append(byte | 0x80)
+        else:
+            result.append(byte)
+            return bytes(result)
+
+
+def generate_dex(descriptors: list[str]) -> bytes:
+    # Every class defines its methods and fields, every method has a code item
+    descriptors = sorted(descriptors)
+    count = len(descriptors)
+    offset = 0x70
+    string_ids_off = offset
+    offset += 4 * count
+    type_ids_off = offset
+    offset += 4 * count
+    field_ids_off = offset
+    offset += 8 * count * FIELDS_PER_CLASS
+    method_ids_off = offset
+    offset += 8 * count * METHODS_PER_CLASS
+    class_defs_off = offset
+    offset += 32 * count
+    data_off = offset
+    data = bytearray()
+    string_offsets = []
+    for descriptor in descriptors:
+        string_offsets.append(data_off + len(data))
+        data += _uleb128(len(descriptor)) + descriptor.encode() + b'\0'
+    code_offsets = []
+    for _ in range(count * METHODS_PER_CLASS):
+        while (data_off + len(data)) % 4:
+            data += b'\0'
+        code_offsets.append(data_off + len(data))
+        data += struct.pack('<4H2I', 1, 1, 0, 0, 0, INSTRUCTIONS_PER_METHOD) + b'\0\0' * INSTRUCTIONS_PER_METHOD
+    class_data_offsets = []
+    for index in range(count):
+        class_data_offsets.append(data_off + len(data))
+        data += _uleb128(0) + _uleb128(FIELDS_PER_CLASS) + _uleb128(METHODS_PER_CLASS) + _uleb128(0)
+        for field in range(FIELDS_PER_CLASS):
+            data += _uleb128(index * FIELDS_PER_CLASS if field == 0 else 1) + _uleb128(1)
+        for method in range(METHODS_PER_CLASS):
+            data += (_uleb128(index * METHODS_PER_CLASS if method == 0 else 1) + _uleb128(1) +
+                     _uleb128(code_offsets[index * METHODS_PER_CLASS + method]))
+    header = bytearray(0x70)
+    header[0:8] = b'dex\n035\0'
+    struct.pack_into('<III', header, 0x20, data_off + len(data), 0x70, 0x12345678)
+    struct.pack_into('<8I', header, 0x38, count, string_ids_off, count, type_ids_off, 0, 0,
+                     count * FIELDS_PER_CLASS, field_ids_off)
+    struct.pack_into('<6I', header, 0x58, count * METHODS_PER_CLASS, method_ids_off, count, class_defs_off,
+                     len(data), data_off)
+    ids = bytearray()
+    ids += b''.join(struct.pack('<I', string_offset) for string_offset in string_offsets)
+    ids += b''.join(struct.pack('<I', index) for index in range(count))
+    ids += b''.join(struct.pack('<HHI', index, 0, 0) for index in range(count) for _ in range(FIELDS_PER_CLASS))
+    ids += b''.join(struct.pack('<HHI', index, 0, 0) for index in range(count) for _ in range(METHODS_PER_CLASS))
+    ids += b''.join(struct.pack('<8I', index, 1, 0, 0, 0, 0, class_data_offsets[index], 0) for index in range(count))
+    return bytes(header) + bytes(ids) + bytes(data)
+
+
+def generate_resource_table(names: dict[str, list[str]], package: str = 'com.example.benchmark') -> bytes:
+    # One default configuration per type, drawables also get an xhdpi one
+    types = list(names)
+    keys = [key for type_name in types for key in names[type_name]]
+    key_indices = {key: index for index, key in enumerate(keys)}
+    type_pool, key_pool = _string_pool(types), _string_pool(keys)
+    chunks = []
+    for type_index, type_name in enumerate(types, start=1):
+        configs = [0, 320] if type_name == 'drawable' else [0]
+        for density in configs:
+            config = bytearray(64)
+            struct.pack_into('<I', config, 0, 64)
+            struct.pack_into('<H', config, 14, density)
+            offsets = bytearray()
+            entries = bytearray()
+            for entry, key in enumerate(names[type_name]):
+                offsets += struct.pack('<I', len(entries))
+                entries += struct.pack('<HHI', 8, 0, key_indices[key]) + struct.pack('<HBBI', 8, 0, 0x10, entry)
+            header_size = 20 + len(config)
+            body = bytes(offsets) + bytes(entries)
+            chunks.append(struct.pack('<HHIBBHII', 0x0201, header_size, header_size + len(body), type_index, 0, 0,
+                                      len(names[type_name]), header_size + len(offsets)) + bytes(config) + body)
+    header_size = 288
+    package_body = type_pool + key_pool + b''.join(chunks)
+    package_chunk = (struct.pack('<HHII', 0x0200, header_size, header_size + len(package_body), 0x7f) +
+                     package.encode('utf-16-le').ljust(256, b'\0') +
+                     struct.pack('<IIIII', header_size, len(types), header_size + len(type_pool), len(keys), 0) +
+                     package_body)
+    body = _string_pool(['res/values/strings.xml']) + package_chunk
+    return struct.pack('<HHII', 0x0002, 12, 12 + len(body), 1) + body
+
+
+def generate_elf(symbols: dict[str, int], data_size: int) -> bytes:
+    # 64-bit little endian shared object with .text, .data and a symbol table,
+    # symbols are functions laid out one after another in .text
+    text = b''.join(bytes([index % 251]) * size for index, size in enumerate(symbols.values()))
+    data = bytes(data_size)
+    names = bytearray(b'\0')
+    symbol_entries = bytearray(24)
+    address = 0
+    for name, size in symbols.items():
+        symbol_entries += struct.pack('<IBBHQQ', len(names), 0x12, 0, 1, address, size)
+        names += name.encode() + b'\0'
+        address += size
+    section_names = b'\0.text\0.data\0.symtab\0.strtab\0.shstrtab\0'
+    sections = [(b'.text', 1, text, 0, 0), (b'.data', 1, data, 0, 0), (b'.symtab', 2, bytes(symbol_entries), 4, 24),
+                (b'.strtab', 3, bytes(names), 0, 0), (b'.shstrtab', 3, section_names, 0, 0)]
+    body = bytearray()
+    headers = bytearray(64)
+    for name, section_type, content, link, entry_size in sections:
+        offset = 64 + len(body)
+        body += content
+        headers += struct.pack('<IIQQQQIIQQ', section_names.index(name + b'\0'), section_type, 0, 0, offset,
+                               len(content), link, 0, 1, entry_size)
+    elf_header = (b'\x7fELF' + bytes([2, 1, 1]) + bytes(9) +
+                  struct.pack('<HHIQQQIHHHHHH', 3, 183, 1, 0, 0, 64 + len(body), 0, 64, 56, 0, 64,
+                              len(sections) + 1, len(sections)))
+    return elf_header + bytes(body) + bytes(headers)
+
+
+def _changed(rng: random.Random, revision: int) -> bool:
+    # Draws in every revision, so unchanged files get the same content
+    return rng.random() < CHANGED_SHARE and revision > 0
+
+
+def generate_apk(path: str, spec: ApkSpec, revision: int = 0):
+    rng = random.Random(spec.seed)
+    changes = random.Random(spec.seed + revision)
+    classes = spec.classes + revision * spec.classes // 10
+    components = spec.components + revision * spec.components // 10
+    resources = spec.resources + revision * spec.resources // 10
+    manifest = generate_manifest(components).replace(
+        'android:versionCode="1"', 'android:versionCode="{}"'.format(revision + 1))
+    descriptors = ['Lcom/example/p{}/C{};'.format(index % PACKAGES, index) for index in range(classes)]
+    per_resource_type = [['{}_{}'.format(type_name, index) for index in range(type_index, resources, 3)]
+                         for type_index, type_name in enumerate(RESOURCE_TYPES)]
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('AndroidManifest.xml', encode_binary_xml(manifest), zipfile.ZIP_DEFLATED)
+        for dex in range(spec.dex_files):
+            name = 'classes{}.dex'.format(dex + 1 if dex else '')
+            archive.writestr(name, generate_dex(descriptors[dex::spec.dex_files]), zipfile.ZIP_DEFLATED)
+        archive.writestr('resources.arsc', generate_resource_table(dict(zip(RESOURCE_TYPES, per_resource_type))),
+                         zipfile.ZIP_STORED)
+        for abi in ABIS:
+            for library in range(spec.libraries):
+                symbols = {'Java_com_example_Native_f{}'.format(index): 64 + (index * 37) % 512
+                           for index in range(200 + revision * 20 * (library == 0))}
+                archive.writestr('lib/{}/libnative{}.so'.format(abi, library),
+                                 generate_elf(symbols, 4096 * (library + 1)), zipfile.ZIP_STORED)
+        for name in per_resource_type[0][:spec.entries // 2]:
+            # Images are incompressible and stored like aapt does
+            data = rng.randbytes(256 + rng.randrange(4096))
+            if _changed(rng, revision):
+                data = changes.randbytes(len(data) + 128)
+            archive.writestr('res/drawable-xhdpi/{}.png'.format(name), data, zipfile.ZIP_STORED)
+        for name in per_resource_type[1][:spec.entries // 4]:
+            layout = '<LinearLayout xmlns:android="{}" android:id="{}"><TextView android:text="{}"/></LinearLayout>'
+            text = 'changed' if _changed(rng, revision) else name
+            archive.writestr('res/layout/{}.xml'.format(name),
+                             encode_binary_xml(layout.format(ANDROID_NAMESPACE, name, text)), zipfile.ZIP_DEFLATED)
+        for index in range(spec.entries // 4):
+            data = ('asset {} '.format(index) * (64 + rng.randrange(256))).encode()
+            if _changed(rng, revision):
+                data += changes.randbytes(512)
+            archive.writestr('assets/data/{}.txt'.format(index), data,
+                             zipfile.ZIP_DEFLATED if index % 2 else zipfile.ZIP_STORED)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a pair of synthetic apks')
+    parser.add_argument('prev', help='Output path of the previous apk')
+    parser.add_argument('curr', help='Output path of the current apk')
+    for field in ApkSpec._fields:
+        parser.add_argument('--' + field.replace('_', '-'), type=int, dest=field,
+                            default=ApkSpec._field_defaults[field])
+    args = parser.parse_args()
+    spec = ApkSpec(**{field: getattr(args, field) for field in ApkSpec._fields})
+    generate_apk(args.prev, spec, revision=0)
+    generate_apk(args.curr, spec, revision=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import io
+import zipfile
+
+import pytest
+
+from apkcomparator.android_manifest_comparator import ANDROID_NAMESPACE
+from apkcomparator.apk_reader import open_archive
+from apkcomparator.cache import configure_cache
+from benchmarks.synthetic_apk import ApkSpec, encode_binary_xml, generate_apk
+
+# Small enough to be generated in a fraction of a second
+SPEC = ApkSpec(entries=20, classes=50, components=5, resources=30, libraries=1)
+
+MANIFEST = ('<manifest xmlns:android="{}" package="com.example" android:versionCode="1">'
+            '<application android:label="app"/></manifest>').format(ANDROID_NAMESPACE)
+
+
+@pytest.fixture(autouse=True)
+def cache_directory(tmp_path):
+    # Analyses are never stored in the cache of the checkout
+    directory = tmp_path / 'cache'
+    directory.mkdir()
+    configure_cache(str(directory))
+    yield str(directory)
+    configure_cache()
+
+
+def write_apk(path: str, entries: dict[str, bytes], manifest: str = MANIFEST):
+    with zipfile.ZipFile(path, 'w') as apk:
+        apk.writestr('AndroidManifest.xml', encode_binary_xml(manifest), zipfile.ZIP_DEFLATED)
+        for name, data in entries.items():
+            apk.writestr(name, data, zipfile.ZIP_DEFLATED)
+
+
+def corrupt_entry(path: str, name: str):
+    # The deflate stream of the entry is overwritten, the zip directory stays valid
+    with open_archive(path) as archive:
+        entry = archive.entries[name]
+        offset = archive.data_offset(entry)
+    with open(path, 'r+b') as apk:
+        apk.seek(offset)
+        apk.write(b'\xff' * entry.compressed_size)
+
+
+@pytest.fixture(scope='session')
+def apk_pair(tmp_path_factory) -> tuple[str, str]:
+    directory = tmp_path_factory.mktemp('apks')
+    paths = str(directory / 'prev.apk'), str(directory / 'curr.apk')
+    for revision, path in enumerate(paths):
+        generate_apk(path, SPEC, revision)
+    return paths
+
+
+@pytest.fixture
+def prev_archive(apk_pair):
+    with open_archive(apk_pair[0]) as archive:
+        yield archive
+
+
+@pytest.fixture
+def curr_archive(apk_pair):
+    with open_archive(apk_pair[1]) as archive:
+        yield archive
+
+
+def _split_key(name: str) -> str:
+    if name.startswith('lib/'):
+        return name.split('/')[1].replace('-', '_')
+    return 'xhdpi' if name.startswith('res/drawable-xhdpi/') else 'master'
+
+
+def write_apk_set(apk: str, path: str, languages: list[str]):
+    # Splits like bundletool makes them: by ABI, density and language
+    with zipfile.ZipFile(apk) as source, zipfile.ZipFile(path, 'w') as apk_set:
+        apk_set.writestr('toc.pb', b'\0' * 10)
+        splits = {}
+        for info in source.infolist():
+            splits.setdefault(_split_key(info.filename), []).append(info)
+        for key, infos in splits.items():
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, 'w') as split:
+                for info in infos:
+                    split.writestr(info.filename, source.read(info), info.compress_type)
+            apk_set.writestr('splits/base-{}.apk'.format(key), buffer.getvalue(), zipfile.ZIP_STORED)
+        for language in languages:
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, 'w') as split:
+                split.writestr('resources.arsc', (language * 1000).encode())
+            apk_set.writestr('splits/base-{}.apk'.format(language), buffer.getvalue(), zipfile.ZIP_STORED)
+
+
+def write_bundle(apk: str, path: str):
+    with zipfile.ZipFile(apk) as source, zipfile.ZipFile(path, 'w') as bundle:
+        bundle.writestr('BundleConfig.pb', b'\0')
+        for info in source.infolist():
+            bundle.writestr('base/' + info.filename, source.read(info), info.compress_type)
+        bundle.writestr('feature/dex/classes.dex', b'dex' * 100)
+        bundle.writestr('feature/res/values-fr/strings.xml', b'fr' * 100)
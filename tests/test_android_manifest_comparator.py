@@ -0,0 +1,70 @@
+import pytest
+
+from apkcomparator.android_manifest_comparator import (
+    ANDROID_NAMESPACE, TAG_USES_PERMISSION, TAG_USES_SDK, diff_manifests, parse_manifest)
+
+
+def _manifest(body: str, version: str = '1', prefix: str = 'android') -> str:
+    return ('<manifest xmlns:{0}="{1}" package="com.example" {0}:versionCode="{2}">{3}</manifest>'.format(
+        prefix, ANDROID_NAMESPACE, version, body.replace('android:', prefix + ':')))
+
+
+PREV = _manifest(
+    '<uses-permission android:name="android.permission.INTERNET"/>'
+    '<uses-sdk android:minSdkVersion="21"/>'
+    '<application><activity android:name=".Main"><intent-filter><action android:name="MAIN"/></intent-filter>'
+    '</activity><service android:name=".Sync"/></application>')
+
+
+def test_parse_manifest():
+    manifest = parse_manifest(PREV)
+    assert (manifest.package, manifest.version_code, manifest.version_name) == ('com.example', '1', None)
+    assert manifest.uses_permissions == {'android.permission.INTERNET'}
+    assert manifest.application.activities == {'.Main'}
+    assert manifest.application.services == {'.Sync'}
+    assert manifest.uses_sdk is not None
+
+
+def test_parse_manifest_with_another_prefix():
+    manifest = parse_manifest(_manifest('<application><service a:name=".Sync"/></application>', prefix='a'))
+    assert manifest.version_code == '1'
+    assert manifest.application.services == {'.Sync'}
+
+
+def test_only_the_first_application_is_read():
+    manifest = parse_manifest(_manifest('<application><service android:name=".A"/></application>'
+                                        '<application><service android:name=".B"/></application>'))
+    assert manifest.application.services == {'.A'}
+
+
+@pytest.mark.parametrize('text', ['<manifest', '<application/>', '<manifest><application/></manifest>',
+                                  _manifest('<uses-sdk/>')])
+def test_parse_malformed_manifest(text):
+    with pytest.raises(RuntimeError):
+        parse_manifest(text)
+
+
+def test_diff_manifests():
+    curr = parse_manifest(_manifest(
+        '<uses-permission android:name="android.permission.CAMERA"/>'
+        '<application><activity android:name=".Main"/><service android:name=".Sync"/>'
+        '<receiver android:name=".Boot"/></application>', version='2'))
+    section = diff_manifests(parse_manifest(PREV), curr)
+    assert section.error is None
+    differences = {difference.description: difference for difference in section.differences}
+    assert differences.keys() == {'versionCode', TAG_USES_PERMISSION, 'broadcast receivers'}
+    assert (differences['versionCode'].was, differences['versionCode'].now) == ('1', '2')
+    assert differences[TAG_USES_PERMISSION].added == ['android.permission.CAMERA']
+    assert differences[TAG_USES_PERMISSION].removed == ['android.permission.INTERNET']
+    assert differences['broadcast receivers'].added == ['.Boot']
+    assert TAG_USES_SDK in section.manual_checks
+
+
+def test_diff_same_manifest():
+    section = diff_manifests(parse_manifest(PREV), parse_manifest(PREV))
+    assert section.differences == []
+
+
+def test_diff_missing_manifests():
+    assert diff_manifests(None, None).error == 'Cannot get manifests'
+    assert diff_manifests(parse_manifest(PREV), None).error == 'Cannot get current version\'s manifest'
@@ -0,0 +1,54 @@
+import pytest
+
+from apkcomparator.android_manifest_comparator import ANDROID_NAMESPACE
+from apkcomparator.apk_comparator import (
+    ANALYSIS_MANIFEST, generate_report, get_manifest, get_native_libraries_diff, get_resources_diff, submit_analysis)
+from apkcomparator.data import Apk, ManifestSection
+from benchmarks.synthetic_apk import generate_elf, generate_resource_table
+from tests.conftest import corrupt_entry, write_apk
+from utils.concurrency import create_executor
+
+
+@pytest.mark.parametrize('manifest', [
+    '<manifest xmlns:android="{}" package="com.example"><uses-sdk/></manifest>'.format(ANDROID_NAMESPACE),
+    '<application/>',
+])
+def test_malformed_manifest_fails_the_manifest_section(tmp_path, manifest):
+    prev, curr = str(tmp_path / 'prev.apk'), str(tmp_path / 'curr.apk')
+    write_apk(prev, {})
+    write_apk(curr, {}, manifest)
+    with create_executor('test') as executor:
+        analysis = submit_analysis(Apk(curr), executor, (ANALYSIS_MANIFEST,))()
+    assert analysis.manifest is not None
+    assert analysis.parsed_manifest is None
+    sections = list(generate_report(Apk(prev), Apk(curr), ['manifest']).iter_sections())
+    assert isinstance(sections[0], ManifestSection)
+    assert sections[0].error == 'Cannot get current version\'s manifest'
+
+
+def test_get_manifest(tmp_path):
+    path = str(tmp_path / 'app.apk')
+    write_apk(path, {})
+    assert 'package="com.example"' in get_manifest(Apk(path))
+    corrupt_entry(path, 'AndroidManifest.xml')
+    assert get_manifest(Apk(path)) is None
+
+
+def test_corrupt_resource_table_fails_the_resources_section(tmp_path, apk_pair):
+    path = str(tmp_path / 'app.apk')
+    write_apk(path, {'resources.arsc': generate_resource_table({'string': ['app_name']})})
+    corrupt_entry(path, 'resources.arsc')
+    section = get_resources_diff(Apk(apk_pair[0]), Apk(path))
+    assert section.error == 'Cannot compare resource tables'
+
+
+def test_corrupt_native_library_keeps_its_file_size(tmp_path):
+    prev, curr = str(tmp_path / 'prev.apk'), str(tmp_path / 'curr.apk')
+    write_apk(prev, {'lib/x86/libfoo.so': generate_elf({'foo': 100}, 10)})
+    write_apk(curr, {'lib/x86/libfoo.so': generate_elf({'foo': 200}, 10)})
+    corrupt_entry(curr, 'lib/x86/libfoo.so')
+    section = get_native_libraries_diff(Apk(prev), Apk(curr))
+    assert section.error is None
+    assert [library.path for library in section.libraries] == ['lib/x86/libfoo.so']
+    assert section.libraries[0].size_now > section.libraries[0].size_was
+    assert section.libraries[0].symbols == []
@@ -0,0 +1,63 @@
+import io
+import zipfile
+import zlib
+
+import pytest
+
+from apkcomparator.apk_reader import COMPRESSION_DEFLATED, COMPRESSION_STORED, ZipArchive, open_archive
+from utils.exceptions import BadApkError
+
+
+def test_entries_match_zipfile(apk_pair, prev_archive):
+    with zipfile.ZipFile(apk_pair[0]) as archive:
+        expected = {info.filename: info for info in archive.infolist()}
+    assert prev_archive.entries.keys() == expected.keys()
+    for name, entry in prev_archive.entries.items():
+        assert entry.crc == expected[name].CRC
+        assert entry.compressed_size == expected[name].compress_size
+        assert entry.uncompressed_size == expected[name].file_size
+
+
+def test_read_inflates_and_checks_out(apk_pair, prev_archive):
+    with zipfile.ZipFile(apk_pair[0]) as archive:
+        for name, entry in prev_archive.entries.items():
+            data = prev_archive.read(entry)
+            assert data == archive.read(name)
+            assert zlib.crc32(data) == entry.crc
+    compressions = {entry.compression for entry in prev_archive.entries.values()}
+    assert compressions == {COMPRESSION_STORED, COMPRESSION_DEFLATED}
+
+
+def test_read_limit(prev_archive):
+    entry = prev_archive.entries['AndroidManifest.xml']
+    assert entry.compression == COMPRESSION_DEFLATED
+    assert prev_archive.read(entry, 10) == prev_archive.read(entry)[:10]
+
+
+def test_open_nested():
+    inner = io.BytesIO()
+    with zipfile.ZipFile(inner, 'w') as archive:
+        archive.writestr('a.txt', b'nested' * 100, zipfile.ZIP_DEFLATED)
+    outer = io.BytesIO()
+    with zipfile.ZipFile(outer, 'w') as archive:
+        archive.writestr('inner.apk', inner.getvalue(), zipfile.ZIP_STORED)
+    archive = ZipArchive(outer.getvalue(), 'outer.zip')
+    nested = archive.open_nested(archive.entries['inner.apk'])
+    assert nested.size == len(inner.getvalue())
+    assert nested.read(nested.entries['a.txt']) == b'nested' * 100
+
+
+def test_not_a_zip(tmp_path):
+    path = tmp_path / 'bad.apk'
+    path.write_bytes(b'not a zip archive')
+    with pytest.raises(BadApkError):
+        with open_archive(str(path)):
+            pass
+
+
+def test_empty_file(tmp_path):
+    path = tmp_path / 'empty.apk'
+    path.write_bytes(b'')
+    with pytest.raises(BadApkError):
+        with open_archive(str(path)):
+            pass
@@ -0,0 +1,45 @@
+import sys
+import time
+
+import pytest
+
+from apkcomparator.apkanalyzer_daemon import ApkAnalyzerWorker
+from utils.exceptions import WorkerTimeoutError
+
+# Speaks the daemon protocol: answers pings, requests with a "sleep" argument never return
+FAKE_WORKER = '''
+import struct, sys, time
+stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+while True:
+    header = stdin.read(4)
+    if len(header) < 4:
+        break
+    arguments = [stdin.read(struct.unpack('>i', stdin.read(4))[0]) for _ in range(struct.unpack('>i', header)[0])]
+    if b'sleep' in arguments:
+        time.sleep(60)
+    output = b' '.join(arguments)
+    stdout.write(struct.pack('>ii', 0, len(output)) + output + struct.pack('>i', 0))
+    stdout.flush()
+'''
+
+
+@pytest.fixture
+def worker():
+    worker = ApkAnalyzerWorker([sys.executable, '-c', FAKE_WORKER])
+    yield worker
+    worker.stop()
+
+
+def test_call(worker):
+    assert worker.call(['apk', 'summary']) == (0, b'apk summary', b'')
+
+
+def test_timed_out_call_kills_the_worker(worker):
+    worker.call(['apk', 'summary'])
+    started = time.monotonic()
+    with pytest.raises(WorkerTimeoutError):
+        worker.call(['sleep'], timeout=0.5)
+    assert time.monotonic() - started < 10
+    assert not worker.alive()
+    # The next call starts a new worker
+    assert worker.call(['apk', 'summary'], timeout=10) == (0, b'apk summary', b'')
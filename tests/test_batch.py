@@ -0,0 +1,56 @@
+import json
+import os.path
+
+import pytest
+
+from apkcomparator.batch import INDEX_HEADER, _make_pair, _unique_names, read_pairs_file, run_batch
+from apkcomparator.budget import configure_budget
+from apkcomparator.report_renderers import FORMAT_JSON
+
+
+@pytest.mark.parametrize('names, unique', [
+    (['a', 'b'], ['a', 'b']),
+    (['a', 'a', 'a'], ['a', 'a-2', 'a-3']),
+    (['a', 'a', 'a-2'], ['a', 'a-3', 'a-2']),
+    (['a', 'a-2', 'a'], ['a', 'a-2', 'a-3']),
+    (['a-2', 'a', 'a', 'a-2'], ['a-2', 'a', 'a-3', 'a-2-2']),
+])
+def test_unique_names(names, unique):
+    pairs = [_make_pair('prev.apk', 'curr.apk', name) for name in names]
+    assert [pair.name for pair in _unique_names(pairs)] == unique
+
+
+def test_read_pairs_file(tmp_path):
+    path = tmp_path / 'pairs.txt'
+    path.write_text('# builds\nold.apk new.apk\n"old one.apk" new.apk release\n')
+    pairs = read_pairs_file(str(path))
+    assert [pair.name for pair in pairs] == ['old-vs-new', 'release']
+    assert pairs[1].prev.apk_path == os.path.abspath('old one.apk')
+    path.write_text('old.apk\n')
+    with pytest.raises(RuntimeError):
+        read_pairs_file(str(path))
+
+
+def test_run_batch(tmp_path, apk_pair):
+    pairs = [_make_pair(*apk_pair), _make_pair(*apk_pair)]
+    index_file = run_batch(pairs, str(tmp_path / 'out'), [FORMAT_JSON])
+    with open(index_file) as stream:
+        rows = [line.rstrip('\n').split('\t') for line in stream]
+    assert rows[0] == list(INDEX_HEADER)
+    assert [row[0] for row in rows[1:]] == ['prev-vs-curr', 'prev-vs-curr-2']
+    file_size_diff = os.path.getsize(apk_pair[1]) - os.path.getsize(apk_pair[0])
+    assert all(int(row[INDEX_HEADER.index('file_size_diff')]) == file_size_diff for row in rows[1:])
+    for row in rows[1:]:
+        with open(tmp_path / 'out' / row[-1]) as stream:
+            assert json.load(stream)['plain_data']['diff']['file_size'] == file_size_diff
+
+
+def test_run_batch_rejects_a_budget(tmp_path, apk_pair):
+    path = tmp_path / 'budget.json'
+    path.write_text(json.dumps({'rules': [{'name': 'size', 'metric': 'file_size', 'max_diff': 0}]}))
+    configure_budget(str(path))
+    try:
+        with pytest.raises(ValueError):
+            run_batch([_make_pair(*apk_pair)], str(tmp_path / 'out'))
+    finally:
+        configure_budget(None)
@@ -0,0 +1,39 @@
+import xml.etree.ElementTree as ElementTree
+
+import pytest
+
+from apkcomparator.android_manifest_comparator import ANDROID_NAMESPACE
+from apkcomparator.binary_xml import decode_xml
+from benchmarks.synthetic_apk import encode_binary_xml
+from utils.exceptions import BadApkError
+
+MANIFEST = ('<manifest xmlns:android="{}" package="com.example" android:versionCode="5">'
+            '<application android:enabled="true"><activity android:name=".Main"/></application>'
+            '</manifest>').format(ANDROID_NAMESPACE)
+
+
+def test_decode_round_trip():
+    root = ElementTree.fromstring(decode_xml(encode_binary_xml(MANIFEST)))
+    android = '{{{}}}'.format(ANDROID_NAMESPACE)
+    assert root.tag == 'manifest'
+    assert root.get('package') == 'com.example'
+    assert root.get(android + 'versionCode') == '5'
+    application = root.find('application')
+    assert application.get(android + 'enabled') == 'true'
+    assert application.find('activity').get(android + 'name') == '.Main'
+
+
+def test_decode_manifest_of_apk(prev_archive):
+    manifest = decode_xml(prev_archive.read(prev_archive.entries['AndroidManifest.xml']))
+    assert ElementTree.fromstring(manifest).get('package') == 'com.example.benchmark'
+
+
+@pytest.mark.parametrize('length', [4, 40, 200])
+def test_truncated_xml(length):
+    with pytest.raises(BadApkError):
+        decode_xml(encode_binary_xml(MANIFEST)[:length])
+
+
+def test_not_binary_xml():
+    with pytest.raises(BadApkError):
+        decode_xml(MANIFEST.encode())
@@ -0,0 +1,133 @@
+import json
+
+import pytest
+
+from apkcomparator.apk_compare_result_processor import ReportLine
+from apkcomparator.apk_comparator import check_bundle_sections
+from apkcomparator.budget import (
+    SEVERITY_ERROR, SEVERITY_WARNING, GlobIndex, budget_passed, configure_budget, evaluate_budget, load_budget)
+from apkcomparator.categories import CategoryIndex
+from apkcomparator.data import Apk, ApkPlainData, BudgetViolation
+
+GLOBS = ['lib/**/*.so', '*.png', 'res/raw/*', 'assets/**', 'classes?.dex', 'META-INF/CERT.RSA']
+
+
+@pytest.mark.parametrize('path, matches', [
+    ('lib/arm64-v8a/libfoo.so', {0}),
+    ('lib/libfoo.so', {0}),
+    ('lib/arm64-v8a/libfoo.so.1', set()),
+    ('icon.png', {1}),
+    ('res/drawable-xhdpi/icon.png', {1}),
+    ('res/raw/data.bin', {2}),
+    ('res/raw/nested/data.bin', set()),
+    ('assets/a/b/c.txt', {3}),
+    ('classes2.dex', {4}),
+    ('classes.dex', set()),
+    ('META-INF/CERT.RSA', {5}),
+    ('META-INF/CERT.SF', set()),
+])
+def test_glob_index(path, matches):
+    assert GlobIndex(GLOBS).match(path) == matches
+
+
+def test_glob_index_shares_segments():
+    index = GlobIndex(['res/**/*.png', 'res/**', '**/*.png'])
+    assert index.match('res/drawable/icon.png') == {0, 1, 2}
+    assert index.match('assets/icon.png') == {2}
+
+
+def _write_budget(tmp_path, rules: list[dict], fail_fast: bool = False) -> str:
+    path = tmp_path / 'budget.json'
+    path.write_text(json.dumps({'rules': rules, 'fail_fast': fail_fast}))
+    return str(path)
+
+
+def test_load_budget_rejects_unknown_metric(tmp_path):
+    with pytest.raises(RuntimeError):
+        load_budget(_write_budget(tmp_path, [{'metric': 'apk_size', 'max': 1}]), index=CategoryIndex())
+
+
+def test_check_plain_data(tmp_path):
+    budget = load_budget(_write_budget(tmp_path, [
+        {'name': 'download', 'metric': 'download_size', 'max_diff': 100},
+        {'name': 'methods', 'metric': 'methods_count', 'max': 1000, 'severity': SEVERITY_WARNING},
+    ]), index=CategoryIndex())
+    prev = ApkPlainData(download_size=1000, file_size=2000, methods_count=900)
+    curr = ApkPlainData(download_size=1050, file_size=2100, methods_count=1100)
+    violations = budget.check_plain_data(prev, curr, None)
+    assert [(violation.rule, violation.severity) for violation in violations] == [('methods', SEVERITY_WARNING)]
+    assert budget_passed(violations)
+    curr = curr._replace(download_size=1200)
+    assert not budget_passed(budget.check_plain_data(prev, curr, None))
+
+
+def test_check_files(tmp_path):
+    budget = load_budget(_write_budget(tmp_path, [
+        {'name': 'libraries', 'category': 'Libraries', 'max_diff': 1000},
+        {'name': 'so', 'glob': 'lib/**/*.so', 'forbid': ['added']},
+        {'name': 'images', 'glob': '*.png', 'per_entry': True, 'max': 500},
+    ]), index=CategoryIndex())
+    lines = [
+        ReportLine(lhs_size=0, rhs_size=800, diff=800, path='lib/x86/libnew.so', lhs_uncompressed_size=0,
+                   rhs_uncompressed_size=1600),
+        ReportLine(lhs_size=100, rhs_size=400, diff=300, path='lib/x86/libold.so'),
+        ReportLine(lhs_size=100, rhs_size=600, diff=500, path='res/drawable/icon.png'),
+        ReportLine(lhs_size=100, rhs_size=200, diff=100, path='res/drawable/small.png'),
+    ]
+    messages = {violation.rule: violation.message for violation in budget.check_files(lines)}
+    assert messages.keys() == {'libraries', 'so', 'images'}
+    assert messages['so'] == 'lib/x86/libnew.so was added'
+    assert messages['images'].startswith('res/drawable/icon.png is ')
+
+
+def test_evaluate_budget_fail_fast(tmp_path):
+    budget = load_budget(_write_budget(tmp_path, [{'metric': 'file_size', 'max': 1}], fail_fast=True),
+                         index=CategoryIndex())
+    failure = BudgetViolation(rule='file_size', severity=SEVERITY_ERROR, message='file_size is 2 B, limit 1 B')
+    called = []
+
+    def later_stage():
+        called.append(True)
+        return []
+
+    section = evaluate_budget(budget, [('plain data', lambda: [failure]), ('files', later_stage)])
+    assert section.stopped
+    assert section.skipped == ['files']
+    assert section.violations == [failure]
+    assert not called
+
+
+def test_evaluate_budget_runs_every_stage(tmp_path):
+    budget = load_budget(_write_budget(tmp_path, [{'metric': 'file_size', 'max': 1}]), index=CategoryIndex())
+    warning = BudgetViolation(rule='file_size', severity=SEVERITY_WARNING, message='')
+    section = evaluate_budget(budget, [('plain data', lambda: [warning]), ('files', lambda: [])])
+    assert not section.stopped
+    assert section.skipped == []
+    assert budget_passed(section.violations)
+
+
+@pytest.mark.parametrize('rule', [
+    {'glob': '*.so', 'forbid': ['changed']},
+    {'category': 'Libraries', 'forbid': ['changed']},
+    {'metric': 'file_size', 'forbid': ['added']},
+    {'category': 'Libraries', 'forbid': ['removed']},
+])
+def test_load_budget_rejects_unchecked_forbid(tmp_path, rule):
+    with pytest.raises(RuntimeError):
+        load_budget(_write_budget(tmp_path, [rule]), index=CategoryIndex())
+
+
+def test_load_budget_accepts_forbid_changed_for_manifest(tmp_path):
+    budget = load_budget(_write_budget(tmp_path, [{'manifest': 'versionCode', 'forbid': ['changed']}]),
+                         index=CategoryIndex())
+    assert budget.needs_manifest()
+
+
+def test_budget_with_bundles_is_a_usage_error(tmp_path):
+    configure_budget(_write_budget(tmp_path, [{'metric': 'file_size', 'max_diff': 0}]))
+    try:
+        with pytest.raises(ValueError):
+            check_bundle_sections(Apk('prev.aab'), Apk('curr.aab'), None)
+        check_bundle_sections(Apk('prev.apk'), Apk('curr.apk'), None)
+    finally:
+        configure_budget(None)
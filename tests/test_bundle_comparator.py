@@ -0,0 +1,111 @@
+import pytest
+
+from apkcomparator.apk_reader import open_archive
+from apkcomparator.bundle_comparator import (
+    DIMENSION_ABI, DIMENSION_DENSITY, DIMENSION_LANGUAGE, DIMENSION_OTHER, _entry_dimension, _suffix_dimension,
+    diff_bundles, is_bundle, iter_bundle_section, read_splits)
+from apkcomparator.download_size import estimate_entry
+from tests.conftest import write_apk_set, write_bundle
+
+
+@pytest.fixture(scope='module')
+def apk_sets(apk_pair, tmp_path_factory) -> tuple[str, str]:
+    directory = tmp_path_factory.mktemp('apk_sets')
+    paths = str(directory / 'prev.apks'), str(directory / 'curr.apks')
+    write_apk_set(apk_pair[0], paths[0], ['en', 'fr'])
+    write_apk_set(apk_pair[1], paths[1], ['en', 'fr', 'de'])
+    return paths
+
+
+@pytest.fixture(scope='module')
+def bundles(apk_pair, tmp_path_factory) -> tuple[str, str]:
+    directory = tmp_path_factory.mktemp('bundles')
+    paths = str(directory / 'prev.aab'), str(directory / 'curr.aab')
+    for apk, path in zip(apk_pair, paths):
+        write_bundle(apk, path)
+    return paths
+
+
+@pytest.mark.parametrize('suffix, dimension', [
+    ('arm64_v8a', (DIMENSION_ABI, 'arm64-v8a')), ('xxhdpi', (DIMENSION_DENSITY, 'xxhdpi')),
+    ('fr', (DIMENSION_LANGUAGE, 'fr')), ('fil', (DIMENSION_LANGUAGE, 'fil')), ('car', (DIMENSION_OTHER, 'car')),
+    ('tv', (DIMENSION_OTHER, 'tv')), ('master', (None, None))])
+def test_suffix_dimension(suffix, dimension):
+    assert _suffix_dimension(suffix) == dimension
+
+
+@pytest.mark.parametrize('path, dimension', [
+    ('lib/x86/libfoo.so', (DIMENSION_ABI, 'x86')), ('res/drawable-xhdpi/a.png', (DIMENSION_DENSITY, 'xhdpi')),
+    ('res/values-fr/strings.xml', (DIMENSION_LANGUAGE, 'fr')),
+    ('res/values-b+sr+Latn/strings.xml', (DIMENSION_LANGUAGE, 'sr')),
+    ('res/values-mcc310-mnc004-en/strings.xml', (DIMENSION_LANGUAGE, 'en')),
+    ('res/drawable-car-hdpi/a.png', (DIMENSION_DENSITY, 'hdpi')), ('res/layout/main.xml', (None, None)),
+    ('classes.dex', (None, None))])
+def test_entry_dimension(path, dimension):
+    assert _entry_dimension(path) == dimension
+
+
+def test_is_bundle():
+    assert is_bundle('app.aab') and is_bundle('app.apks')
+    assert not is_bundle('app.apk')
+
+
+def test_read_apk_set_splits(apk_sets):
+    with open_archive(apk_sets[0]) as archive:
+        splits = {split.name: split for split in read_splits(archive)}
+    assert splits.keys() == {'base-master', 'base-arm64_v8a', 'base-armeabi_v7a', 'base-xhdpi', 'base-en', 'base-fr'}
+    assert splits['base-arm64_v8a'].dimension == DIMENSION_ABI
+    assert list(splits['base-arm64_v8a'].entries) == ['lib/arm64-v8a/libnative0.so']
+
+
+def test_read_bundle_splits(bundles):
+    with open_archive(bundles[0]) as archive:
+        splits = {split.name: split for split in read_splits(archive)}
+    assert splits.keys() == {'base-master', 'base-arm64_v8a', 'base-armeabi_v7a', 'base-xhdpi', 'feature-master',
+                             'feature-fr'}
+    entries = splits['feature-fr'].entries.values()
+    assert splits['feature-fr'].file_size == sum(entry.compressed_size for entry in entries)
+
+
+def test_diff_apk_sets(apk_sets):
+    with open_archive(apk_sets[0]) as prev, open_archive(apk_sets[1]) as curr:
+        section = diff_bundles(prev, curr)
+    assert section.error is None
+    splits = {split.name: split for split in section.splits}
+    assert splits['base-de'].file_size_was == 0 and splits['base-de'].file_size_now > 0
+    assert splits['base-en'].changed_entries == 0
+    assert splits['base-en'].download_size_diff == 0
+    assert splits['base-master'].changed_entries > 0
+    configs = {(config.abi, config.density, config.language): config for config in section.configs}
+    assert configs.keys() == {('arm64-v8a', 'xhdpi', 'en'), ('armeabi-v7a', 'xhdpi', 'en')}
+    config = configs['arm64-v8a', 'xhdpi', 'en']
+    installed = ('base-master', 'base-arm64_v8a', 'base-xhdpi', 'base-en')
+    assert config.file_size_now == sum(splits[name].file_size_now for name in installed)
+    assert config.download_size_diff == sum(splits[name].download_size_diff for name in installed)
+    assert any(line.startswith('Device configurations') for line in iter_bundle_section(section))
+
+
+def _full_download_size(splits: dict, name: str) -> int:
+    if name not in splits:
+        return 0
+    split = splits[name]
+    return split.file_size + sum(estimate_entry(split.archive, entry) - entry.compressed_size
+                                 for entry in split.entries.values())
+
+
+def test_download_size_diff_of_changed_entries(apk_sets):
+    # Only the changed entries are compressed again, the diff is the same as with all of them
+    with open_archive(apk_sets[0]) as prev, open_archive(apk_sets[1]) as curr:
+        prev_splits = {split.name: split for split in read_splits(prev)}
+        curr_splits = {split.name: split for split in read_splits(curr)}
+        for split in diff_bundles(prev, curr).splits:
+            assert split.download_size_diff == (_full_download_size(curr_splits, split.name) -
+                                                _full_download_size(prev_splits, split.name))
+
+
+def test_diff_bundles(bundles):
+    with open_archive(bundles[0]) as prev, open_archive(bundles[1]) as curr:
+        section = diff_bundles(prev, curr)
+    splits = {split.name: split for split in section.splits}
+    assert splits['feature-master'].changed_entries == 0
+    assert splits['base-master'].file_size_now > splits['base-master'].file_size_was
@@ -0,0 +1,84 @@
+import os
+import pathlib
+
+import pytest
+
+from apkcomparator.cache import (
+    CACHE_SUFFIX, apk_digest, cache_key, configure_cache, configure_memory_cache, evict, invalidate, load_analysis,
+    memory_cache_size, store_analysis)
+from apkcomparator.data import Apk, ApkAnalysis, ApkPlainData
+
+ANALYSIS = ApkAnalysis(plain_data=ApkPlainData(1, 2, 3), manifest='<manifest/>', parsed_manifest=None)
+
+
+def _files(directory: str) -> list[str]:
+    return sorted(name for name in os.listdir(directory) if name.endswith(CACHE_SUFFIX))
+
+
+@pytest.fixture
+def memory_cache():
+    configure_memory_cache(2)
+    yield
+    configure_memory_cache(0)
+
+
+def test_store_and_load(apk_pair, cache_directory):
+    key = cache_key(Apk(apk_pair[0]), 'native')
+    assert load_analysis(key) is None
+    store_analysis(key, ANALYSIS)
+    assert _files(cache_directory) == [key + CACHE_SUFFIX]
+    assert load_analysis(key) == ANALYSIS
+
+
+def test_digest_follows_the_content(apk_pair, tmp_path):
+    assert apk_digest(Apk(apk_pair[0])) != apk_digest(Apk(apk_pair[1]))
+    copy = tmp_path / 'copy.apk'
+    copy.write_bytes(pathlib.Path(apk_pair[0]).read_bytes())
+    assert apk_digest(Apk(str(copy))) == apk_digest(Apk(apk_pair[0]))
+    assert cache_key(Apk(str(tmp_path / 'missing.apk')), 'native') is None
+
+
+def test_unreadable_entry_is_dropped(apk_pair, cache_directory):
+    key = cache_key(Apk(apk_pair[0]), 'native')
+    store_analysis(key, ANALYSIS)
+    with open(os.path.join(cache_directory, key + CACHE_SUFFIX), 'wb') as stream:
+        stream.write(b'not a pickle')
+    assert load_analysis(key) is None
+    assert _files(cache_directory) == []
+
+
+def test_evict_least_recently_used(cache_directory):
+    for index in range(3):
+        store_analysis('key{}'.format(index), ANALYSIS)
+        os.utime(os.path.join(cache_directory, 'key{}{}'.format(index, CACHE_SUFFIX)), (index, index))
+    load_analysis('key0')
+    size = os.path.getsize(os.path.join(cache_directory, 'key0' + CACHE_SUFFIX))
+    evict(2 * size)
+    assert _files(cache_directory) == ['key0' + CACHE_SUFFIX, 'key2' + CACHE_SUFFIX]
+
+
+def test_invalidate(apk_pair, cache_directory):
+    for path in apk_pair:
+        store_analysis(cache_key(Apk(path), 'native'), ANALYSIS)
+        store_analysis(cache_key(Apk(path), 'apkanalyzer'), ANALYSIS)
+    assert invalidate(Apk(apk_pair[0])) == 2
+    assert all(name.startswith(apk_digest(Apk(apk_pair[1]))) for name in _files(cache_directory))
+    assert invalidate() == 2
+
+
+def test_disabled_cache(apk_pair, cache_directory):
+    configure_cache(cache_directory, enabled=False)
+    assert cache_key(Apk(apk_pair[0]), 'native') is None
+    store_analysis('key', ANALYSIS)
+    assert _files(cache_directory) == []
+
+
+def test_memory_cache(apk_pair, cache_directory, memory_cache):
+    configure_cache(cache_directory, enabled=False)
+    keys = [cache_key(Apk(path), 'native') for path in apk_pair] + ['other']
+    for key in keys:
+        store_analysis(key, ANALYSIS)
+    assert _files(cache_directory) == []
+    assert memory_cache_size() == 2
+    assert load_analysis(keys[0]) is None
+    assert load_analysis(keys[2]) == ANALYSIS
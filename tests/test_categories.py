@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from apkcomparator.apk_compare_result_processor import ReportLine, categorize_compare_result
+from apkcomparator.categories import OTHER_CATEGORY, Category, CategoryIndex, load_categories
+
+
+def _line(path: str, diff: int) -> ReportLine:
+    return ReportLine(lhs_size=0, rhs_size=diff, diff=diff, path=path, lhs_uncompressed_size=0,
+                      rhs_uncompressed_size=diff)
+
+
+@pytest.mark.parametrize('path, matches', [
+    ('classes.dex', {0}), ('lib/x86/libfoo.so', {1}), ('assets/data.bin', {2}), ('res/layout/main.xml', {3}),
+    ('assets/classes.dex', {0, 2}), ('resources.arsc', set()), ('lib', set())])
+def test_match(path, matches):
+    assert CategoryIndex().match(path) == matches
+
+
+def test_bucket_applies_thresholds():
+    index = CategoryIndex([Category('Native', ('lib/',), ('.so',), 100)], other_threshold=10)
+    buckets = index.bucket([_line('lib/x86/libfoo.so', 500), _line('lib/x86/libbar.so', -50),
+                            _line('resources.arsc', 20), _line('AndroidManifest.xml', -5)])
+    assert [[line.path for line in bucket] for bucket in buckets] == [['lib/x86/libfoo.so'], ['resources.arsc']]
+
+
+def test_load_categories(tmp_path):
+    path = tmp_path / 'categories.json'
+    path.write_text(json.dumps({'threshold': 0, 'categories': [
+        {'name': 'arm64', 'prefixes': ['lib/arm64-v8a/'], 'threshold': 10}]}))
+    index = load_categories(str(path))
+    names = [category.name for category in index.categories]
+    assert names == ['Dex files', 'Libraries', 'Assets', 'Resources', 'arm64']
+    assert index.thresholds() == {0, 10}
+    assert index.match('lib/arm64-v8a/libfoo.so') == {1, 4}
+    path.write_text(json.dumps({'replace_defaults': True, 'categories': [{'prefixes': ['lib/']}]}))
+    with pytest.raises(RuntimeError):
+        load_categories(str(path))
+
+
+def test_categorize_compare_result():
+    section = categorize_compare_result([_line('lib/x86/libfoo.so', 2000), _line('lib/x86/libbar.so', 3000),
+                                         _line('resources.arsc', 5000)], CategoryIndex())
+    categories = {category.name: category for category in section.categories}
+    assert [line.path for line in categories['Libraries'].lines] == ['lib/x86/libbar.so', 'lib/x86/libfoo.so']
+    assert categories['Libraries'].total_diff == 5000
+    assert categories[OTHER_CATEGORY].total_diff == 5000
+    assert section.thresholds == [1024]
@@ -0,0 +1,54 @@
+import pytest
+
+from apkcomparator.dex_reader import (
+    count_methods, count_packages, count_references, dex_entry_names, package_of, parse_header)
+from benchmarks.synthetic_apk import FIELDS_PER_CLASS, METHODS_PER_CLASS, generate_dex
+from tests.conftest import SPEC
+from utils.exceptions import BadApkError
+
+
+def test_dex_entry_names_are_in_load_order(prev_archive):
+    assert dex_entry_names(prev_archive) == ['classes.dex', 'classes2.dex']
+
+
+def test_count_methods(prev_archive, curr_archive):
+    assert count_methods(prev_archive) == SPEC.classes * METHODS_PER_CLASS
+    # The current revision adds a tenth of the classes
+    assert count_methods(curr_archive) == SPEC.classes * 11 // 10 * METHODS_PER_CLASS
+
+
+def test_count_references_by_package(prev_archive):
+    references = count_references(prev_archive, by_package=True)
+    assert [counts.name for counts in references.dex_counts] == ['classes.dex', 'classes2.dex']
+    assert references.fields == SPEC.classes * FIELDS_PER_CLASS
+    assert sum(references.packages.values()) == references.methods
+    assert references.packages['com.example.p0'] == METHODS_PER_CLASS
+
+
+def test_count_packages(prev_archive):
+    packages = count_packages(prev_archive)
+    row = packages.names.index('com.example.p0')
+    assert packages.classes[row] == 1
+    assert packages.methods[row] == METHODS_PER_CLASS
+    assert packages.fields[row] == FIELDS_PER_CLASS
+    assert packages.sizes[row] > 0
+    assert sum(packages.methods) == SPEC.classes * METHODS_PER_CLASS
+
+
+def test_parse_header():
+    data = generate_dex(['La/b/C;', 'La/b/D;'])
+    header = parse_header(data, 'classes.dex')
+    assert header.class_defs_size == 2
+    assert header.method_ids_size == 2 * METHODS_PER_CLASS
+
+
+@pytest.mark.parametrize('data', [b'', b'dex\n035\0', b'\0' * 0x70])
+def test_parse_header_rejects_other_files(data):
+    with pytest.raises(BadApkError):
+        parse_header(data, 'classes.dex')
+
+
+@pytest.mark.parametrize('descriptor, package', [
+    ('Lcom/example/Foo;', 'com.example'), ('LFoo;', ''), ('I', ''), ('[Lcom/example/Foo;', '')])
+def test_package_of(descriptor, package):
+    assert package_of(descriptor) == package
@@ -0,0 +1,58 @@
+import zipfile
+import zlib
+
+from apkcomparator.apk_reader import open_archive
+from apkcomparator.categories import CategoryIndex
+from apkcomparator.download_size import (
+    COMPRESSION_LEVEL, diff_download_sizes, estimate_download_size, estimate_entries, estimate_entry)
+
+TEXT = b'compressible text ' * 500
+
+
+def _write(path: str, stored: dict[str, bytes], deflated: dict[str, bytes]):
+    with zipfile.ZipFile(path, 'w') as apk:
+        for name, data in stored.items():
+            apk.writestr(name, data, zipfile.ZIP_STORED)
+        for name, data in deflated.items():
+            apk.writestr(name, data, zipfile.ZIP_DEFLATED)
+
+
+def _deflated_size(data: bytes) -> int:
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return len(compressor.compress(data) + compressor.flush())
+
+
+def test_estimate_entry(tmp_path):
+    path = str(tmp_path / 'app.apk')
+    _write(path, {'res/raw/text.txt': TEXT, 'res/raw/random.bin': bytes(range(256))}, {'classes.dex': TEXT})
+    with open_archive(path) as archive:
+        stored = archive.entries['res/raw/text.txt']
+        assert estimate_entry(archive, stored) == _deflated_size(TEXT)
+        # Incompressible entries are never larger than stored
+        random = archive.entries['res/raw/random.bin']
+        assert estimate_entry(archive, random) == random.compressed_size
+        deflated = archive.entries['classes.dex']
+        assert estimate_entry(archive, deflated) == deflated.compressed_size
+        assert estimate_entries(archive, [stored, None, deflated]) == [
+            _deflated_size(TEXT), 0, deflated.compressed_size]
+        entries = archive.entries.values()
+        assert estimate_download_size(archive) == archive.size - sum(
+            entry.compressed_size - estimate_entry(archive, entry) for entry in entries)
+
+
+def test_diff_download_sizes(tmp_path):
+    prev, curr = str(tmp_path / 'prev.apk'), str(tmp_path / 'curr.apk')
+    _write(prev, {'res/raw/text.txt': TEXT, 'assets/same.txt': TEXT}, {'lib/x86/libfoo.so': b'a' * 100})
+    _write(curr, {'res/raw/text.txt': TEXT * 2, 'assets/same.txt': TEXT}, {'lib/x86/libfoo.so': bytes(range(256))})
+    with open_archive(prev) as lhs, open_archive(curr) as rhs:
+        section = diff_download_sizes(lhs, rhs, CategoryIndex())
+        library = 'lib/x86/libfoo.so'
+        library_diff = rhs.entries[library].compressed_size - lhs.entries[library].compressed_size
+    assert section.error is None
+    entries = {entry.path: entry for entry in section.entries}
+    assert entries.keys() == {'res/raw/text.txt', 'lib/x86/libfoo.so'}
+    assert (entries['res/raw/text.txt'].size_was, entries['res/raw/text.txt'].size_now) == (
+        _deflated_size(TEXT), _deflated_size(TEXT * 2))
+    categories = {category.name: category.diff for category in section.categories}
+    assert categories == {'Libraries': library_diff,
+                          'Resources': _deflated_size(TEXT * 2) - _deflated_size(TEXT)}
@@ -0,0 +1,45 @@
+from apkcomparator.apk_reader import open_archive
+from apkcomparator.duplicates import diff_duplicates, entry_contents, find_duplicates, iter_duplicates_section
+from tests.conftest import write_apk
+
+ICON = b'icon' * 1000
+
+
+def _analyze(path: str, entries: dict[str, bytes]):
+    write_apk(path, entries)
+    with open_archive(path) as archive:
+        return find_duplicates(archive), entry_contents(archive), archive.entries
+
+
+def test_find_duplicates(tmp_path):
+    groups, _, entries = _analyze(str(tmp_path / 'app.apk'), {
+        'res/b.png': ICON, 'res/a.png': ICON, 'assets/a.png': ICON, 'res/c.png': b'other' * 1000, 'empty': b'',
+        'empty2': b''})
+    assert len(groups) == 1
+    assert groups[0].paths == ['assets/a.png', 'res/a.png', 'res/b.png']
+    assert groups[0].size == len(ICON)
+    assert groups[0].wasted == 2 * entries['res/a.png'].compressed_size
+
+
+def test_diff_duplicates(tmp_path):
+    prev_groups, prev_contents, _ = _analyze(str(tmp_path / 'prev.apk'), {
+        'res/a.png': ICON, 'res/b.png': b'other' * 1000})
+    curr_groups, _, _ = _analyze(str(tmp_path / 'curr.apk'), {
+        'res/a.png': ICON, 'res/b.png': b'other' * 1000, 'assets/copy.png': ICON})
+    section = diff_duplicates(prev_groups, curr_groups, prev_contents)
+    assert section.error is None
+    assert (section.wasted_was, section.wasted_now) == (0, curr_groups[0].wasted)
+    assert [(duplicate.path, duplicate.copy_of) for duplicate in section.introduced] == [
+        ('assets/copy.png', 'res/a.png')]
+    assert 'New duplicates:' in list(iter_duplicates_section(section))
+
+
+def test_changed_duplicates_are_not_introduced(tmp_path):
+    # Both copies changed together, neither of them is new
+    prev_groups, prev_contents, _ = _analyze(str(tmp_path / 'prev.apk'), {'res/a.png': ICON, 'res/b.png': ICON})
+    curr_groups, _, _ = _analyze(str(tmp_path / 'curr.apk'), {'res/a.png': ICON * 2, 'res/b.png': ICON * 2})
+    assert diff_duplicates(prev_groups, curr_groups, prev_contents).introduced == []
+
+
+def test_diff_without_duplicates():
+    assert diff_duplicates(None, [], {}).error == 'Cannot find duplicates'
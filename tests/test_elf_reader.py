@@ -0,0 +1,40 @@
+import pytest
+
+from apkcomparator.elf_reader import parse_elf, read_elf
+from benchmarks.synthetic_apk import generate_elf
+from utils.exceptions import BadApkError
+
+SYMBOLS = {'Java_com_example_Native_f0': 64, 'Java_com_example_Native_f1': 128, 'JNI_OnLoad': 32}
+
+
+def test_parse_elf():
+    data = generate_elf(SYMBOLS, 4096)
+    summary = parse_elf(data, 0, len(data), 'libnative.so')
+    assert summary.sections['.text'] == sum(SYMBOLS.values())
+    assert summary.sections['.data'] == 4096
+    assert summary.symbols == {name.encode(): size for name, size in SYMBOLS.items()}
+
+
+def test_parse_elf_at_offset():
+    data = generate_elf(SYMBOLS, 0)
+    padded = b'\0' * 100 + data + b'\0' * 10
+    summary = parse_elf(padded, 100, 100 + len(data), 'libnative.so')
+    assert summary.symbols == parse_elf(data, 0, len(data), 'libnative.so').symbols
+
+
+def test_read_elf_of_apk(prev_archive):
+    summary = read_elf(prev_archive, prev_archive.entries['lib/arm64-v8a/libnative0.so'])
+    assert len(summary.symbols) == 200
+    assert summary.sections['.data'] == 4096
+
+
+def test_not_an_elf_file():
+    data = b'\0' * 64
+    with pytest.raises(BadApkError):
+        parse_elf(data, 0, len(data), 'libnative.so')
+
+
+def test_truncated_section_table():
+    data = generate_elf(SYMBOLS, 0)
+    with pytest.raises(BadApkError):
+        parse_elf(data, 0, len(data) // 2, 'libnative.so')
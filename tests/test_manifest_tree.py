@@ -0,0 +1,59 @@
+from apkcomparator.android_manifest_comparator import ANDROID_NAMESPACE
+from apkcomparator.manifest_tree import (
+    CHANGE_ADDED, CHANGE_CHANGED, CHANGE_REMOVED, diff_manifest_trees, exported_state, parse_manifest_tree)
+
+
+def _manifest(application: str, prefix: str = 'android') -> str:
+    return '<manifest xmlns:{0}="{1}" package="com.example"><application>{2}</application></manifest>'.format(
+        prefix, ANDROID_NAMESPACE, application.replace('android:', prefix + ':'))
+
+
+FILTER = '<intent-filter><action android:name="{}"/></intent-filter>'
+
+
+def test_parse_manifest_tree_normalizes_the_prefix():
+    root = parse_manifest_tree(_manifest('<service a:name=".Sync" a:exported="false"/>', prefix='a'))
+    service = root.children[0].children[0]
+    assert service.attrib == {'android:name': '.Sync', 'android:exported': 'false'}
+    assert service.label() == 'service[.Sync]'
+
+
+def test_same_subtrees_have_the_same_digest():
+    lhs = parse_manifest_tree(_manifest('<service android:name=".A"/>'))
+    rhs = parse_manifest_tree(_manifest('<service android:name=".A"/>', prefix='a'))
+    assert lhs.children[0].digest == rhs.children[0].digest
+
+
+def test_diff_manifest_trees():
+    prev = _manifest('<activity android:name=".Main" android:theme="light">{}{}</activity>'
+                     '<service android:name=".Old"/>'.format(FILTER.format('MAIN'), FILTER.format('VIEW')))
+    curr = _manifest('<activity android:name=".Main" android:theme="dark">{}{}</activity>'
+                     '<service android:name=".New"/>'.format(FILTER.format('VIEW'), FILTER.format('SEND')))
+    section = diff_manifest_trees(prev, curr)
+    assert section.error is None
+    changes = [(change.kind, change.path, change.attribute) for change in section.changes]
+    # The unchanged VIEW filter is paired by digest, the other two by position
+    assert changes == [
+        (CHANGE_ADDED, 'manifest/application/service[.New]', None),
+        (CHANGE_REMOVED, 'manifest/application/service[.Old]', None),
+        (CHANGE_CHANGED, 'manifest/application/activity[.Main]', 'android:theme'),
+        (CHANGE_REMOVED, 'manifest/application/activity[.Main]/intent-filter#2/action[MAIN]', None),
+        (CHANGE_ADDED, 'manifest/application/activity[.Main]/intent-filter#2/action[SEND]', None),
+    ]
+
+
+def test_exported_components():
+    prev = _manifest('<service android:name=".Sync" android:exported="false"/>')
+    curr = _manifest('<service android:name=".Sync" android:exported="true"/>'
+                     '<receiver android:name=".Boot">{}</receiver>'
+                     '<activity android:name=".Hidden"/>'.format(FILTER.format('BOOT')))
+    section = diff_manifest_trees(prev, curr)
+    exported = {change.path: (change.exported_was, change.exported_now) for change in section.exported}
+    assert exported == {'manifest/application/receiver[.Boot]': (None, 'true (implicit)'),
+                        'manifest/application/service[.Sync]': ('false', 'true')}
+    assert exported_state(parse_manifest_tree(curr).children[0].children[2]) == 'false (implicit)'
+
+
+def test_diff_malformed_manifest_trees():
+    assert diff_manifest_trees('<application/>', _manifest('')).error == 'Expected <manifest> as root tag'
+    assert diff_manifest_trees(None, _manifest('')).error is not None
@@ -0,0 +1,47 @@
+import os.path
+import random
+import zlib
+
+from apkcomparator.patch_size import COMPRESSION_LEVEL, WINDOW, estimate_delta, estimate_patch_size
+
+OLD = random.Random(1).randbytes(200000)
+
+
+def _chunks(data: bytes, size: int) -> list[bytes]:
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+def test_delta_without_old_data_is_the_compressed_data():
+    assert estimate_delta(b'', [OLD[:1000], OLD[1000:5000]]) == len(zlib.compress(OLD[:5000], COMPRESSION_LEVEL))
+    assert estimate_delta(b'', []) == 0
+
+
+def test_delta_of_same_data():
+    assert estimate_delta(OLD, [OLD]) < 100
+
+
+def test_delta_of_edited_data():
+    # Random data does not compress, the patch only holds the edits
+    new = OLD[:50000] + b'inserted' * 100 + OLD[50000:120000] + OLD[120500:]
+    for size in (len(new), 4096, 333):
+        assert estimate_delta(OLD, _chunks(new, size)) < 2000
+
+
+def test_delta_of_slightly_changed_bytes():
+    # Sparse byte changes extend a match, their XOR compresses well
+    new = bytearray(OLD)
+    for offset in range(0, len(new), 1000):
+        new[offset] ^= 0xff
+    assert estimate_delta(OLD, [bytes(new)]) < 5000
+
+
+def test_delta_across_windows():
+    old = random.Random(2).randbytes(WINDOW * 2 + 12345)
+    assert estimate_delta(old, _chunks(old, 65536)) < 200
+
+
+def test_estimate_patch_size(prev_archive, curr_archive, apk_pair):
+    assert estimate_patch_size(prev_archive, prev_archive) == len(
+        zlib.compress(prev_archive.central_directory(), COMPRESSION_LEVEL))
+    size = estimate_patch_size(prev_archive, curr_archive)
+    assert 0 < size < os.path.getsize(apk_pair[1])
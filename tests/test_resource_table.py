@@ -0,0 +1,38 @@
+from apkcomparator.resource_table import (
+    APP_PACKAGE_ID, EMPTY_TABLE, diff_resource_tables, format_config, parse_resource_table, read_resource_table)
+from benchmarks.synthetic_apk import generate_resource_table
+
+
+def test_parse_resource_table():
+    data = generate_resource_table({'string': ['app_name', 'title'], 'layout': ['main']})
+    table = parse_resource_table(data, 0, len(data))
+    assert len(table.packages) == 1
+    package = table.packages[0]
+    assert (package.id, package.name) == (APP_PACKAGE_ID, 'com.example.benchmark')
+    names = {type_index.name: package.names(type_index) for type_index in package.types.values()}
+    assert names == {'string': {'app_name', 'title'}, 'layout': {'main'}}
+
+
+def test_diff_resource_tables(prev_archive, curr_archive):
+    section = diff_resource_tables(read_resource_table(prev_archive), read_resource_table(curr_archive))
+    assert section.error is None
+    added = {diff.type: diff.added for diff in section.types}
+    assert added == {'drawable': ['drawable_30'], 'layout': ['layout_31'], 'string': ['string_32']}
+    assert all(not diff.removed for diff in section.types)
+
+
+def test_diff_same_tables(prev_archive):
+    table = read_resource_table(prev_archive)
+    section = diff_resource_tables(table, table)
+    assert section.types == []
+    assert section.string_pools == []
+
+
+def test_diff_with_empty_table(prev_archive):
+    section = diff_resource_tables(EMPTY_TABLE, read_resource_table(prev_archive))
+    assert all(not diff.removed and diff.entries_was == 0 for diff in section.types)
+    assert {diff.type for diff in section.types} == {'drawable', 'layout', 'string'}
+
+
+def test_format_default_config():
+    assert format_config(bytes(64), 0) == 'default'
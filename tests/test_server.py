@@ -0,0 +1,110 @@
+import json
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from apkcomparator import server
+from apkcomparator.apk_comparator import call_with_output
+from apkcomparator.server import (
+    STATUS_DONE, STATUS_FAILED, STATUS_TIMEOUT, ComparisonService, Job, create_server)
+
+SLEEP = [sys.executable, '-c', 'import time; time.sleep(60)']
+
+
+def _wait(job: Job, timeout: float = 20):
+    deadline = time.monotonic() + timeout
+    while not job.is_finished() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return job.status
+
+
+@pytest.fixture
+def service():
+    service = ComparisonService(workers=1, queue_size=4, job_timeout=60)
+    yield service
+    service.stop()
+
+
+@pytest.fixture
+def http_server(service):
+    instance = create_server(service, 'json', port=0)
+    thread = threading.Thread(target=instance.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://{}:{}'.format(*instance.server_address)
+    instance.shutdown()
+    instance.server_close()
+
+
+def test_job(service, apk_pair):
+    job = Job(apk_pair[0], apk_pair[1], ['plain-data', 'files'], 'json', 60)
+    assert service.submit(job)
+    assert _wait(job) == STATUS_DONE
+    report = json.loads(''.join(job.iter_output()))
+    assert report['plain_data']['curr']['file_size'] > report['plain_data']['prev']['file_size']
+
+
+def test_timed_out_job_kills_its_child_processes(service, apk_pair, monkeypatch):
+    generate_report = server.generate_report
+    calls = []
+
+    def slow_report(prev, curr, sections, executor):
+        # Only the first job starts a child process that outlives its timeout
+        calls.append(sections)
+        if len(calls) == 1:
+            executor.submit(call_with_output, SLEEP).result()
+        return generate_report(prev, curr, sections, executor)
+
+    monkeypatch.setattr(server, 'generate_report', slow_report)
+    timed_out = Job(apk_pair[0], apk_pair[1], ['plain-data'], 'json', 0.5)
+    next_job = Job(apk_pair[0], apk_pair[1], ['plain-data'], 'json', 60)
+    started = time.monotonic()
+    assert service.submit(timed_out) and service.submit(next_job)
+    # The worker takes the next job once the sleeping child is killed, not after a minute
+    assert _wait(next_job) == STATUS_DONE
+    assert time.monotonic() - started < 20
+    assert timed_out.status == STATUS_TIMEOUT
+
+
+def test_stuck_job_is_abandoned(service, apk_pair, monkeypatch):
+    release = threading.Event()
+    calls = []
+
+    def stuck_report(prev, curr, sections, executor):
+        calls.append(sections)
+        if len(calls) == 1:
+            release.wait(60)
+        raise RuntimeError('released')
+
+    monkeypatch.setattr(server, 'generate_report', stuck_report)
+    monkeypatch.setattr(server, 'ABANDON_TIMEOUT', 0.2)
+    stuck = Job(apk_pair[0], apk_pair[1], ['plain-data'], 'json', 0.2)
+    next_job = Job(apk_pair[0], apk_pair[1], ['plain-data'], 'json', 60)
+    assert service.submit(stuck) and service.submit(next_job)
+    assert _wait(next_job) == STATUS_FAILED
+    release.set()
+    assert stuck.status == STATUS_TIMEOUT
+
+
+def _post(url: str, document: dict) -> tuple[int, dict]:
+    request = urllib.request.Request(url + '/jobs', json.dumps(document).encode(), method='POST')
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+def test_http_api(http_server, apk_pair):
+    code, document = _post(http_server, {'prev': apk_pair[0], 'curr': '/missing.apk'})
+    assert code == 400
+    code, document = _post(http_server, {'prev': apk_pair[0], 'curr': apk_pair[1], 'sections': ['plain-data']})
+    assert code == 202
+    with urllib.request.urlopen('{}/jobs/{}/report'.format(http_server, document['id'])) as response:
+        report = json.load(response)
+    assert report['plain_data']['prev']['file_size'] > 0
+    with urllib.request.urlopen('{}/jobs/{}'.format(http_server, document['id'])) as response:
+        assert json.load(response)['status'] == STATUS_DONE
@@ -0,0 +1,71 @@
+import os.path
+
+import pytest
+
+from apkcomparator.apk_comparator import get_backend
+from apkcomparator.apk_reader import open_archive
+from apkcomparator.cache import cache_key, load_analysis
+from apkcomparator.data import Apk
+from apkcomparator.trend_db import (
+    connect, diff_builds, list_builds, load_entries, metric_series, path_series, record_apks, resolve_build)
+
+
+@pytest.fixture
+def connection(tmp_path):
+    connection = connect(str(tmp_path / 'trends.sqlite3'))
+    yield connection
+    connection.close()
+
+
+def test_record_apks(connection, apk_pair):
+    ids = record_apks(connection, [Apk(path) for path in apk_pair])
+    builds = list_builds(connection)
+    assert [build.id for build in builds] == ids
+    assert [build.version_code for build in builds] == [1, 2]
+    assert [build.package for build in builds] == ['com.example.benchmark'] * 2
+    assert [build.file_size for build in builds] == [os.path.getsize(path) for path in apk_pair]
+    # Only the analyses a build stores are run
+    analysis = load_analysis(cache_key(Apk(apk_pair[0]), get_backend()))
+    assert analysis.plain_data is not None and analysis.parsed_manifest is not None
+    assert analysis.dex_packages is None and analysis.duplicates is None
+
+
+def test_record_the_same_apk_twice(connection, apk_pair):
+    assert record_apks(connection, [Apk(apk_pair[0])]) == record_apks(connection, [Apk(apk_pair[0])])
+    assert len(list_builds(connection)) == 1
+
+
+def test_stored_entries(connection, apk_pair):
+    build_id, = record_apks(connection, [Apk(apk_pair[0])])
+    entries = load_entries(connection, build_id)
+    assert list(entries.path_ids) == sorted(entries.path_ids)
+    with open_archive(apk_pair[0]) as archive:
+        assert sum(entries.compressed_sizes) == sum(entry.compressed_size for entry in archive.entries.values())
+        assert len(entries.crcs) == len(archive.entries)
+
+
+def test_series(connection, apk_pair):
+    record_apks(connection, [Apk(path) for path in apk_pair])
+    file_sizes = [value for _, value in metric_series(connection, 'file_size')]
+    assert file_sizes == [os.path.getsize(path) for path in apk_pair]
+    with open_archive(apk_pair[1]) as archive:
+        size = archive.entries['resources.arsc'].compressed_size
+    assert [value for _, value in path_series(connection, 'resources.arsc')][1] == size
+    assert [value for _, value in path_series(connection, 'missing.txt')] == [0, 0]
+    with pytest.raises(RuntimeError):
+        list(metric_series(connection, 'unknown'))
+
+
+def test_diff_builds(connection, apk_pair):
+    record_apks(connection, [Apk(path) for path in apk_pair])
+    prev, curr = resolve_build(connection, '1'), resolve_build(connection, '2')
+    lines = {line.path: line for line in diff_builds(connection, prev, curr)}
+    with open_archive(apk_pair[0]) as lhs, open_archive(apk_pair[1]) as rhs:
+        changed = {name for name in lhs.entries.keys() | rhs.entries.keys()
+                   if name not in lhs.entries or name not in rhs.entries or
+                   lhs.entries[name].crc != rhs.entries[name].crc}
+        assert lines.keys() == changed
+        size = rhs.entries['resources.arsc'].compressed_size
+    assert lines['resources.arsc'].rhs_size == size
+    with pytest.raises(RuntimeError):
+        resolve_build(connection, '3')
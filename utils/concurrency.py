@@ -0,0 +1,46 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+DEFAULT_PARALLELISM = os.cpu_count() or 1
+
+_parallelism = DEFAULT_PARALLELISM
+_subprocess_slots = threading.BoundedSemaphore(_parallelism)
+_deadline = threading.local()
+
+
+def set_parallelism(parallelism: int):
+    global _parallelism, _subprocess_slots
+    if parallelism < 1:
+        raise ValueError('Parallelism must be positive, got {}'.format(parallelism))
+    _parallelism = parallelism
+    _subprocess_slots = threading.BoundedSemaphore(parallelism)
+
+
+def get_parallelism() -> int:
+    return _parallelism
+
+
+def subprocess_slot() -> threading.BoundedSemaphore:
+    # Shared by every pool, so nested fan-outs never run more child
+    # processes than the configured limit.
+    return _subprocess_slots
+
+
+def set_deadline(deadline: Optional[float]):
+    # A time.monotonic() value, child processes of this thread are killed once it passes
+    _deadline.value = deadline
+
+
+def remaining_time() -> Optional[float]:
+    deadline = getattr(_deadline, 'value', None)
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+def create_executor(name: str, deadline: Optional[float] = None) -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=_parallelism, thread_name_prefix=name, initializer=set_deadline,
+                              initargs=(deadline,))
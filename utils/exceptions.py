@@ -1,3 +1,18 @@
 class BadEnvironmentError(Exception):
     def __init__(self, message: str):
         super(BadEnvironmentError, self).__init__(message)
+
+
+class BadApkError(Exception):
+    def __init__(self, message: str):
+        super(BadApkError, self).__init__(message)
+
+
+class WorkerError(Exception):
+    def __init__(self, message: str):
+        super(WorkerError, self).__init__(message)
+
+
+class WorkerTimeoutError(WorkerError):
+    def __init__(self, message: str):
+        super(WorkerTimeoutError, self).__init__(message)
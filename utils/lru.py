@@ -0,0 +1,34 @@
+import collections
+import threading
+from typing import Hashable, Optional
+
+
+class LruCache(object):
+    # Thread-safe mapping of at most max_entries items, the least recently
+    # used are dropped first. Memoizes per-entry work in long-running processes.
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[object]:
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: object):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._items)
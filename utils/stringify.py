@@ -1,8 +1,15 @@
+def _fields(obj):
+    if hasattr(obj, '__dict__'):
+        return vars(obj).items()
+    return [(name, getattr(obj, name, None))
+            for cls in reversed(type(obj).__mro__) for name in getattr(cls, '__slots__', ())]
+
+
 def stringify(cls):
     def __str__(self):
         return '%s(%s)' % (
             type(self).__name__,
-            ', '.join('%s=%s' % item for item in vars(self).items())
+            ', '.join('%s=%s' % item for item in _fields(self))
         )
 
     cls.__str__ = __str__
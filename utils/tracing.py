@@ -0,0 +1,167 @@
+import collections
+import contextlib
+import cProfile
+import json
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+from typing import Callable, Iterator, Optional
+
+from utils.logger import log
+
+# Spans are only collected when a trace or profile file is configured, the
+# disabled span is a plain yield
+Span = collections.namedtuple('Span', ('name', 'category', 'start', 'duration', 'thread', 'args'))
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+_RSS_SCALE = 1 if sys.platform == 'darwin' else 1024
+
+_trace_file = None
+_profile_file = None
+_spans = []
+_profile_stats = None
+_profile_owner = None
+_lock = threading.Lock()
+_origin = time.perf_counter()
+
+
+def configure_tracing(trace_file: Optional[str] = None, profile_file: Optional[str] = None):
+    global _trace_file, _profile_file, _profile_stats
+    _trace_file = trace_file
+    _profile_file = profile_file
+    _profile_stats = None
+    _spans.clear()
+
+
+def is_tracing_enabled() -> bool:
+    return _trace_file is not None or _profile_file is not None
+
+
+def _children_usage() -> tuple[float, int]:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss * _RSS_SCALE
+
+
+def _start_profiler() -> Optional[cProfile.Profile]:
+    # One span is profiled at a time, nested and concurrent spans are not.
+    # Since Python 3.12 cProfile is a process wide sys.monitoring tool: a
+    # second one fails to start and one started by a worker thread would see
+    # the calls of every thread, so only the main thread profiles there.
+    global _profile_owner
+    if sys.version_info >= (3, 12) and threading.current_thread() is not threading.main_thread():
+        return None
+    with _lock:
+        if _profile_owner is not None:
+            return None
+        _profile_owner = threading.get_ident()
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # Another profiling tool, a debugger or an outer cProfile, is active
+        log().debug('Span is not profiled: {}'.format(e))
+        _stop_profiler(None)
+        return None
+    return profiler
+
+
+def _stop_profiler(profiler: Optional[cProfile.Profile]):
+    global _profile_owner
+    if profiler is not None:
+        profiler.disable()
+        _add_profile(profiler)
+    with _lock:
+        _profile_owner = None
+
+
+def _add_profile(profiler: cProfile.Profile):
+    global _profile_stats
+    with _lock:
+        if _profile_stats is None:
+            _profile_stats = pstats.Stats(profiler)
+        else:
+            _profile_stats.add(profiler)
+
+
+@contextlib.contextmanager
+def span(name: str, category: str, subprocess: bool = False, profile: bool = False, **args) -> Iterator[None]:
+    # Child usage is process wide: children reaped by other threads while the
+    # span is open are counted too, warm apkanalyzer workers are never reaped
+    if not is_tracing_enabled():
+        yield
+        return
+    profiler = _start_profiler() if profile and _profile_file else None
+    children = _children_usage() if subprocess else None
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        if profiler:
+            _stop_profiler(profiler)
+        if children:
+            cpu, max_rss = _children_usage()
+            args.update(child_cpu_time=round(cpu - children[0], 6), child_max_rss=max_rss)
+        with _lock:
+            _spans.append(Span(name, category, start - _origin, duration, threading.current_thread().name, args))
+
+
+def traced(function: Callable, name: str, category: str, **args) -> Callable:
+    def call(*call_args, **call_kwargs):
+        with span(name, category, profile=True, **args):
+            return function(*call_args, **call_kwargs)
+
+    return call
+
+
+def get_spans() -> list[Span]:
+    with _lock:
+        return sorted(_spans, key=lambda item: item.start)
+
+
+def chrome_trace(spans: list[Span]) -> dict:
+    # Complete ("X") events in microseconds, loadable by chrome://tracing and Perfetto
+    pid = os.getpid()
+    threads = {}
+    events = []
+    for item in spans:
+        tid = threads.setdefault(item.thread, len(threads) + 1)
+        events.append({'name': item.name, 'cat': item.category, 'ph': 'X', 'pid': pid, 'tid': tid,
+                       'ts': round(item.start * 1e6, 1), 'dur': round(item.duration * 1e6, 1), 'args': item.args})
+    events.extend({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread}}
+                  for thread, tid in threads.items())
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def iter_summary(spans: list[Span]) -> Iterator[str]:
+    # Spans nest, so totals of different rows overlap
+    rows = {}
+    for item in spans:
+        row = rows.setdefault(item.name, [0, 0.0, 0.0, 0.0, 0])
+        row[0] += 1
+        row[1] += item.duration
+        row[2] = max(row[2], item.duration)
+        row[3] += item.args.get('child_cpu_time', 0.0)
+        row[4] = max(row[4], item.args.get('child_max_rss', 0))
+    yield '{:<40}{:>8}{:>12}{:>12}{:>16}{:>16}'.format(
+        'span', 'count', 'total, ms', 'max, ms', 'child cpu, ms', 'child rss, MB')
+    for name, (count, total, longest, cpu, rss) in sorted(rows.items(), key=lambda item: -item[1][1]):
+        yield '{:<40}{:>8}{:>12.1f}{:>12.1f}{:>16.1f}{:>16.1f}'.format(
+            name[:39], count, total * 1000, longest * 1000, cpu * 1000, rss / (1 << 20))
+
+
+def finish_tracing():
+    if not is_tracing_enabled():
+        return
+    spans = get_spans()
+    log().info('Timings:\n{}'.format('\n'.join(iter_summary(spans))))
+    if _trace_file:
+        log().info('Saving trace to {}'.format(_trace_file))
+        with open(_trace_file, 'w') as stream:
+            json.dump(chrome_trace(spans), stream)
+    if _profile_file and _profile_stats is not None:
+        log().info('Saving profile to {}'.format(_profile_file))
+        _profile_stats.dump_stats(_profile_file)